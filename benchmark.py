@@ -0,0 +1,287 @@
+#!/usr/bin/python
+# Benchmark suite: runs every workload over every synthetic graph against the
+# basic_graph, fd_graph and rz_graph implementations, and reports throughput,
+# per-batch latency percentiles and peak memory as JSON. Results can be compared
+# against a stored baseline to catch performance regressions.
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import threading
+import time
+import traceback
+
+from graph import basic_graph, fd_graph, rz_graph
+from graph.generators import GENERATORS, WORKLOADS
+from graph.timer import percentile
+
+class Implementation:
+  """
+  Adapts one of the graph implementations to ('add'/'remove', edge list) batches.
+  Node and Edge objects are created outside of the timed section, and an edge that
+  is removed is always the same Edge object that was inserted.
+  """
+  module = None
+
+  def __init__(self):
+    self.nodes, self.edges = {}, {}
+
+  def prepare(self, op, pairs):
+    """
+    @param op: 'add' or 'remove'
+    @param pairs: a list of (u, v) integer pairs
+    @return the set of Edge objects of this implementation
+    """
+    edge_set = set()
+    for u, v in pairs:
+      if (u, v) not in self.edges:
+        self.edges[(u, v)] = self.module.Edge(self.node(u), self.node(v))
+      edge_set.add(self.edges[(u, v)])
+    return edge_set
+
+  def node(self, value):
+    if value not in self.nodes:
+      self.nodes[value] = self.module.Node(value)
+    return self.nodes[value]
+
+  def add_node(self, value):
+    """
+    Isolated nodes are only represented by fd_graph, so this is a no-op by default
+    """
+    pass
+
+  def remove_node(self, value, pairs):
+    """
+    Removes a node's edges as one batch by default
+    @param value: the node's value
+    @param pairs: the (u, v) integer pairs of its edges
+    """
+    if len(pairs) > 0:
+      self.apply('remove', self.prepare('remove', pairs))
+
+class Basic(Implementation):
+  """
+  Edges one at a time, then a full Tarjan after each batch
+  """
+  module = basic_graph
+
+  def __init__(self):
+    Implementation.__init__(self)
+    self.graph = basic_graph.Graph()
+
+  def apply(self, op, edge_set):
+    if op == 'add':
+      self.graph.add_edges(edge_set)
+    else:
+      self.graph.remove_edges(edge_set)
+    self.graph.compute_scc()
+
+  def same_component(self, u, v):
+    labels = self.graph.inverse_components
+    return u in labels and v in labels and labels[u] == labels[v]
+
+  def component_of(self, u):
+    return self.graph.inverse_components.get(u)
+
+class FullyDynamic(Implementation):
+  """
+  fd_graph's optimized bulk insertions/deletions
+  """
+  module = fd_graph
+
+  def __init__(self):
+    Implementation.__init__(self)
+    self.graph = fd_graph.Graph()
+
+  def apply(self, op, edge_set):
+    if op == 'add':
+      self.graph.optimized_add_edges(edge_set)
+    else:
+      self.graph.optimized_remove_edges(edge_set)
+
+  def same_component(self, u, v):
+    return self.graph.same_component(u, v)
+
+  def component_of(self, u):
+    return self.graph.component_of(u)
+
+  def add_node(self, value):
+    self.graph.add_node(self.node(value))
+
+  def remove_node(self, value, pairs):
+    self.graph.remove_node(self.node(value))
+
+class Versioned(Implementation):
+  """
+  rz_graph's Roditty-Zwick versioned graph (one version per insertion batch)
+  """
+  module = rz_graph
+
+  def __init__(self):
+    Implementation.__init__(self)
+    self.graph = rz_graph.DynamicGraph()
+
+  def apply(self, op, edge_set):
+    if op == 'add':
+      self.graph.insert(edge_set)
+    else:
+      self.graph.delete(edge_set)
+
+  def same_component(self, u, v):
+    graph = self.graph
+    return u in graph.parent and v in graph.parent and graph.query(u, v, graph.t)
+
+  def component_of(self, u):
+    """
+    The forest has no component numbers; this only checks that u is in the graph
+    """
+    return u in self.graph.parent and self.graph.query(u, u, self.graph.t)
+
+IMPLEMENTATIONS = {
+  'basic': Basic,
+  'fd': FullyDynamic,
+  'rz': Versioned,
+}
+
+def run_case(impl, generator, workload, nodes, batch_size, seed):
+  """
+  Runs one (implementation, graph, workload) case in the current process
+  @return a result dictionary
+  """
+  edges = GENERATORS[generator](nodes, seed)
+  batches = WORKLOADS[workload](edges, batch_size, seed)
+  adapter = IMPLEMENTATIONS[impl]()
+  result = {
+    'impl': impl, 'generator': generator, 'workload': workload,
+    'nodes': nodes, 'edges': len(edges), 'batches': len(batches),
+  }
+
+  rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  latencies, applied, total = [], 0, 0.0
+  for op, pairs in batches:
+    edge_set = adapter.prepare(op, pairs)
+    start = time.time()
+    adapter.apply(op, edge_set)
+    elapsed = time.time() - start
+    latencies.append(elapsed)
+    total += elapsed
+    applied += len(pairs)
+  latencies.sort()
+
+  result.update({
+    'seconds': total,
+    'edges_per_second': applied / total if total > 0 else 0.0,
+    'p50_ms': percentile(latencies, 50) * 1000,
+    'p99_ms': percentile(latencies, 99) * 1000,
+    'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before,
+  })
+  return result
+
+def run_isolated(args, timeout):
+  """
+  Runs a case in a fresh child process, so peak memory is measured per case and
+  a crash or a timeout only fails that case. The traversals are recursive, so
+  the case runs on a thread with a large stack.
+  @return a result dictionary, with an 'error' entry if the case failed
+  """
+  queue = multiprocessing.Queue()
+
+  def child():
+    sys.setrecursionlimit(1 << 20)
+    threading.stack_size(512 * 1024 * 1024)
+    def work():
+      try:
+        queue.put(run_case(*args))
+      except Exception:
+        queue.put({ 'error': traceback.format_exc().strip().splitlines()[-1] })
+    thread = threading.Thread(target=work)
+    thread.start()
+    thread.join()
+
+  process = multiprocessing.Process(target=child)
+  process.start()
+  process.join(timeout)
+  if process.is_alive():
+    process.terminate()
+    process.join()
+    result = { 'error': 'timeout after %s s' % timeout }
+  elif queue.empty():
+    result = { 'error': 'exited with code %s' % process.exitcode }
+  else:
+    result = queue.get()
+  if 'error' in result:
+    impl, generator, workload, nodes = args[:4]
+    result.update({ 'impl': impl, 'generator': generator, 'workload': workload, 'nodes': nodes })
+  return result
+
+def case_key(result):
+  return '%s/%s/%s/%s' % (result['impl'], result['generator'], result['workload'], result['nodes'])
+
+def compare(results, baseline, tolerance):
+  """
+  @param results: the results of this run
+  @param baseline: the results of a stored run
+  @param tolerance: allowed relative slowdown, e.g. 0.2 for 20%
+  @return a list of regression descriptions
+  """
+  previous = dict((case_key(result), result) for result in baseline['results'] if 'error' not in result)
+  regressions = []
+  for result in results:
+    key = case_key(result)
+    if key not in previous:
+      continue
+    if 'error' in result:
+      regressions.append('%s: %s' % (key, result['error']))
+      continue
+    old = previous[key]
+    if result['edges_per_second'] < old['edges_per_second'] * (1 - tolerance):
+      regressions.append('%s: throughput %.0f -> %.0f edges/s' % (key, old['edges_per_second'], result['edges_per_second']))
+    if result['p99_ms'] > old['p99_ms'] * (1 + tolerance) and result['p99_ms'] - old['p99_ms'] > 1.0:
+      regressions.append('%s: p99 %.2f -> %.2f ms' % (key, old['p99_ms'], result['p99_ms']))
+  return regressions
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark the graph implementations')
+  parser.add_argument('--impls', default='basic,fd,rz', help='comma-separated subset of %s' % ','.join(sorted(IMPLEMENTATIONS)))
+  parser.add_argument('--generators', default=','.join(sorted(GENERATORS)))
+  parser.add_argument('--workloads', default=','.join(sorted(WORKLOADS)))
+  parser.add_argument('--nodes', type=int, default=1000)
+  parser.add_argument('--batch', type=int, default=64, help='edges per batch')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--timeout', type=float, default=300.0, help='seconds allowed per case')
+  parser.add_argument('--output', help='write the results as JSON to this file')
+  parser.add_argument('--baseline', help='JSON results of a previous run to compare against')
+  parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+  args = parser.parse_args()
+
+  results = []
+  for impl in args.impls.split(','):
+    for generator in args.generators.split(','):
+      for workload in args.workloads.split(','):
+        result = run_isolated((impl, generator, workload, args.nodes, args.batch, args.seed), args.timeout)
+        results.append(result)
+        if 'error' in result:
+          print "%-45s ERROR %s" % (case_key(result), result['error'])
+        else:
+          print "%-45s %10.0f edges/s  p50 %9.3f ms  p99 %9.3f ms  %8d KB" % \
+            (case_key(result), result['edges_per_second'], result['p50_ms'], result['p99_ms'], result['peak_rss_kb'])
+
+  report = {
+    'meta': { 'python': sys.version.split()[0], 'time': time.time(), 'args': vars(args) },
+    'results': results,
+  }
+  if args.output:
+    with open(args.output, 'w') as output:
+      json.dump(report, output, indent=2, sort_keys=True)
+
+  if args.baseline:
+    with open(args.baseline) as baseline:
+      regressions = compare(results, json.load(baseline), args.tolerance)
+    for regression in regressions:
+      print "REGRESSION %s" % regression
+    if len(regressions) > 0:
+      sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -1,48 +1,24 @@
 #!/usr/bin/python
 import pydot
+from graph import dot
 from graph import fd_graph as LB
-import random
 
-def hex_color():
-  r = lambda: random.randint(0,255)
-  return '#%02X%02X%02X' % (r(),r(),r())
-
-# Draw the graph and generate
+# Draw the graph and generate; for large graphs, see graph/dot.py
 def draw_graph(G, name='output_graph'):
   graph = pydot.Dot('Forest')
-  scc_colors = {}
   visited_nodes = {}
 
-  for node in G.edges:
-    col = hex_color()
-    while col in scc_colors:
-      col = hex_color()
-    scc = G.inverse_components[node]
-    if scc in scc_colors:
-      col = scc_colors[scc]
-    scc_colors[scc] = col
-
+  def pydot_node(node):
     if node not in visited_nodes:
-      pydot_snode = pydot.Node(str(node), style="filled", fillcolor=col)
-      visited_nodes[node] = pydot_snode
-      graph.add_node(pydot_snode)
+      col = dot.color(G.inverse_components[node])
+      visited_nodes[node] = pydot.Node(str(node), style="filled", fillcolor=col)
+      graph.add_node(visited_nodes[node])
+    return visited_nodes[node]
 
+  for node in G.edges:
+    pydot_snode = pydot_node(node)
     for e_node in G.edges[node]:
-      if e_node not in visited_nodes:
-        col2 = hex_color()
-        while col in scc_colors:
-          col2 = hex_color()
-        scc = G.inverse_components[e_node]
-       
-        if scc in scc_colors:
-          col2 = scc_colors[scc]
-        scc_colors[scc] = col2
-
-        pydot_enode = pydot.Node(str(e_node), style="filled", fillcolor=col2)
-        edge = pydot.Edge(pydot_snode, pydot_enode)
-      else:
-        edge = pydot.Edge(pydot_snode, visited_nodes[e_node])
-      graph.add_edge(edge)
+      graph.add_edge(pydot.Edge(pydot_snode, pydot_node(e_node)))
   graph.write_png(name + '.png')
 
 def print_edges(edges):
@@ -0,0 +1,262 @@
+#!/usr/bin/python
+# Differential fuzzer for fd_graph: runs random interleaved insertion/deletion
+# batches and node additions/removals through the optimized (incremental) paths,
+# and after every batch checks components, inverse_components, intra_edges,
+# inter_edges and the node registry against a full compute_scc of the same graph.
+# Batches include self-loops. Also reports how much faster each incremental batch
+# was than the full recompute, so an optimization can be judged on both
+# correctness and measured gain. With --lazy, the same stream also runs through a
+# lazy_graph.LazyGraph, whose on-demand components are checked for random nodes.
+# With --wal, streams run through a wal.DurableGraph instead, with failing batches
+# mixed in, and the graph is reopened from its log and checkpoints along the way.
+import argparse
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from graph import fd_graph
+from graph import lazy_graph
+from graph import wal
+from graph.timer import percentile
+
+def partition(components):
+  return set(frozenset(nodes) for nodes in components.values() if len(nodes) > 0)
+
+def edge_map(edges):
+  return dict((s_node, set(e_nodes)) for s_node, e_nodes in edges.items() if len(e_nodes) > 0)
+
+def check(graph):
+  """
+  Compares the maintained structures of a graph to a fresh compute over its edges
+  @param graph: a fd_graph.Graph, settled if in DEFERRED mode
+  @return a list of mismatch descriptions, and the seconds the full compute took
+  """
+  expected = fd_graph.Graph()
+  for s_node, e_nodes in graph.edges.items():
+    for e_node in e_nodes:
+      expected.add_edge(fd_graph.Edge(s_node, e_node))
+  for node in graph.explicit_nodes:
+    expected.add_node(node)
+  start = time.time()
+  expected.compute_scc()
+  seconds = time.time() - start
+
+  errors = []
+  if partition(graph.components) != partition(expected.components):
+    errors.append('components differ')
+  if set(graph.inverse_components) != set(expected.inverse_components):
+    errors.append('inverse_components covers %d nodes instead of %d' % \
+      (len(graph.inverse_components), len(expected.inverse_components)))
+  for scc, nodes in graph.components.items():
+    if len(nodes) == 0:
+      errors.append('component %s is empty' % scc)
+    if scc >= graph.scc_num:
+      errors.append('component %s is not below scc_num %s' % (scc, graph.scc_num))
+    for node in nodes:
+      if graph.inverse_components.get(node) != scc:
+        errors.append('%s is in component %s but labeled %s' % (node, scc, graph.inverse_components.get(node)))
+  if edge_map(graph.intra_edges) != edge_map(expected.intra_edges):
+    errors.append('intra_edges differ')
+  if edge_map(graph.inter_edges) != edge_map(expected.inter_edges):
+    errors.append('inter_edges differ')
+  if graph.degrees != expected.degrees:
+    errors.append('degrees differ')
+  if graph.reverse_edges and edge_map(graph.rev_edges) != edge_map(expected.rev_edges):
+    errors.append('rev_edges differ')
+  return errors, seconds
+
+def check_lazy(lazy, graph, rand, queries):
+  """
+  Compares the on-demand components of a lazy graph to the checked components of a graph
+  @param lazy: a lazy_graph.LazyGraph that went through the same updates as graph
+  @param graph: a fd_graph.Graph, already checked against a full compute
+  @param queries: the number of random nodes to query
+  @return a list of mismatch descriptions
+  """
+  errors = []
+  if set(lazy.get_nodes()) != set(graph.get_nodes()):
+    errors.append('lazy graph has %d nodes instead of %d' % (len(lazy.get_nodes()), len(graph.get_nodes())))
+  nodes = list(graph.get_nodes())
+  for node in rand.sample(nodes, min(queries, len(nodes))):
+    if lazy.component(node) != graph.components[graph.inverse_components[node]]:
+      errors.append('lazy component of %s differs' % node)
+  return errors
+
+def fuzz(seed, steps, nodes, batch, mode, reverse_edges=True, compressed_inter_edges=None, lazy_queries=None):
+  """
+  Runs one random stream of batches
+  @return the per-batch speedups (full compute time / incremental time)
+  @raise AssertionError describing the first mismatch
+  """
+  rand = random.Random(seed)
+  graph = fd_graph.Graph(mode=mode, reverse_edges=reverse_edges, compressed_inter_edges=compressed_inter_edges)
+  lazy = lazy_graph.LazyGraph() if lazy_queries is not None else None
+  node_list = [fd_graph.Node(i) for i in xrange(nodes)]
+  edges = {}                # Maps (u, v) to the Edge object that was inserted
+  present = []
+  speedups = []
+  for step in xrange(steps):
+    if rand.random() < 0.1:
+      node = node_list[rand.randrange(nodes)]
+      if rand.random() < 0.5:
+        op, pairs = 'add_node', [node.value]
+      else:
+        op, pairs = 'remove_node', [pair for pair in present if node.value in pair]
+        present = [pair for pair in present if node.value not in pair]
+    elif len(present) == 0 or rand.random() < 0.55:
+      op, pairs = 'add', set()
+      for i in xrange(rand.randint(1, batch)):
+        u, v = rand.randrange(nodes), rand.randrange(nodes)
+        if (u, v) not in edges:
+          pairs.add((u, v))
+      for u, v in pairs:
+        edges[(u, v)] = fd_graph.Edge(node_list[u], node_list[v])
+      present.extend(pairs)
+    else:
+      rand.shuffle(present)
+      count = rand.randint(1, min(batch, len(present)))
+      op, pairs, present = 'remove', present[:count], present[count:]
+    edge_set = set(edges[pair] for pair in pairs) if op != 'add_node' else set()
+    if op == 'remove' or op == 'remove_node':
+      for pair in pairs:
+        del edges[pair]
+
+    start = time.time()
+    if op == 'add':
+      graph.optimized_add_edges(edge_set)
+    elif op == 'remove':
+      graph.optimized_remove_edges(edge_set)
+    elif op == 'add_node':
+      graph.add_node(node)
+    else:
+      graph.remove_node(node)
+    graph.settle()
+    seconds = time.time() - start
+    if lazy is not None:
+      if op == 'add':
+        lazy.optimized_add_edges(edge_set)
+      elif op == 'remove':
+        lazy.optimized_remove_edges(edge_set)
+      elif op == 'add_node':
+        lazy.add_node(node)
+      else:
+        lazy.remove_node(node)
+
+    errors, full_seconds = check(graph)
+    if len(errors) == 0 and lazy is not None:
+      errors = check_lazy(lazy, graph, rand, lazy_queries)
+    if len(errors) > 0:
+      raise AssertionError('seed %d, step %d (%s %s): %s' % \
+        (seed, step, op, sorted(pairs), '; '.join(errors)))
+    if seconds > 0:
+      speedups.append(full_seconds / seconds)
+  return speedups
+
+def value_partition(graph):
+  return set(frozenset(node.value for node in nodes) for nodes in graph.components.values() if len(nodes) > 0)
+
+def fuzz_recovery(seed, steps, nodes, batch, directory):
+  """
+  Runs one random stream of batches through a durable graph, some of which fail,
+  reopening it every few batches and checking it against a graph with the same edges
+  @raise AssertionError describing the first mismatch
+  """
+  rand = random.Random(seed)
+  durable = wal.DurableGraph(directory, checkpoint_interval=rand.randint(2, 10))
+  node_of = {}              # Maps value to the durable graph's Node
+  present = set()           # The (u, v) pairs of the edges in the graph
+  def edge(u, v):
+    return fd_graph.Edge(node_of.setdefault(u, fd_graph.Node(u)), node_of.setdefault(v, fd_graph.Node(v)))
+  for step in xrange(steps):
+    if rand.random() < 0.2:
+      # Removing an edge of nodes that are not in the graph raises, and must leave no trace
+      op, pairs = 'fail', [(rand.randrange(nodes), nodes + step)]
+      try:
+        durable.optimized_remove_edges(set(edge(u, v) for u, v in pairs + sorted(present)[:1]))
+      except KeyError:
+        pass
+      else:
+        raise AssertionError('seed %d, step %d: the failing batch did not raise' % (seed, step))
+    elif len(present) == 0 or rand.random() < 0.55:
+      op, pairs = 'add', set()
+      for i in xrange(rand.randint(1, batch)):
+        pairs.add((rand.randrange(nodes), rand.randrange(nodes)))
+      durable.optimized_add_edges(set(edge(u, v) for u, v in pairs))
+      present.update(pairs)
+    else:
+      op, pairs = 'remove', rand.sample(sorted(present), rand.randint(1, min(batch, len(present))))
+      durable.optimized_remove_edges(set(edge(u, v) for u, v in pairs))
+      present.difference_update(pairs)
+    if rand.random() < 0.3:
+      durable.close()
+      durable = wal.DurableGraph(directory, checkpoint_interval=rand.randint(2, 10))
+      node_of = dict((node.value, node) for node in durable.nodes.itervalues())
+
+    values = dict((value, fd_graph.Node(value)) for pair in present for value in pair)
+    expected = fd_graph.Graph(set(fd_graph.Edge(values[u], values[v]) for u, v in present))
+    actual = set((s_node.value, e_node.value) for s_node, e_nodes in durable.graph.edges.items() for e_node in e_nodes)
+    if actual != present or value_partition(durable.graph) != value_partition(expected):
+      raise AssertionError('seed %d, step %d (%s %s): durable graph differs' % (seed, step, op, sorted(pairs)))
+  durable.close()
+
+def main():
+  parser = argparse.ArgumentParser(description='Fuzz the fd_graph incremental maintenance against full recomputes')
+  parser.add_argument('--seeds', type=int, default=100, help='number of random streams')
+  parser.add_argument('--first-seed', type=int, default=0)
+  parser.add_argument('--steps', type=int, default=50, help='batches per stream')
+  parser.add_argument('--nodes', type=int, default=30)
+  parser.add_argument('--batch', type=int, default=8, help='maximum edges per batch')
+  parser.add_argument('--mode', choices=[fd_graph.EAGER, fd_graph.DEFERRED], default=fd_graph.EAGER)
+  parser.add_argument('--no-reverse-edges', action='store_true', help='do not maintain rev_edges')
+  parser.add_argument('--compressed-inter-edges', type=int, default=None, metavar='N',
+                      help='store inter_edges compressed, with N blocks decoded at a time')
+  parser.add_argument('--lazy', type=int, default=None, metavar='N',
+                      help='also check a LazyGraph, querying N random nodes after every batch')
+  parser.add_argument('--wal', action='store_true', help='check recovery of a DurableGraph instead')
+  args = parser.parse_args()
+
+  # The traversals are recursive, so fuzz on a thread with a large stack
+  sys.setrecursionlimit(1 << 20)
+  threading.stack_size(512 * 1024 * 1024)
+  speedups, failures = [], []
+  batches = [0]               # Batches run, in a list so the worker can update it
+
+  def work():
+    for seed in xrange(args.first_seed, args.first_seed + args.seeds):
+      try:
+        if args.wal:
+          directory = tempfile.mkdtemp(prefix='fuzz-wal-')
+          try:
+            fuzz_recovery(seed, args.steps, args.nodes, args.batch, directory)
+            batches[0] += args.steps
+          finally:
+            shutil.rmtree(directory)
+          continue
+        stream = fuzz(seed, args.steps, args.nodes, args.batch, args.mode, not args.no_reverse_edges, \
+          args.compressed_inter_edges, args.lazy)
+        speedups.extend(stream)
+        batches[0] += len(stream)
+      except AssertionError as e:
+        failures.append(str(e))
+        print "FAIL seed %d: %s" % (seed, failures[-1])
+      except Exception:
+        failures.append(traceback.format_exc().strip().splitlines()[-1])
+        print "FAIL seed %d: %s" % (seed, failures[-1])
+  thread = threading.Thread(target=work)
+  thread.start()
+  thread.join()
+
+  speedups.sort()
+  print "%d streams, %d batches, %d failures" % (args.seeds, batches[0], len(failures))
+  if len(speedups) > 0:
+    print "speedup over full recompute: p50 %.2fx  p10 %.2fx  p90 %.2fx" % \
+      (percentile(speedups, 50), percentile(speedups, 10), percentile(speedups, 90))
+  if len(failures) > 0:
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -1,5 +1,6 @@
 # See https://wiki.python.org/moin/TimeComplexity for running times
 ### BASIC GRAPH ###
+from timer import Timer
 
 class Node:
   """
@@ -97,7 +98,8 @@ class Graph:
           del self.rev_edges[s_node]
 
       # If there are no outgoing edges from the end node, del it
-      if len(self.rev_edges[e_node]) == 0:
+      # (a self-loop may have deleted it above already)
+      if e_node in self.rev_edges and len(self.rev_edges[e_node]) == 0:
         del self.rev_edges[e_node]
 
         # If there are no incoming edges to the end node, del it
@@ -202,12 +204,19 @@ edge_set6 = set([e10, e11])
 edge_sets = [edge_set1, edge_set2, edge_set3, edge_set4, edge_set5, edge_set6]
 
 def benchmark(edge_set_list):
+  """
+  Times the insertion of each edge; see benchmark.py for the full suite
+  @param edge_set_list: a list of sets of edges
+  @return the elapsed time in seconds
+  """
   with Timer() as t:
     G1 = Graph()
     for edge_set in edge_set_list:
       for edge in edge_set:
         G1.add_edge(edge)
   fsecs = float(t.secs)
+  print "Insertion completed in %s s" % fsecs
+  return fsecs
 
 def test_graph():
   a = Node('A')
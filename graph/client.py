@@ -0,0 +1,75 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### CLIENT LIBRARY, for the query/update server in server.py ###
+import json
+import socket
+
+class ServerError(Exception):
+  """
+  Raised when the server fails to answer a call
+  """
+  pass
+
+class Client:
+  """
+  A blocking connection to a GraphServer. Not thread-safe: use one Client per thread.
+  """
+  def __init__(self, address):
+    """
+    @param address: a Unix socket path, or a (host, port) tuple for TCP
+    """
+    if isinstance(address, tuple):
+      self.sock = socket.create_connection(address)
+      self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    else:
+      self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      self.sock.connect(address)
+    self.rfile = self.sock.makefile('rb')
+
+  def insert(self, edges):
+    """
+    @param edges: a list of (u, v) node value pairs to insert
+    @return the snapshot version that first reflects the insertion
+    """
+    return self.__call('insert', [list(edge) for edge in edges])
+
+  def delete(self, edges):
+    """
+    @param edges: a list of (u, v) node value pairs to delete
+    @return the snapshot version that first reflects the deletion
+    """
+    return self.__call('delete', [list(edge) for edge in edges])
+
+  def same_component(self, u, v):
+    """
+    @param u, v: two node values
+    @return True if u, v are in the same SCC
+    """
+    return self.__call('same_component', u, v)
+
+  def component_of(self, u):
+    """
+    @param u: a node value
+    @return the component number of u, or None if u is not in the graph
+    """
+    return self.__call('component_of', u)
+
+  def reachable(self, u, v):
+    """
+    @param u, v: two node values
+    @return True if there is a path from u to v
+    """
+    return self.__call('reachable', u, v)
+
+  def close(self):
+    self.rfile.close()
+    self.sock.close()
+
+  def __call(self, op, *args):
+    self.sock.sendall(json.dumps({ 'op': op, 'args': args }) + '\n')
+    line = self.rfile.readline()
+    if line == '':
+      raise ServerError('Connection closed by server')
+    response = json.loads(line)
+    if 'error' in response:
+      raise ServerError(response['error'])
+    return response['result']
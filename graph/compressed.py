@@ -0,0 +1,159 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### COMPRESSED ADJACENCY, for cold neighbor sets kept in little memory ###
+# Maps each node to its set of neighbors, like the dictionaries of sets of
+# fd_graph, but stores each set as a block of bytes: the ids of the neighbors,
+# sorted, as varint-encoded deltas (7 bits per byte, the high bit set on all but
+# the last byte of a number). A block costs a few bytes per neighbor instead of a
+# set entry; the recently used sets are kept decoded in a small cache, and are
+# the sets the callers mutate in place. The cache approximates an LRU with the
+# CLOCK policy: a hit only marks the set as referenced, and a referenced set gets
+# a second chance when it comes up for eviction, so hits cost no reordering. A
+# set is encoded again when it leaves the cache, so a set must not be changed
+# through a reference kept across other accesses (reading it, as the traversals
+# do, is fine).
+import collections
+
+class CompressedAdjacency(collections.MutableMapping):
+  """
+  A mapping of node to set of nodes, decoding a node's set on access.
+  Accessing a decoded set is O(1); decoding or encoding one is O(its size log its size).
+  """
+  def __init__(self, capacity=64, items=()):
+    """
+    @param capacity: the number of decoded sets kept in the cache, at least 1
+    @param items: [optional] (node, set of nodes) pairs to start with
+    """
+    self.capacity = max(1, capacity)
+    self.blocks = {}          # Maps node to the encoded block of its neighbors
+    self.decoded = collections.OrderedDict()   # Maps node to its decoded set, next to evict first
+    self.referenced = set()   # Decoded nodes accessed since they were decoded or given a second chance
+    self.ids = {}             # Maps node to the id used in the blocks
+    self.nodes = []           # The nodes by id
+    self.compact_at = 1024    # Size of the id table that triggers the next compaction
+    for node, e_nodes in items:
+      self.blocks[node] = self.__encode(e_nodes)
+
+  def __len__(self):
+    return len(self.blocks) + len(self.decoded)
+
+  def __contains__(self, node):
+    return node in self.decoded or node in self.blocks
+
+  def __iter__(self):
+    for node in self.decoded.keys():
+      yield node
+    for node in self.blocks.keys():
+      yield node
+
+  def __getitem__(self, node):
+    """
+    @return the live set of neighbors of the node, marked as referenced
+    """
+    e_nodes = self.decoded.get(node)
+    if e_nodes is not None:
+      self.referenced.add(node)
+      return e_nodes
+    e_nodes = self.__decode(self.blocks.pop(node))
+    self.__make_room()
+    self.decoded[node] = e_nodes
+    return e_nodes
+
+  def __setitem__(self, node, e_nodes):
+    if node in self.decoded:
+      self.referenced.add(node)
+    else:
+      self.blocks.pop(node, None)
+      self.__make_room()
+    self.decoded[node] = e_nodes
+
+  def __delitem__(self, node):
+    if node in self.decoded:
+      del self.decoded[node]
+      self.referenced.discard(node)
+    else:
+      del self.blocks[node]
+
+  def iteritems(self):
+    """
+    Iterates without passing the sets through the cache; the sets of the encoded
+    blocks are fresh copies, so changing them has no effect
+    """
+    for node, e_nodes in self.decoded.items():
+      yield node, e_nodes
+    for node, block in self.blocks.items():
+      yield node, self.__decode(block)
+
+  def itervalues(self):
+    for node, e_nodes in self.iteritems():
+      yield e_nodes
+
+  def items(self):
+    return list(self.iteritems())
+
+  def values(self):
+    return list(self.itervalues())
+
+  def encoded_bytes(self):
+    """
+    @return the number of bytes in the encoded blocks
+    """
+    return sum(len(block) for block in self.blocks.itervalues())
+
+  #######################
+  ### PRIVATE METHODS ###
+  #######################
+
+  def __make_room(self):
+    """
+    Encodes decoded sets until there is room for one more, passing over (and
+    unmarking) the referenced ones. O(capacity) passes over at most
+    """
+    while len(self.decoded) >= self.capacity:
+      node, e_nodes = self.decoded.popitem(last=False)
+      if node in self.referenced:
+        self.referenced.remove(node)
+        self.decoded[node] = e_nodes
+      else:
+        self.blocks[node] = self.__encode(e_nodes)
+
+  def __encode(self, e_nodes):
+    if len(self.nodes) + len(e_nodes) > self.compact_at:
+      self.__compact()
+    ids = self.ids
+    for e_node in e_nodes:
+      if e_node not in ids:
+        ids[e_node] = len(self.nodes)
+        self.nodes.append(e_node)
+    block, previous = bytearray(), 0
+    for node_id in sorted(ids[e_node] for e_node in e_nodes):
+      delta, previous = node_id - previous, node_id
+      while delta >= 0x80:
+        block.append((delta & 0x7f) | 0x80)
+        delta >>= 7
+      block.append(delta)
+    return str(block)
+
+  def __decode(self, block):
+    nodes, e_nodes = self.nodes, set()
+    node_id, delta, shift = 0, 0, 0
+    for byte in bytearray(block):
+      delta |= (byte & 0x7f) << shift
+      if byte & 0x80:
+        shift += 7
+      else:
+        node_id += delta
+        e_nodes.add(nodes[node_id])
+        delta, shift = 0, 0
+    return e_nodes
+
+  def __compact(self):
+    """
+    Renumbers the nodes still referenced by a block, dropping the others from the
+    id table. O(encoded neighbors) time, amortized over the ids handed out since
+    the last compaction
+    """
+    sets = dict((node, self.__decode(block)) for node, block in self.blocks.iteritems())
+    self.ids, self.nodes = {}, []
+    self.compact_at = max(1024, 2 * sum(len(e_nodes) for e_nodes in sets.itervalues()))
+    for node, e_nodes in sets.iteritems():
+      self.blocks[node] = self.__encode(e_nodes)
@@ -0,0 +1,159 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### DOT OUTPUT, for visualizing large graphs through their condensation ###
+# DOT text is written straight to a file (render it with e.g. `dot -Tsvg`), so no
+# object is built per node or edge. The condensation has one node per component,
+# sized by its number of nodes, and one edge per pair of components joined by
+# inter-SCC edges, labeled with their number. Large graphs are viewed through the
+# top-k largest components or a sample of them, and any one component can be
+# expanded to show its nodes and intra-SCC edges.
+import colorsys
+import math
+import random
+import zlib
+
+GOLDEN_RATIO = 0.618033988749895
+
+def color(scc):
+  """
+  A deterministic color per component: the hues of consecutive component numbers
+  are spread by the golden ratio, so neighbors never look alike. O(1) time
+  @param scc: a component number (or any value, hashed with crc32)
+  @return a '#RRGGBB' string
+  """
+  key = scc if isinstance(scc, (int, long)) else zlib.crc32(str(scc))
+  hue = (key * GOLDEN_RATIO) % 1.0
+  lightness = (0.55, 0.7, 0.85)[key % 3]
+  r, g, b = colorsys.hls_to_rgb(hue, lightness, 0.65)
+  return '#%02X%02X%02X' % (int(r * 255), int(g * 255), int(b * 255))
+
+def quote(text):
+  """
+  @return text as a quoted DOT string
+  """
+  return '"%s"' % str(text).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def select_components(graph, top=None, sample=None, seed=0):
+  """
+  @param graph: a fd_graph.Graph
+  @param top: [optional] keep the top largest components
+  @param sample: [optional] keep a random sample of this many components
+  @param seed: the seed of the sample
+  @return the set of selected components, or None for all of them
+  """
+  if top is None and sample is None:
+    return None
+  sccs = graph.components.keys()
+  if top is not None:
+    sccs = sorted(sccs, key=lambda scc: (-len(graph.components[scc]), scc))[:top]
+  if sample is not None and sample < len(sccs):
+    sccs = random.Random(seed).sample(sorted(sccs), sample)
+  return set(sccs)
+
+def condensation_edges(graph, selected=None):
+  """
+  O(number of inter-SCC edges) time
+  @param graph: a fd_graph.Graph
+  @param selected: [optional] only count the edges between these components
+  @return a dictionary mapping (s_scc, e_scc) to the number of edges from s_scc to e_scc
+  """
+  inverse_components = graph.inverse_components
+  counts = {}
+  for s_node, e_nodes in graph.inter_edges.iteritems():
+    s_scc = inverse_components.get(s_node)
+    if s_scc is None or (selected is not None and s_scc not in selected):
+      continue
+    for e_node in e_nodes:
+      e_scc = inverse_components.get(e_node)
+      if e_scc is None or e_scc == s_scc or (selected is not None and e_scc not in selected):
+        continue
+      counts[(s_scc, e_scc)] = counts.get((s_scc, e_scc), 0) + 1
+  return counts
+
+def write_condensation(graph, path, top=None, sample=None, seed=0, name='Condensation'):
+  """
+  Writes the condensation DAG. O(|V| + inter-SCC edges) time, O(components shown) memory
+  for the nodes plus one counter per pair of joined components
+  @param graph: a fd_graph.Graph
+  @param path: the DOT file to create
+  @param top, sample, seed: see select_components
+  @return the number of components written
+  """
+  selected = select_components(graph, top, sample, seed)
+  sccs = graph.components.keys() if selected is None else selected
+  largest = max([len(graph.components[scc]) for scc in sccs] or [1])
+  with open(path, 'w') as dot_file:
+    dot_file.write('digraph %s {\n' % quote(name))
+    dot_file.write('  node [shape=circle, style=filled, fixedsize=true, fontsize=10];\n')
+    for scc in sorted(sccs):
+      size = len(graph.components[scc])
+      # Areas proportional to the number of nodes, between 0.3 and 3 inches wide
+      width = 0.3 + 2.7 * math.sqrt(float(size) / largest)
+      dot_file.write('  c%d [label=%s, width=%.2f, fillcolor=%s];\n' % \
+        (scc, quote('%s\n(%d)' % (scc, size)), width, quote(color(scc))))
+    for (s_scc, e_scc), count in sorted(condensation_edges(graph, selected).iteritems()):
+      label = ', label="%d"' % count if count > 1 else ''
+      dot_file.write('  c%d -> c%d [penwidth=%.1f%s];\n' % (s_scc, e_scc, 1 + math.log(count, 2), label))
+    dot_file.write('}\n')
+  return len(sccs)
+
+def write_component(graph, scc, path, boundary=True, name=None):
+  """
+  Expands one component: its nodes and intra-SCC edges, and (optionally) its
+  inter-SCC edges collapsed onto the neighboring components.
+  O(nodes of the component + their edges) time
+  @param graph: a fd_graph.Graph
+  @param scc: the component number
+  @param path: the DOT file to create
+  @param boundary: whether to show the neighboring components
+  """
+  if scc not in graph.components:
+    raise ValueError('No such component: %s' % scc)
+  nodes = graph.components[scc]
+  ids = dict((node, i) for i, node in enumerate(nodes))
+  inverse_components = graph.inverse_components
+  outgoing, incoming = {}, {}   # Map (node id, neighboring component) to the number of edges
+  with open(path, 'w') as dot_file:
+    dot_file.write('digraph %s {\n' % quote(name or 'Component %s' % scc))
+    dot_file.write('  node [style=filled, fillcolor=%s];\n' % quote(color(scc)))
+    for node, i in ids.iteritems():
+      dot_file.write('  n%d [label=%s];\n' % (i, quote(node.value)))
+    for node, i in ids.iteritems():
+      for e_node in graph.edges.get(node, ()):
+        if e_node in ids:
+          dot_file.write('  n%d -> n%d;\n' % (i, ids[e_node]))
+        elif boundary and e_node in inverse_components:
+          key = (i, inverse_components[e_node])
+          outgoing[key] = outgoing.get(key, 0) + 1
+      if boundary and graph.reverse_edges:
+        for s_node in graph.rev_edges.get(node, ()):
+          if s_node not in ids and s_node in inverse_components:
+            key = (i, inverse_components[s_node])
+            incoming[key] = incoming.get(key, 0) + 1
+    for other in sorted(set(other for i, other in outgoing.keys() + incoming.keys())):
+      dot_file.write('  c%d [shape=box, label=%s, fillcolor=%s];\n' % \
+        (other, quote('%s\n(%d)' % (other, len(graph.components[other]))), quote(color(other))))
+    for (i, other), count in sorted(outgoing.iteritems()):
+      dot_file.write('  n%d -> c%d [style=dashed%s];\n' % (i, other, ', label="%d"' % count if count > 1 else ''))
+    for (i, other), count in sorted(incoming.iteritems()):
+      dot_file.write('  c%d -> n%d [style=dashed%s];\n' % (other, i, ', label="%d"' % count if count > 1 else ''))
+    dot_file.write('}\n')
+
+def write_graph(graph, path, name='Graph'):
+  """
+  Writes every node, colored by its component, and every edge. O(|V| + |E|) time;
+  only readable for small graphs
+  @param graph: a fd_graph.Graph
+  @param path: the DOT file to create
+  """
+  ids = {}
+  with open(path, 'w') as dot_file:
+    dot_file.write('digraph %s {\n' % quote(name))
+    dot_file.write('  node [style=filled];\n')
+    for node, scc in graph.inverse_components.iteritems():
+      ids[node] = len(ids)
+      dot_file.write('  n%d [label=%s, fillcolor=%s];\n' % (ids[node], quote(node.value), quote(color(scc))))
+    for s_node, e_nodes in graph.edges.iteritems():
+      for e_node in e_nodes:
+        if s_node in ids and e_node in ids:
+          dot_file.write('  n%d -> n%d;\n' % (ids[s_node], ids[e_node]))
+    dot_file.write('}\n')
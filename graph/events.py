@@ -0,0 +1,48 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### CHANGE EVENTS, describing how a batch changed the strong components ###
+# A graph hands each subscriber the list of events of a batch, in the order the
+# changes were made, so a consumer can keep a copy of the components up to date in
+# time proportional to the change instead of diffing the whole mapping.
+# Components are identified by their component number in fd_graph, and by the root
+# node of their tree in the rz_graph forest.
+import collections
+
+# Nodes that joined the graph; nodes maps each new node to its (new) component
+NodesAdded = collections.namedtuple('NodesAdded', ['nodes'])
+
+# Nodes that left the graph; nodes maps each removed node to the component it was
+# in, and a component left without nodes no longer exists
+NodesRemoved = collections.namedtuple('NodesRemoved', ['nodes'])
+
+# The components in sources were merged into the new component target
+Merged = collections.namedtuple('Merged', ['target', 'sources'])
+
+# The component source was split; fragments maps each new component to its nodes,
+# and the nodes not listed stay in source
+Split = collections.namedtuple('Split', ['source', 'fragments'])
+
+# The components were recomputed from scratch (e.g. by a full compute_scc);
+# components maps every component to its nodes and replaces any previous state
+Recomputed = collections.namedtuple('Recomputed', ['components'])
+
+class EventStream:
+  """
+  Buffers the events of a graph for consumers that would rather iterate than
+  register a callback. Iterating yields the buffered events, oldest first, and
+  stops once the buffer is empty.
+  """
+  def __init__(self, graph, maxlen=None):
+    """
+    @param graph: a graph with a subscribe method (fd_graph.Graph or rz_graph.DynamicGraph)
+    @param maxlen: [optional] the number of events to keep; older events are dropped
+    """
+    self.graph = graph
+    self.events = collections.deque(maxlen=maxlen)
+    graph.subscribe(self.events.extend)
+
+  def __iter__(self):
+    while len(self.events) > 0:
+      yield self.events.popleft()
+
+  def close(self):
+    self.graph.unsubscribe(self.events.extend)
@@ -0,0 +1,170 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### NUMPY/SCIPY EXPORT, for handing the components of a graph to analytics jobs ###
+# Nodes are exported by integer id and components by number. A LabelArray keeps
+# the node -> component labels in a NumPy array that is updated in place after
+# every batch, so reading them is a view rather than a walk over
+# inverse_components; the one-shot functions build the same arrays in one pass.
+import numpy
+import scipy.sparse
+
+NO_COMPONENT = -1
+
+class LabelArray:
+  """
+  A dense int64 array of component labels indexed by node id, kept up to date as
+  one of a graph's label listeners. Each batch costs O(relabeled nodes), written
+  with one vectorized assignment.
+  """
+  def __init__(self, graph, node_id=None, capacity=1024):
+    """
+    @param graph: a fd_graph.Graph
+    @param node_id: [optional] a function mapping a Node to its integer id (e.g. one
+                    returning node.value); by default ids are handed out densely in
+                    the order nodes are first seen, see node_id()
+    @param capacity: the initial number of slots; the array grows as needed
+    """
+    self.graph = graph
+    self.id_function = node_id
+    self.ids = {}             # Maps Node to its id, when ids are handed out here
+    self.nodes = []           # The nodes by id, when ids are handed out here
+    self.size = 0             # One past the largest id written so far
+    self.labels = numpy.empty(max(1, capacity), dtype=numpy.int64)
+    self.labels.fill(NO_COMPONENT)
+    self.publish(graph.inverse_components, graph.inverse_components.keys())
+    graph.add_label_listener(self.publish)
+
+  def node_id(self, node):
+    """
+    @param node: a Node object
+    @return the id of the node in the arrays, or None if it was never labeled
+    """
+    if self.id_function is not None:
+      return self.id_function(node)
+    return self.ids.get(node)
+
+  def publish(self, labels, changed):
+    """
+    @param labels: the graph's mapping of node to component number
+    @param changed: the nodes whose label changed or that were removed
+    """
+    node_ids, sccs = [], []
+    for node in changed:
+      node_id = self.node_id(node)
+      if node_id is None:
+        if node not in labels:
+          continue
+        node_id = self.ids[node] = len(self.nodes)
+        self.nodes.append(node)
+      node_ids.append(node_id)
+      sccs.append(labels.get(node, NO_COMPONENT))
+    if len(node_ids) == 0:
+      return
+    self.size = max(self.size, max(node_ids) + 1)
+    if self.size > len(self.labels):
+      self.__grow(max(self.size, 2 * len(self.labels)))
+    self.labels[node_ids] = sccs
+
+  def component_labels(self):
+    """
+    O(1) time. The view shares memory with the array, so it follows later batches
+    until the array grows; copy it to keep the labels of one point in time.
+    @return an int64 view of the labels by node id, NO_COMPONENT for ids not in the graph
+    """
+    return self.labels[:self.size]
+
+  def component_of_many(self, node_ids):
+    """
+    O(len(node_ids)) time, vectorized
+    @param node_ids: an array-like of node ids
+    @return an int64 array of their component numbers, NO_COMPONENT for ids not in the graph
+    """
+    return _lookup(self.labels[:self.size], node_ids)
+
+  def node_array(self, nodes):
+    """
+    @param nodes: an iterable of Node objects
+    @return an int64 array of their ids, -1 for nodes never labeled
+    """
+    return numpy.fromiter((_or_missing(self.node_id(node)) for node in nodes), dtype=numpy.int64)
+
+  def condensation(self):
+    """
+    See condensation()
+    """
+    return condensation(self.graph, self.node_id, self.component_labels())
+
+  def close(self):
+    self.graph.remove_label_listener(self.publish)
+
+  #######################
+  ### PRIVATE METHODS ###
+  #######################
+
+  def __grow(self, capacity):
+    labels = numpy.empty(capacity, dtype=numpy.int64)
+    labels.fill(NO_COMPONENT)
+    labels[:len(self.labels)] = self.labels
+    self.labels = labels
+
+def _or_missing(node_id):
+  return NO_COMPONENT if node_id is None else node_id
+
+def _lookup(labels, node_ids):
+  node_ids = numpy.asarray(node_ids, dtype=numpy.int64)
+  result = numpy.empty(node_ids.shape, dtype=numpy.int64)
+  result.fill(NO_COMPONENT)
+  valid = (node_ids >= 0) & (node_ids < len(labels))
+  result[valid] = labels[node_ids[valid]]
+  return result
+
+def component_labels(graph, node_id):
+  """
+  Builds the labels array in one pass over inverse_components. O(|V|) time
+  @param graph: a fd_graph.Graph
+  @param node_id: a function mapping a Node to its integer id
+  @return an int64 array of the labels by node id, NO_COMPONENT for ids not in the graph
+  """
+  inverse_components = graph.inverse_components
+  count = len(inverse_components)
+  node_ids = numpy.fromiter((node_id(node) for node in inverse_components.iterkeys()), dtype=numpy.int64, count=count)
+  sccs = numpy.fromiter(inverse_components.itervalues(), dtype=numpy.int64, count=count)
+  labels = numpy.empty(node_ids.max() + 1 if count > 0 else 0, dtype=numpy.int64)
+  labels.fill(NO_COMPONENT)
+  labels[node_ids] = sccs
+  return labels
+
+def component_of_many(graph, node_ids, node_id):
+  """
+  @param graph: a fd_graph.Graph
+  @param node_ids: an array-like of node ids
+  @param node_id: a function mapping a Node to its integer id
+  @return an int64 array of their component numbers, NO_COMPONENT for ids not in the graph
+  """
+  return _lookup(component_labels(graph, node_id), node_ids)
+
+def condensation(graph, node_id, labels=None):
+  """
+  Builds the condensation DAG as a sparse matrix: entry (i, j) is the number of
+  inter-SCC edges from component i to component j. The endpoints are gathered in
+  one pass over inter_edges, and the matrix is built from them with vectorized
+  operations. O(|V| + inter-SCC edges) time
+  @param graph: a fd_graph.Graph
+  @param node_id: a function mapping a Node to its integer id, or None if it has none
+  @param labels: [optional] the labels array by node id, see component_labels
+  @return a scipy.sparse.csr_matrix of shape (scc_num, scc_num)
+  """
+  if labels is None:
+    labels = component_labels(graph, node_id)
+  count = sum(len(e_nodes) for e_nodes in graph.inter_edges.itervalues())
+  s_ids = numpy.fromiter((_or_missing(node_id(s_node)) for s_node, e_nodes in graph.inter_edges.iteritems() \
+    for e_node in e_nodes), dtype=numpy.int64, count=count)
+  e_ids = numpy.fromiter((_or_missing(node_id(e_node)) for e_nodes in graph.inter_edges.itervalues() \
+    for e_node in e_nodes), dtype=numpy.int64, count=count)
+  s_sccs, e_sccs = _lookup(labels, s_ids), _lookup(labels, e_ids)
+  # In DEFERRED mode, inter_edges may hold edges that are not inter-SCC anymore
+  keep = (s_sccs != e_sccs) & (s_sccs >= 0) & (e_sccs >= 0)
+  s_sccs, e_sccs = s_sccs[keep], e_sccs[keep]
+  n = graph.scc_num
+  matrix = scipy.sparse.csr_matrix((numpy.ones(len(s_sccs), dtype=numpy.int64), (s_sccs, e_sccs)), shape=(n, n))
+  matrix.sum_duplicates()
+  return matrix
@@ -1,5 +1,25 @@
 # See https://wiki.python.org/moin/TimeComplexity for running times
 ### FULLY DYNAMIC GRAPH, with optimized bulk insertions/deletions ###
+import bisect
+import collections
+import contextlib
+import time
+
+import compressed
+import events
+import timing_wheel
+import trace
+from instrument import instrumented
+from timer import Timer
+
+# Maintenance modes
+EAGER = 'eager'               # Components are maintained by every bulk insertion/deletion
+DEFERRED = 'deferred'         # Bulk insertions/deletions only record a dirty region, which
+                              # is repaired by the first component query (see settle())
+
+STRATUM_GAP = 1 << 16         # Spacing of the strata order labels after a relabeling
+
+MISSING = object()            # Undo log value of an entry that did not exist
 
 class Node:
   """
@@ -32,22 +52,120 @@ class Edge:
   def __str__(self):
     return '[Edge: %s %s]' % (str(self.nodes[0]), str(self.nodes[1]))
 
+class EdgeOverlay:
+  """
+  Read-only view of a mapping of node to forward neighbors, with some edges added
+  and some removed, for traversing a graph as if a batch had been applied
+  """
+  def __init__(self, edges, added=None, removed=None):
+    """
+    @param edges: the underlying mapping, which is never modified
+    @param added, removed: [optional] dictionaries mapping node to a set of forward neighbors
+    """
+    self.edges = edges
+    self.added = added if added is not None else {}
+    self.removed = removed if removed is not None else {}
+  def __contains__(self, node):
+    return len(self[node]) > 0
+  def __getitem__(self, node):
+    if node not in self.added and node not in self.removed:
+      return self.edges.get(node, ())
+    return (self.edges.get(node, set()) | self.added.get(node, set())) - self.removed.get(node, set())
+
+class PartitionedEdges(collections.Mapping):
+  """
+  Read-only view of the forward neighbors of a graph as the union of its intra-SCC
+  and inter-SCC edges. Stands in for the edges mapping when inter_edges is
+  compressed, so that the edges are not also kept uncompressed
+  """
+  def __init__(self, graph):
+    """
+    @param graph: the Graph whose current intra_edges and inter_edges are viewed
+    """
+    self.graph = graph
+  def __contains__(self, node):
+    degree = self.graph.degrees.get(node)
+    return degree is not None and degree[1] > 0
+  def __getitem__(self, node):
+    """
+    @return the neighbors of the node: one of the graph's sets if all its edges are
+            on one side, which must not be modified, or else a new set
+    """
+    if node not in self:
+      raise KeyError(node)
+    intra_edges, inter_edges = self.graph.intra_edges.get(node), self.graph.inter_edges.get(node)
+    if not inter_edges:
+      return intra_edges
+    if not intra_edges:
+      return inter_edges
+    return intra_edges | inter_edges
+  def __iter__(self):
+    return iter([node for node, degree in self.graph.degrees.iteritems() if degree[1] > 0])
+  def __len__(self):
+    return sum(1 for degree in self.graph.degrees.itervalues() if degree[1] > 0)
+
 class Graph:
   """
   Class to represent a DIRECTED graph using linear space
   """
-  def __init__(self, edges=set()):
+  def __init__(self, edges=set(), mode=EAGER, full_recompute_ratio=0.25, reverse_edges=True,
+               compressed_inter_edges=None):
     """
     @param edges: optional input set or list of edges to be inserted
+    @param mode: EAGER or DEFERRED maintenance of the components
+    @param full_recompute_ratio: in DEFERRED mode, a dirty region covering more than
+                                 this fraction of the nodes is repaired by a full compute
+    @param reverse_edges: False to save the memory of rev_edges, e.g. for workloads
+                          that never delete; remove_node then scans all edges, and
+                          rev_edges is built the first time the strata are requested
+    @param compressed_inter_edges: None to keep inter_edges as sets; a number to store
+                                   them as compressed blocks (see compressed.py), with
+                                   that many of them decoded at a time. edges is then
+                                   a PartitionedEdges view rather than a copy
     """
     self.edges = {}               # Maps node to list of forward neighbors
     self.rev_edges = {}           # Maps node to list of backwards neighbors
+    self.reverse_edges = reverse_edges  # Whether rev_edges is maintained
+    self.degrees = {}             # Node registry: maps every node to its (in degree, out degree)
+    self.num_edges = 0            # Number of edges in the graph
+    self.explicit_nodes = set()   # Nodes added by add_node, which stay without edges
     self.components = {}          # Strong components of graph
     self.inverse_components = {}  # Maps each node to its component in the graph
     self.scc_num = 0              # Next available component number
 
     self.intra_edges = {}         # Stores the intra-SCC edges, mapping node to list of forward neighbors
     self.inter_edges = {}         # Stores the inter-SCC edges, mapping node to list of forward neighbors
+    self.compressed_inter_edges = compressed_inter_edges
+    if compressed_inter_edges is not None:
+      self.edges = PartitionedEdges(self)
+      self.inter_edges = compressed.CompressedAdjacency(compressed_inter_edges)
+
+    self.label_listeners = []     # Called with (inverse_components, relabeled nodes) after every batch
+    self.relabeled = set()        # Nodes whose component changed (or that were removed) in this batch
+    self.subscribers = []         # Called with the list of change events of every batch
+    self.changes = []             # The change events of this batch, if there are subscribers
+    self.removed_nodes = {}       # Maps each node removed in this batch to its last component
+
+    self.ranks = None             # Maps component to its strata order label, once strata are requested
+    self.rank_labels = []         # The order labels in use, sorted
+    self.stratum_at = {}          # Maps order label to its component
+    self.unordered = set()        # (s_node, e_node) pairs to check against the strata order
+    self.ordered_changes = 0      # Number of this batch's change events applied to the strata
+    self.reranked = set()         # Components whose place in the strata order changed in this batch
+    self.last_reranked = set()    # ... and in the previous batch
+
+    self.mode = mode
+    self.full_recompute_ratio = full_recompute_ratio
+    self.pending_edges = set()    # DEFERRED mode: inserted edges that may merge components
+    self.pending_sccs = set()     # DEFERRED mode: components that lost intra-SCC edges
+
+    self.instrumentation = None   # An instrument.Instrumentation, or None to disable counters
+    self.operation = None         # The instrument.Operation in progress, if instrumented
+    self.recorder = None          # A trace.TraceRecorder, or None to disable tracing
+    self.expiry = None            # A timing_wheel.TimingWheel of the (s_node, e_node) pairs inserted with a ttl
+
+    self.undo = None              # In a transaction: the undo log, see __rollback()
+    self.undo_saved = set()       # In a transaction: (id(mapping), key) pairs already in the undo log
 
     # Initialize graph, if desired
     self.add_edges(edges)
@@ -58,13 +176,37 @@ class Graph:
     O(1) time to add node to a set inside a map (dictionary)
     """
     s_node, e_node = edge.nodes
+    if s_node in self.edges and e_node in self.edges[s_node]:
+      return
+    if self.compressed_inter_edges is not None:
+      # The edges are only kept in their partition, as of the current labels
+      s_scc = self.inverse_components.get(s_node)
+      if s_node is e_node or (s_scc is not None and s_scc == self.inverse_components.get(e_node)):
+        edges = self.intra_edges
+      else:
+        edges = self.inter_edges
+    else:
+      edges = self.edges
+    if self.undo is not None:
+      self.__save_set(edges, s_node)
+      if self.reverse_edges:
+        self.__save_set(self.rev_edges, e_node)
+      self.__save(self.degrees, s_node)
+      self.__save(self.degrees, e_node)
+      self.__save_attributes('num_edges')
 
-    if s_node not in self.edges:
-      self.edges[s_node] = set()
-    if e_node not in self.rev_edges:
-      self.rev_edges[e_node] = set()
-    self.edges[s_node].add(e_node)
-    self.rev_edges[e_node].add(s_node)
+    if s_node not in edges:
+      edges[s_node] = set()
+    edges[s_node].add(e_node)
+    if self.reverse_edges:
+      if e_node not in self.rev_edges:
+        self.rev_edges[e_node] = set()
+      self.rev_edges[e_node].add(s_node)
+    in_degree, out_degree = self.degrees.get(s_node, (0, 0))
+    self.degrees[s_node] = (in_degree, out_degree + 1)
+    in_degree, out_degree = self.degrees.get(e_node, (0, 0))
+    self.degrees[e_node] = (in_degree + 1, out_degree)
+    self.num_edges += 1
 
   def add_edges(self, edge_set):
     """
@@ -77,20 +219,60 @@ class Graph:
     if len(edge_set) > 0:
       self.compute_scc()
 
-  def optimized_add_edges(self, edge_set):
+  @instrumented('add')
+  def optimized_add_edges(self, edge_set, ttl=None):
     """
     An optimized bulk edge insertion method.
     @param edge_set: a set of edges to be added to the graph
+    @param ttl: [optional] the edges expire ttl after the time of the last advance(),
+                which removes them; inserting an edge again renews its expiry, or
+                cancels it if there is no ttl
     """
+    if self.recorder is not None:
+      self.recorder.record_batch(trace.ADD, edge_set)
+    op = self.operation
+    if op is not None:
+      start = time.time()
+      op.count('edges', len(edge_set))
+    emit = self.__changes_wanted()
+    if ttl is not None or self.expiry is not None:
+      self.__schedule_expiry(edge_set, ttl)
+    if self.undo is not None:
+      self.__save_attributes('scc_num', 'pending_edges', 'unordered')
+    if self.ranks is not None:
+      self.unordered.update(edge.nodes for edge in edge_set)
+    added = {}
     check_scc = set()
+    if self.compressed_inter_edges is not None:
+      # Group the edges by source, so that each source's sets are decoded once
+      edge_set = sorted(edge_set, key=lambda edge: id(edge.nodes[0]))
     for edge in edge_set:
       s_node, e_node = edge.nodes
       self.add_edge(edge)
 
+      # A self-loop on a new node: a single new component, and an intra-SCC edge
+      if s_node is e_node and s_node not in self.inverse_components:
+        if self.undo is not None:
+          self.__save_set(self.intra_edges, s_node)
+          self.__save(self.inverse_components, s_node)
+          self.__save(self.components, self.scc_num)
+        self.inverse_components[s_node] = self.scc_num
+        self.components[self.scc_num] = set([s_node])
+        self.intra_edges[s_node] = set([s_node])
+        self.scc_num += 1
+        self.relabeled.add(s_node)
+        if emit:
+          added[s_node] = self.inverse_components[s_node]
+        continue
+
       # First 3 cases are just adding inter-SCC edges, since one or more of the nodes
       # were not part of the graph to begin with
       if s_node not in self.inverse_components or e_node not in self.inverse_components:
-        self.add_edge(edge)
+        if self.undo is not None:
+          self.__save_set(self.inter_edges, s_node)
+          self.__save(self.inverse_components, s_node)
+          self.__save(self.inverse_components, e_node)
+          self.__save_keys(self.components, (self.scc_num, self.scc_num + 1))
         if s_node not in self.inter_edges:
           self.inter_edges[s_node] = set()
         self.inter_edges[s_node].add(e_node)
@@ -102,25 +284,46 @@ class Graph:
         self.components[self.scc_num] = set([s_node])
         self.components[self.scc_num+1] = set([e_node])
         self.scc_num += 2
+        self.relabeled.add(s_node)
+        self.relabeled.add(e_node)
+        if emit:
+          added[s_node], added[e_node] = self.inverse_components[s_node], self.inverse_components[e_node]
       elif s_node not in self.inverse_components:
         self.inverse_components[s_node] = self.scc_num
         self.components[self.scc_num] = set([s_node])
         self.scc_num += 1
+        self.relabeled.add(s_node)
+        if emit:
+          added[s_node] = self.inverse_components[s_node]
       elif e_node not in self.inverse_components:
         self.inverse_components[e_node] = self.scc_num
         self.components[self.scc_num] = set([e_node])
         self.scc_num += 1
+        self.relabeled.add(e_node)
+        if emit:
+          added[e_node] = self.inverse_components[e_node]
       elif self.inverse_components[s_node] == self.inverse_components[e_node]:
-        self.add(edge)
+        if self.undo is not None:
+          self.__save_set(self.intra_edges, s_node)
         if s_node not in self.intra_edges:
           self.intra_edges[s_node] = set()
         self.intra_edges[s_node].add(e_node)
       else:
         check_scc.add(edge)
+    if len(added) > 0:
+      self.changes.append(events.NodesAdded(added))
+
+    if op is not None:
+      op.phase('classify', start)
+      op.path = 'deferred' if self.mode == DEFERRED else 'maintenance' if len(check_scc) > 0 else 'direct'
 
     # If there are any edges that we need to check, let's run maintenance on them
-    if len(check_scc) > 0:
+    if self.mode == DEFERRED:
+      self.pending_edges.update(check_scc)
+    elif len(check_scc) > 0:
       self.__run_add_maintenance(check_scc)
+    self.__maintain_strata()
+    self.__publish_labels()
 
   def remove_edge(self, edge):
     """
@@ -131,8 +334,33 @@ class Graph:
     """
     s_node, e_node = edge.nodes
     if s_node in self.edges and e_node in self.edges[s_node]:
-      self.edges[s_node].remove(e_node)
-      self.rev_edges[e_node].remove(s_node)
+      if self.undo is not None:
+        if self.compressed_inter_edges is None:
+          self.__save_set(self.edges, s_node)
+        if self.reverse_edges:
+          self.__save_set(self.rev_edges, e_node)
+        self.__save(self.degrees, s_node)
+        self.__save(self.degrees, e_node)
+        self.__save_set(self.intra_edges, s_node)
+        self.__save_set(self.inter_edges, s_node)
+        self.__save_attributes('num_edges')
+      if self.compressed_inter_edges is None:
+        self.edges[s_node].remove(e_node)
+        if len(self.edges[s_node]) == 0:
+          del self.edges[s_node]
+      if self.reverse_edges:
+        self.rev_edges[e_node].remove(s_node)
+        if len(self.rev_edges[e_node]) == 0:
+          del self.rev_edges[e_node]
+      in_degree, out_degree = self.degrees[s_node]
+      self.degrees[s_node] = (in_degree, out_degree - 1)
+      in_degree, out_degree = self.degrees[e_node]
+      self.degrees[e_node] = (in_degree - 1, out_degree)
+      self.num_edges -= 1
+      if self.expiry is not None:
+        if self.undo is not None:
+          self.__save(self.expiry, edge.nodes)
+        self.expiry.pop(edge.nodes)
       # Update edge partitions
       if s_node in self.intra_edges and e_node in self.intra_edges[s_node]: 
         self.intra_edges[s_node].remove(e_node)
@@ -142,28 +370,11 @@ class Graph:
         self.inter_edges[s_node].remove(e_node)
         if len(self.inter_edges[s_node]) == 0:
           del self.inter_edges[s_node]
-      # If there are no outgoing edges from the start node, del it
-      if len(self.edges[s_node]) == 0:
-        del self.edges[s_node]
-        # If there are no incoming edges to the start node, del it
-        if s_node in self.rev_edges and len(self.rev_edges[s_node]) == 0:
-          del self.rev_edges[s_node]
+      # A node left without edges leaves the graph, unless it was added by add_node
+      for node in edge.nodes:
+        if node in self.degrees and self.degrees[node] == (0, 0) and node not in self.explicit_nodes:
           # Maintain inverse components mapping
-          self.__clear_component_node(e_node)
-        elif s_node not in self.rev_edges:
-          # Maintain inverse components mapping
-          self.__clear_component_node(s_node)
-      # If there are no incoming edges to the end node, del it
-      if len(self.rev_edges[e_node]) == 0:
-        del self.rev_edges[e_node]
-        # If there are no outgoing edges from the end node, del it
-        if e_node in self.edges and len(self.edges[e_node]) == 0:
-          del self.edges[e_node]
-          # Maintain inverse components mapping
-          self.__clear_component_node(e_node)
-        elif e_node not in self.edges:
-          # Maintain inverse components mapping
-          self.__clear_component_node(e_node)
+          self.__clear_component_node(node)
 
   def remove_edges(self, edge_set):
     """
@@ -176,11 +387,20 @@ class Graph:
     if len(edge_set) > 0:
       self.compute_scc()
 
+  @instrumented('remove')
   def optimized_remove_edges(self, edge_set):
     """
     Optimized bulk removal of edges
     @param edges: a set of edges to be removed
     """
+    if self.recorder is not None:
+      self.recorder.record_batch(trace.REMOVE, edge_set)
+    op = self.operation
+    if op is not None:
+      start = time.time()
+      op.count('edges', len(edge_set))
+    if self.undo is not None:
+      self.__save_attributes('pending_sccs')
     check_scc = set()
     for edge in edge_set:
       s_node, e_node = edge.nodes
@@ -188,33 +408,311 @@ class Graph:
         scc = self.inverse_components[s_node]
         check_scc.add(scc)
       self.remove_edge(edge)
+    if len(self.removed_nodes) > 0:
+      self.changes.append(events.NodesRemoved(self.removed_nodes))
+      self.removed_nodes = {}
+    if op is not None:
+      op.phase('classify', start)
+      op.path = 'deferred' if self.mode == DEFERRED else 'maintenance' if len(check_scc) > 0 else 'direct'
 
-    for scc in check_scc:
-      # Check if the SCC still exists; could be taken care of by cleanup
-      # code already
-      if scc in self.components:
-        nodes = self.components[scc]
-        components, inverse_components = self.__compute_partial_scc_deletion(nodes)
+    if self.mode == DEFERRED:
+      self.pending_sccs.update(check_scc)
+    else:
+      self.__run_remove_maintenance(check_scc)
+    self.__maintain_strata()
+    self.__publish_labels()
 
-        # If the component got split up, we need to merge the results in
-        # 1. Delete the scc from self.components
-        # 2. Merge in the new components
-        # 3. Update all the nodes in self.inverse_components
-        # NOTE: We can re-use the number "scc" by replacing the max number of 
-        #       components with "scc", then going through all of inverse_comp
-        #       to reset those nodes to "scc". Currently NOT implemented.
-        if len(components) > 1:
-          del self.components[scc]
-          self.components.update(components)
-          self.inverse_components.update(inverse_components)
-          self.__delete_partial_partition_edges(components, inverse_components)
+  def advance(self, now):
+    """
+    Moves the expiry clock forward, and removes the edges whose ttl ran out as a
+    single optimized_remove_edges batch. Finding them takes O(expired) time, see
+    timing_wheel.py. The first call starts the clock, which is at 0 until then.
+    Not allowed in a transaction, since the clock cannot be moved back.
+    @param now: the current time, in the units of the ttls
+    @return the set of expired edges
+    """
+    if self.undo is not None:
+      raise ValueError('advance() cannot be called in a transaction')
+    if self.expiry is None:
+      self.expiry = timing_wheel.TimingWheel(now=now)
+    expired = set(Edge(s_node, e_node) for s_node, e_node in self.expiry.advance(now))
+    if len(expired) > 0:
+      self.optimized_remove_edges(expired)
+    return expired
+
+  def preview_add(self, edge_set):
+    """
+    Computes the change events optimized_add_edges(edge_set) would produce, without
+    changing the graph: the edges are inserted in an overlay, and the same bounded
+    traversal runs over it. New components get provisional numbers from scc_num up.
+    Time proportional to the region reachable from the edges that cross components
+    @param edge_set: a set of edges
+    @return a list of events (see events.py)
+    @raise ValueError if there is deferred maintenance pending, see settle()
+    """
+    self.__check_settled()
+    added, labels, next_scc = {}, {}, self.scc_num
+    for edge in edge_set:
+      s_node, e_node = edge.nodes
+      for node in edge.nodes:
+        if node not in self.inverse_components and node not in labels:
+          labels[node] = next_scc
+          next_scc += 1
+      if s_node not in self.edges or e_node not in self.edges[s_node]:
+        if s_node not in added:
+          added[s_node] = set()
+        added[s_node].add(e_node)
+    label = lambda node: labels[node] if node in labels else self.inverse_components[node]
+
+    changes = [events.NodesAdded(labels)] if len(labels) > 0 else []
+    check_scc = [edge for edge in edge_set if label(edge.nodes[0]) != label(edge.nodes[1])]
+    if len(check_scc) > 0:
+      components, inverse_components, traversed_edges = \
+        self.__compute_partial_scc_addition(check_scc, EdgeOverlay(self.edges, added=added), [next_scc])
+      for scc, members in components.items():
+        sources = set(label(node) for node in members)
+        if len(sources) > 1:
+          changes.append(events.Merged(scc, sources))
+    return changes
+
+  def preview_remove(self, edge_set):
+    """
+    Computes the change events optimized_remove_edges(edge_set) would produce,
+    without changing the graph: the edges are removed in an overlay, and the same
+    bounded traversal runs over it. New components get provisional numbers from
+    scc_num up. Time proportional to the components that lose intra-SCC edges
+    @param edge_set: a set of edges
+    @return a list of events (see events.py)
+    @raise ValueError if there is deferred maintenance pending, see settle()
+    """
+    self.__check_settled()
+    removed, removed_in = {}, {}
+    for edge in edge_set:
+      s_node, e_node = edge.nodes
+      if s_node in self.edges and e_node in self.edges[s_node]:
+        if s_node not in removed:
+          removed[s_node] = set()
+        removed[s_node].add(e_node)
+        if e_node not in removed_in:
+          removed_in[e_node] = set()
+        removed_in[e_node].add(s_node)
+
+    # Nodes left without any edge leave the graph, unless they were added by add_node
+    removed_nodes = {}
+    for node in set(removed) | set(removed_in):
+      in_degree, out_degree = self.degrees[node]
+      if out_degree == len(removed.get(node, ())) and in_degree == len(removed_in.get(node, ())) and \
+          node not in self.explicit_nodes:
+        removed_nodes[node] = self.inverse_components[node]
+    changes = [events.NodesRemoved(removed_nodes)] if len(removed_nodes) > 0 else []
+
+    check_scc = set()
+    for s_node in removed:
+      for e_node in removed[s_node]:
+        if self.inverse_components[s_node] == self.inverse_components[e_node]:
+          check_scc.add(self.inverse_components[s_node])
+    overlay, index = EdgeOverlay(self.edges, removed=removed), [self.scc_num]
+    for scc in check_scc:
+      nodes = set(node for node in self.components[scc] if node not in removed_nodes)
+      components, inverse_components = self.__compute_partial_scc_deletion(nodes, overlay, index)
+      if len(components) > 1:
+        largest = max(components, key=lambda c: len(components[c]))
+        changes.append(events.Split(scc, \
+          dict((c, frozenset(components[c])) for c in components if c != largest)))
+    return changes
 
   def get_nodes(self):
     """
-    O(|V|) time to retrieve all nodes in the graph
+    O(|V|) time to retrieve all nodes in the graph, including the isolated nodes
+    added by add_node; see degree() for an O(1) membership test
+    @return a new set, which may be kept while the graph changes
+    """
+    return set(self.degrees)
+
+  def degree(self, node):
+    """
+    O(1) time
+    @param node: a Node object
+    @return the (in degree, out degree) pair of the node, or None if it is not in the graph
+    """
+    return self.degrees.get(node)
+
+  def add_node(self, node):
+    """
+    Adds a node, which stays in the graph even without edges until remove_node
+    is called. A new node is a component of its own. O(1) time
+    @param node: a Node object
+    """
+    if self.recorder is not None:
+      self.recorder.record_node(trace.ADD_NODE, node)
+    if node in self.explicit_nodes:
+      return
+    if self.undo is not None:
+      self.undo.append((self.explicit_nodes, node))
+    self.explicit_nodes.add(node)
+    if node in self.degrees:
+      return
+    if self.undo is not None:
+      self.__save_attributes('scc_num')
+      self.__save(self.degrees, node)
+      self.__save(self.inverse_components, node)
+      self.__save(self.components, self.scc_num)
+    self.degrees[node] = (0, 0)
+    self.inverse_components[node] = self.scc_num
+    self.components[self.scc_num] = set([node])
+    if self.__changes_wanted():
+      self.changes.append(events.NodesAdded({ node: self.scc_num }))
+    self.scc_num += 1
+    self.relabeled.add(node)
+    self.__maintain_strata()
+    self.__publish_labels()
+
+  def remove_node(self, node):
+    """
+    Removes a node and its edges, with one bulk deletion of the edges.
+    O(degree) time plus the deletion, or O(|E|) to find the incoming edges if
+    rev_edges is not maintained
+    @param node: a Node object
+    """
+    if self.recorder is not None:
+      self.recorder.record_node(trace.REMOVE_NODE, node)
+    if node not in self.degrees:
+      return
+    if node in self.explicit_nodes:
+      if self.undo is not None:
+        self.undo.append((self.explicit_nodes, node))
+      self.explicit_nodes.remove(node)
+    edge_set = set(Edge(node, e_node) for e_node in self.edges.get(node, ()))
+    if self.reverse_edges:
+      s_nodes = self.rev_edges.get(node, ())
+    else:
+      s_nodes = [s_node for s_node, e_nodes in self.edges.iteritems() if node in e_nodes]
+    edge_set.update(Edge(s_node, node) for s_node in s_nodes if s_node is not node)
+    if len(edge_set) > 0:
+      # Traced as one node removal rather than as a batch of edges
+      recorder, self.recorder = self.recorder, None
+      try:
+        self.optimized_remove_edges(edge_set)
+      finally:
+        self.recorder = recorder
+      return
+    # An isolated node
+    self.__clear_component_node(node)
+    if len(self.removed_nodes) > 0:
+      self.changes.append(events.NodesRemoved(self.removed_nodes))
+      self.removed_nodes = {}
+    self.__maintain_strata()
+    self.__publish_labels()
+
+  def component_of(self, node):
+    """
+    Settles any deferred maintenance first
+    @param node: a Node object
+    @return the component number of the node, or None if it is not in the graph
     """
-    return set(self.edges.keys()) | set(self.rev_edges.keys())
+    if self.recorder is not None:
+      self.recorder.record_query(trace.COMPONENT_OF, (node,))
+    self.settle()
+    return self.inverse_components.get(node)
 
+  def same_component(self, u, v):
+    """
+    Settles any deferred maintenance first
+    @param u, v: two Node objects
+    @return True if u, v are in the same SCC
+    """
+    if self.recorder is not None:
+      self.recorder.record_query(trace.SAME_COMPONENT, (u, v))
+    self.settle()
+    return u in self.inverse_components and v in self.inverse_components and \
+      self.inverse_components[u] == self.inverse_components[v]
+
+  def strata(self):
+    """
+    The components in an evaluation order of the condensation: every inter-SCC
+    edge goes from an earlier stratum to a later one. The order is computed on
+    the first call and maintained incrementally afterwards.
+    Settles any deferred maintenance first. O(number of components) time
+    @return a list of component numbers
+    """
+    self.__enable_strata()
+    return [self.stratum_at[label] for label in self.rank_labels]
+
+  def stratum_of(self, node):
+    """
+    Settles any deferred maintenance first. O(1) time
+    @param node: a Node object
+    @return the order label of the node's component: strata with smaller labels
+            come first; labels are only comparable to each other, and may change
+            without the order changing. None if the node is not in the graph
+    """
+    self.__enable_strata()
+    scc = self.inverse_components.get(node)
+    return self.ranks[scc] if scc is not None else None
+
+  def changed_strata(self):
+    """
+    Settles any deferred maintenance first
+    @return the set of components that were created or moved in the strata
+            order by the last batch
+    """
+    self.__enable_strata()
+    return set(scc for scc in self.last_reranked if scc in self.ranks)
+
+  def set_mode(self, mode):
+    """
+    Switches between EAGER and DEFERRED maintenance, settling when leaving DEFERRED mode
+    @param mode: EAGER or DEFERRED
+    """
+    self.mode = mode
+    if mode == EAGER:
+      self.settle()
+
+  @instrumented('settle')
+  def settle(self):
+    """
+    Repairs the components after bulk insertions/deletions made in DEFERRED mode.
+    Runs one consolidated maintenance pass over the dirty region, or a full compute
+    if the dirty region is large. components and inverse_components are only
+    up to date after a settle.
+    """
+    if len(self.pending_edges) == 0 and len(self.pending_sccs) == 0:
+      return
+    if self.undo is not None:
+      self.__save_attributes('pending_edges', 'pending_sccs')
+    pending_edges, pending_sccs = self.pending_edges, self.pending_sccs
+    self.pending_edges, self.pending_sccs = set(), set()
+
+    dirty = len(pending_edges)
+    for scc in pending_sccs:
+      dirty += len(self.components.get(scc, ()))
+    if self.operation is not None:
+      self.operation.count('dirty', dirty)
+    if dirty > self.full_recompute_ratio * len(self.inverse_components):
+      self.compute_scc()
+      return
+    if self.operation is not None:
+      self.operation.path = 'maintenance'
+
+    # Splits first: the components that lost intra-SCC edges are only refined,
+    # then the inserted edges that still cross components are checked for merges
+    self.__run_remove_maintenance(pending_sccs)
+    self.__maintain_strata(check_edges=False)
+    check_scc = set()
+    for edge in pending_edges:
+      s_node, e_node = edge.nodes
+      if s_node not in self.edges or e_node not in self.edges[s_node]:
+        continue
+      if self.inverse_components[s_node] == self.inverse_components[e_node]:
+        self.__add_partial_partition_edges({ s_node: set([e_node]) })
+      else:
+        check_scc.add(edge)
+    if len(check_scc) > 0:
+      self.__run_add_maintenance(check_scc)
+    self.__maintain_strata()
+    self.__publish_labels()
+
+  @instrumented('compute')
   def compute_scc(self):
     """
     Full compute of the SCCs of this graph
@@ -222,19 +720,140 @@ class Graph:
     @return a dictionary mapping component number to a set of component nodes, 
             and a reverse dictionary mapping a node to the component number
     """
-    s_nodes = self.edges.keys()
+    op = self.operation
+    if op is not None:
+      start = time.time()
+      op.path = 'full'
+    s_nodes = self.degrees.keys()
     lowlinks, indices, index = {}, {}, [0]
     components, inverse_components = {}, {}
     visited = []
     for s_node in s_nodes:
       if s_node not in indices:
         self.__traverse(s_node, lowlinks, indices, index, components, inverse_components, visited)
+    if self.undo is not None:
+      self.__save_attributes('scc_num', 'pending_edges', 'pending_sccs', 'components', 'inverse_components', 'intra_edges', 'inter_edges')
     self.scc_num = index[0]
+    self.pending_edges, self.pending_sccs = set(), set()
+    if op is not None:
+      op.phase('traversal', start)
+      op.count('nodes_visited', len(inverse_components))
+      op.count('edges_traversed', sum(len(e_nodes) for e_nodes in self.edges.itervalues()))
+      start = time.time()
+    self.relabeled.update(self.inverse_components)
+    self.relabeled.update(inverse_components)
     self.components = components
     self.inverse_components = inverse_components
     self.__partition_edges()
+    self.__reset_changes()
+    self.__maintain_strata()
+    if op is not None:
+      op.phase('partition', start)
+    self.__publish_labels()
     return components, inverse_components
 
+  def restore_scc(self, inverse_components, scc_num):
+    """
+    Restores a previously computed components mapping instead of running a
+    full compute (e.g. when loading a checkpoint)
+    O(|V|+|E|) time to rebuild the forward mapping and the edge partitions
+    @param inverse_components: a dictionary mapping each node to its component number
+    @param scc_num: the next available component number
+    """
+    components = {}
+    for node, scc in inverse_components.items():
+      if scc not in components:
+        components[scc] = set()
+      components[scc].add(node)
+      # Nodes without edges were added by add_node
+      if node not in self.degrees:
+        if self.undo is not None:
+          self.__save(self.degrees, node)
+          self.undo.append((self.explicit_nodes, node))
+        self.degrees[node] = (0, 0)
+        self.explicit_nodes.add(node)
+    if self.undo is not None:
+      self.__save_attributes('scc_num', 'pending_edges', 'pending_sccs', 'components', 'inverse_components', 'intra_edges', 'inter_edges')
+    self.scc_num = scc_num
+    self.pending_edges, self.pending_sccs = set(), set()
+    self.relabeled.update(self.inverse_components)
+    self.relabeled.update(inverse_components)
+    self.components = components
+    self.inverse_components = inverse_components
+    self.__partition_edges()
+    self.__reset_changes()
+    self.__maintain_strata()
+    self.__publish_labels()
+
+  def add_label_listener(self, listener):
+    """
+    Registers a callable that is given (inverse_components, relabeled) after every
+    batch, where relabeled is the set of nodes whose component number changed or
+    that were removed from the graph. Used to publish labels to concurrent readers.
+    @param listener: a callable taking two arguments
+    """
+    self.label_listeners.append(listener)
+
+  def remove_label_listener(self, listener):
+    """
+    @param listener: a callable previously passed to add_label_listener
+    """
+    self.label_listeners.remove(listener)
+
+  def subscribe(self, callback):
+    """
+    Registers a callable that is given the list of change events (see events.py)
+    of every batch. Events are only built while there are subscribers.
+    @param callback: a callable taking a list of events
+    """
+    self.subscribers.append(callback)
+
+  def unsubscribe(self, callback):
+    """
+    @param callback: a callable previously passed to subscribe
+    """
+    self.subscribers.remove(callback)
+
+  @contextlib.contextmanager
+  def transaction(self):
+    """
+    Groups batches so that they take effect together or not at all:
+
+      with graph.transaction():
+        graph.optimized_remove_edges(old_edges)
+        graph.optimized_add_edges(new_edges)
+
+    Every change made to the adjacency, the components and the edge partitions
+    is recorded in an undo log, saving each entry the first time it is touched.
+    If the block raises, the log is replayed backwards and the exception is
+    re-raised; rollback costs time proportional to the entries the block touched,
+    not to the size of the graph. Listeners, subscribers and the trace recorder
+    only see the batches of the transaction once it commits.
+    Nested transactions are part of the outermost one.
+    """
+    if self.undo is not None:
+      yield self
+      return
+    batch = (set(self.relabeled), list(self.changes), self.ordered_changes, dict(self.removed_nodes), \
+      set(self.reranked), set(self.last_reranked))
+    recorder = self.recorder
+    if recorder is not None:
+      self.recorder = trace.RecordBuffer()
+    self.undo, self.undo_saved = [], set()
+    try:
+      yield self
+    except:
+      self.__rollback()
+      self.relabeled, self.changes, self.ordered_changes, self.removed_nodes, \
+        self.reranked, self.last_reranked = batch
+      raise
+    finally:
+      buffered, self.recorder = self.recorder, recorder
+      self.undo, self.undo_saved = None, set()
+    if recorder is not None:
+      buffered.replay(recorder)
+    self.__publish_labels()
+
   def __str__(self):
     """
     Returns a text representation of the graph.
@@ -289,15 +908,15 @@ class Graph:
     """
     intra_edges, inter_edges = {}, {}
     for s_node in self.edges:
-      intra_edges[s_node] = set()
-      inter_edges[s_node] = set()
       e_nodes = self.edges[s_node]
 
       for e_node in e_nodes:
-        if self.inverse_components[s_node] == self.inverse_components[e_node]:
-          intra_edges[s_node].add(e_node)
-        else:
-          inter_edges[s_node].add(e_node)
+        partition = intra_edges if self.inverse_components[s_node] == self.inverse_components[e_node] else inter_edges
+        if s_node not in partition:
+          partition[s_node] = set()
+        partition[s_node].add(e_node)
+    if self.compressed_inter_edges is not None:
+      inter_edges = compressed.CompressedAdjacency(self.compressed_inter_edges, inter_edges.iteritems())
     self.intra_edges, self.inter_edges = intra_edges, inter_edges
 
   ### PARTIAL SCC COMPUTE METHODS: ADDITION ###
@@ -310,7 +929,6 @@ class Graph:
     @param check_scc: the edges that need to be checked
     """
     # Build the edge maps
-    nodes = self.get_nodes()
     forward_edges = {}
     for edge in check_scc:
       s_node, e_node = edge.nodes
@@ -319,25 +937,64 @@ class Graph:
       forward_edges[s_node].add(e_node)
 
     # Run limited Tarjan's SCC algorithm on the reachable parts of the edges to be checked
-    components, inverse_components, traversed_edges = self.__compute_partial_scc_addition(check_scc)
+    op = self.operation
+    if op is not None:
+      start = time.time()
+    index = [self.scc_num]
+    components, inverse_components, traversed_edges = self.__compute_partial_scc_addition(check_scc, self.edges, index)
+    if self.undo is not None:
+      self.__save_attributes('scc_num')
+    self.scc_num = index[0]
+    if op is not None:
+      op.phase('traversal', start)
+      op.count('nodes_visited', len(inverse_components))
+      op.count('edges_traversed', sum(len(e_nodes) for e_nodes in traversed_edges.itervalues()))
+      start = time.time()
+
+    # Keep the number of every component whose members did not change, so that
+    # only the nodes of merged components are relabeled
+    for scc in components.keys():
+      members = components[scc]
+      curr_scc = self.inverse_components[next(iter(members))]
+      if len(self.components[curr_scc]) == len(members) and \
+          all(self.inverse_components[node] == curr_scc for node in members):
+        del components[scc]
+        for node in members:
+          del inverse_components[node]
+
+    if self.__changes_wanted():
+      for scc, members in components.items():
+        self.changes.append(events.Merged(scc, set(self.inverse_components[node] for node in members)))
 
     # Update the components map and the inverse index
     affected_nodes = inverse_components.keys()
     affected_sccs = set()
     for node in affected_nodes:
-      if node in nodes:
+      if node in self.degrees:
         curr_scc = self.inverse_components[node]
         affected_sccs.add(curr_scc)
+    if self.undo is not None:
+      self.__save_keys(self.components, affected_sccs)
+      self.__save_keys(self.components, components)
+      self.__save_keys(self.inverse_components, inverse_components)
     for scc in affected_sccs:
       del self.components[scc]
 
     self.components.update(components)
     self.inverse_components.update(inverse_components)
+    self.relabeled.update(inverse_components)
+    if op is not None:
+      op.phase('relabel', start)
+      op.count('components_merged', len(affected_sccs))
+      op.count('components_created', len(components))
+      start = time.time()
 
     # Maintain the edge partitions
     self.__add_partial_partition_edges(traversed_edges)
+    if op is not None:
+      op.phase('partition', start)
 
-  def __compute_partial_scc_addition(self, check_scc):
+  def __compute_partial_scc_addition(self, check_scc, edges, index):
     """
     Computes the SCCs of the graph from traversing just the nodes in question,
     considering only intra-SCC edges
@@ -346,20 +1003,21 @@ class Graph:
           be updated by the calling method.
 
     @param check_scc: the edges that need to be checked
+    @param edges: the forward neighbors mapping to traverse (self.edges, or an EdgeOverlay)
+    @param index: the first unused component number, in a list; advanced past the new numbers
     @return a dictionary mapping component number to a set of component nodes, 
             and a reverse dictionary mapping a node to the component number,
             and the traversed edges
     """
-    index, lowlinks, indices, components, inverse_components, visited = [self.scc_num], {}, {}, {}, {}, []
+    lowlinks, indices, components, inverse_components, visited = {}, {}, {}, {}, []
     traversed_edges = {}
     for edge in check_scc:
       s_node, e_node = edge.nodes
       if s_node not in indices:
-        self.__partial_addition_traverse(s_node, lowlinks, indices, index, components, inverse_components, visited, traversed_edges)
-    self.scc_num = index[0]
+        self.__partial_addition_traverse(s_node, lowlinks, indices, index, components, inverse_components, visited, traversed_edges, edges)
     return components, inverse_components, traversed_edges
 
-  def __partial_addition_traverse(self, node, lowlinks, indices, index, components, inverse_components, visited, traversed_edges):
+  def __partial_addition_traverse(self, node, lowlinks, indices, index, components, inverse_components, visited, traversed_edges, edges):
     """
     Private helper function to perform DFS and compute components
     of graph (final components in lowlinks)
@@ -374,18 +1032,19 @@ class Graph:
     @param inverse_components: the inverse index on components
     @param visited: the visited nodes
     @param traversed_edges: edges that are traversed during this process
+    @param edges: the forward neighbors mapping to traverse
     """
     indices[node], lowlinks[node] = index[0], index[0]
     index[0] = index[0] + 1
     visited.append(node)
-    if node in self.edges:
+    if node in edges:
       if node not in traversed_edges:
         traversed_edges[node] = set()
 
-      for e_node in self.edges[node]:
+      for e_node in edges[node]:
         traversed_edges[node].add(e_node)
         if e_node not in indices:
-          self.__partial_addition_traverse(e_node, lowlinks, indices, index, components, inverse_components, visited, traversed_edges)
+          self.__partial_addition_traverse(e_node, lowlinks, indices, index, components, inverse_components, visited, traversed_edges, edges)
           lowlinks[node] = min(lowlinks[node], lowlinks[e_node])
         elif e_node in visited:
           lowlinks[node] = min(lowlinks[node], indices[e_node])
@@ -404,28 +1063,84 @@ class Graph:
     Maintain the edge partitions after an insertion operation.
     @param traversed_edges: the edges that were traversed
     """
-    # Update edge partitioning
+    # Update edge partitioning, one source at a time: each source's sets are looked
+    # up once (a compressed inter_edges decodes a set on lookup)
     for s_node in traversed_edges:
-      for e_node in traversed_edges[s_node]:
-        if self.inverse_components[s_node] == self.inverse_components[e_node]:
-          if s_node in self.inter_edges and e_node in self.inter_edges[s_node]:
-            self.inter_edges[s_node].remove(e_node)
-            if len(self.inter_edges[s_node]) == 0:
-              del self.inter_edges[s_node]
-          if s_node not in self.intra_edges:
-            self.intra_edges[s_node] = set()
-          self.intra_edges[s_node].add(e_node)
-        else:
-          if s_node in self.intra_edges and e_node in self.intra_edges[s_node]:
-            self.intra_edges[s_node].remove(e_node)
-            if len(self.intra_edges[s_node]) == 0:
-              del self.intra_edges[s_node]
-          if s_node not in self.inter_edges:
-            self.inter_edges[s_node] = set()
-          self.inter_edges[s_node].add(e_node)
+      s_scc = self.inverse_components[s_node]
+      intra = set(e_node for e_node in traversed_edges[s_node] if self.inverse_components[e_node] == s_scc)
+      inter = traversed_edges[s_node] - intra
+      intra_edges, inter_edges = self.intra_edges.get(s_node, set()), self.inter_edges.get(s_node, set())
+      if intra <= intra_edges and inter <= inter_edges and intra.isdisjoint(inter_edges) and inter.isdisjoint(intra_edges):
+        continue
+      if self.undo is not None:
+        self.__save_set(self.intra_edges, s_node)
+        self.__save_set(self.inter_edges, s_node)
+      intra_edges = (intra_edges - inter) | intra
+      inter_edges = (inter_edges - intra) | inter
+      for edges, e_nodes in ((self.intra_edges, intra_edges), (self.inter_edges, inter_edges)):
+        if len(e_nodes) > 0:
+          edges[s_node] = e_nodes
+        elif s_node in edges:
+          del edges[s_node]
 
   ### PARTIAL SCC COMPUTE METHODS: DELETION ###
-  def __compute_partial_scc_deletion(self, nodes):
+  def __run_remove_maintenance(self, check_scc):
+    """
+    Runs a limited Tarjan on each of the components that lost intra-SCC edges,
+    and merges any splits into the components mapping, its inverse index and
+    the edge partitions.
+    @param check_scc: the component numbers that need to be checked
+    """
+    op = self.operation
+    for scc in check_scc:
+      # Check if the SCC still exists; could be taken care of by cleanup
+      # code already
+      if scc in self.components:
+        nodes = self.components[scc]
+        if op is not None:
+          start = time.time()
+          op.count('nodes_visited', len(nodes))
+          op.count('edges_traversed', sum(len(self.intra_edges.get(node, ())) for node in nodes))
+        index = [self.scc_num]
+        # A split only separates nodes of the component, so its intra-SCC edges suffice
+        components, inverse_components = self.__compute_partial_scc_deletion(nodes, self.intra_edges, index)
+        if self.undo is not None:
+          self.__save_attributes('scc_num')
+        self.scc_num = index[0]
+        if op is not None:
+          op.phase('traversal', start)
+
+        # If the component got split up, we need to merge the results in
+        # 1. Re-use the number "scc" for the largest new component, so that
+        #    only the nodes split off from it are relabeled
+        # 2. Merge in the new components
+        # 3. Update all the nodes in self.inverse_components
+        if len(components) > 1:
+          if op is not None:
+            start = time.time()
+            op.count('components_split')
+            op.count('components_created', len(components) - 1)
+          largest = max(components, key=lambda c: len(components[c]))
+          components[scc] = components.pop(largest)
+          for node in components[scc]:
+            inverse_components[node] = scc
+          if self.__changes_wanted():
+            self.changes.append(events.Split(scc, \
+              dict((c, frozenset(components[c])) for c in components if c != scc)))
+          if self.undo is not None:
+            self.__save_keys(self.components, components)
+            self.__save_keys(self.inverse_components, (node for node in inverse_components if inverse_components[node] != scc))
+          self.components.update(components)
+          self.inverse_components.update(inverse_components)
+          self.relabeled.update(node for node in inverse_components if inverse_components[node] != scc)
+          if op is not None:
+            op.phase('relabel', start)
+            start = time.time()
+          self.__delete_partial_partition_edges(components, inverse_components)
+          if op is not None:
+            op.phase('partition', start)
+
+  def __compute_partial_scc_deletion(self, nodes, edges, index):
     """
     Computes the SCCs of the graph from traversing just the nodes in question,
     considering only intra-SCC edges
@@ -433,19 +1148,21 @@ class Graph:
     NOTE: The partial SCC compute does NOT partition the edges, so those need to
           be updated by the calling method.
 
+    @param nodes: the nodes of the component to check
+    @param edges: the forward neighbors mapping to traverse (self.intra_edges, or an EdgeOverlay)
+    @param index: the first unused component number, in a list; advanced past the new numbers
     @return a dictionary mapping component number to a set of component nodes, 
             and a reverse dictionary mapping a node to the component number
     """
-    lowlinks, indices, index = {}, {}, [self.scc_num]
+    lowlinks, indices = {}, {}
     components, inverse_components = {}, {}
     visited = []
     for node in nodes:
       if node not in indices:
-        self.__partial_deletion_traverse(node, lowlinks, indices, index, components, inverse_components, visited, nodes)
-    self.scc_num = index[0]
+        self.__partial_deletion_traverse(node, lowlinks, indices, index, components, inverse_components, visited, nodes, edges)
     return components, inverse_components
 
-  def __partial_deletion_traverse(self, node, lowlinks, indices, index, components, inverse_components, visited, nodes):
+  def __partial_deletion_traverse(self, node, lowlinks, indices, index, components, inverse_components, visited, nodes, edges):
     """
     Private helper function to perform DFS and compute components
     of graph (final components in lowlinks)
@@ -459,16 +1176,18 @@ class Graph:
     @param components: the forward components mapping of SCC number to node
     @param inverse_components: the inverse index on components
     @param visited: the visited nodes
+    @param nodes: the nodes to consider
+    @param edges: the forward neighbors mapping to traverse
     """
     indices[node], lowlinks[node] = index[0], index[0]
     index[0] = index[0] + 1
     visited.append(node)
-    if node in self.edges:
-      for e_node in self.edges[node]:
+    if node in edges:
+      for e_node in edges[node]:
         if e_node not in nodes:
           continue
         if e_node not in indices:
-          self.__partial_deletion_traverse(e_node, lowlinks, indices, index, components, inverse_components, visited, nodes)
+          self.__partial_deletion_traverse(e_node, lowlinks, indices, index, components, inverse_components, visited, nodes, edges)
           lowlinks[node] = min(lowlinks[node], lowlinks[e_node])
         elif e_node in visited:
           lowlinks[node] = min(lowlinks[node], indices[e_node])
@@ -485,23 +1204,29 @@ class Graph:
   def __delete_partial_partition_edges(self, components, inverse_components):
     """
     Computes a partial recompute of the edge partitions.
-    For a deletion, SCCs can only be broken, not created, so only 
-    update the nodes that are no longer part of an SCC. For these,
-    just move all of the node's intra-SCC edges to inter-SCC ones.
+    For a deletion, SCCs can only be broken, not created, so only the
+    intra-SCC edges of the split nodes can change: those that now join two
+    different fragments are moved to the inter-SCC edges.
     @param components: the partial components that were re-computed
     @param inverse_components: the inverse index on the partial components
     """
     for node in inverse_components:
+      if node not in self.intra_edges:
+        continue
       scc = inverse_components[node]
-      if len(components[scc]) == 1 and node in self.intra_edges:
-        if node not in self.inter_edges:
-          self.inter_edges[node] = set()
-        self.inter_edges[node] = self.inter_edges[node] | self.intra_edges[node]
-        del self.intra_edges[node]
-      else:
-        # The node was part of an SCC, is still now part of an SCC, 
-        # so its edge is still part of an SCC and no changes need to be made.
+      split_edges = set(e_node for e_node in self.intra_edges[node] if inverse_components[e_node] != scc)
+      if len(split_edges) == 0:
+        # The node's edges all stay inside its fragment
         continue
+      if self.undo is not None:
+        self.__save_set(self.intra_edges, node)
+        self.__save_set(self.inter_edges, node)
+      self.intra_edges[node] -= split_edges
+      if len(self.intra_edges[node]) == 0:
+        del self.intra_edges[node]
+      if node not in self.inter_edges:
+        self.inter_edges[node] = set()
+      self.inter_edges[node] |= split_edges
         
   def __clear_component_node(self, node):
     """
@@ -510,11 +1235,371 @@ class Graph:
     @param node: a Node object
     """
     scc = self.inverse_components[node]
+    if self.undo is not None:
+      self.__save(self.inverse_components, node)
+      self.__save(self.components, scc)
+      self.undo.append((self.components[scc], node))
+    if self.undo is not None:
+      self.__save(self.degrees, node)
     del self.inverse_components[node]
+    del self.degrees[node]
+    self.relabeled.add(node)
+    if self.__changes_wanted():
+      self.removed_nodes[node] = scc
+    if self.operation is not None:
+      self.operation.count('nodes_removed')
     self.components[scc].remove(node)
     if len(self.components[scc]) == 0:
       del self.components[scc]
 
+  ### EXPIRY METHODS ###
+  def __schedule_expiry(self, edge_set, ttl):
+    """
+    Schedules the inserted edges to expire at ttl after the current expiry
+    time, or cancels their expiry if ttl is None. O(|edge_set|) time
+    """
+    if self.expiry is None:
+      self.expiry = timing_wheel.TimingWheel()
+    deadline = self.expiry.now + ttl if ttl is not None else None
+    for edge in edge_set:
+      if self.undo is not None:
+        self.__save(self.expiry, edge.nodes)
+      if deadline is None:
+        self.expiry.pop(edge.nodes)
+      else:
+        self.expiry[edge.nodes] = deadline
+
+  ### TRANSACTION METHODS ###
+  def __check_settled(self):
+    """
+    Previews compare a batch to the current components, so they need them up to
+    date, and settling inside a preview would change the graph
+    """
+    if len(self.pending_edges) > 0 or len(self.pending_sccs) > 0:
+      raise ValueError('Cannot preview with deferred maintenance pending; call settle() first')
+
+  def __save(self, mapping, key):
+    """
+    Logs the value of mapping[key], the first time it is changed in the transaction.
+    The value is kept by reference, so it must be replaced rather than mutated.
+    O(1) time
+    """
+    saved = (id(mapping), key)
+    if saved not in self.undo_saved:
+      self.undo_saved.add(saved)
+      self.undo.append((mapping, key, mapping.get(key, MISSING), None))
+
+  def __save_set(self, mapping, key):
+    """
+    Logs the set at mapping[key] and a copy of its contents, the first time it is
+    changed in the transaction. O(size of the set) time
+    """
+    saved = (id(mapping), key)
+    if saved not in self.undo_saved:
+      self.undo_saved.add(saved)
+      value = mapping.get(key, MISSING)
+      self.undo.append((mapping, key, value, set(value) if value is not MISSING else None))
+
+  def __save_keys(self, mapping, keys):
+    for key in keys:
+      self.__save(mapping, key)
+
+  def __save_attributes(self, *names):
+    """
+    Logs attributes of the graph, copying the contents of sets and lists, which
+    are updated in place
+    """
+    for name in names:
+      saved = (id(self.__dict__), name)
+      if saved not in self.undo_saved:
+        self.undo_saved.add(saved)
+        value = self.__dict__[name]
+        contents = list(value) if isinstance(value, (set, list)) else None
+        self.undo.append((self.__dict__, name, value, contents))
+
+  def __rollback(self):
+    """
+    Replays the undo log backwards. The log holds two kinds of entries:
+      (mapping, key, value, contents): restore mapping[key] to value, or delete it
+        if value is MISSING; if contents is not None, value is a set or list
+        whose contents are restored in place first
+      (container, element): element was added to, or removed from, a set or a
+        sorted list; undo that
+    O(length of the log) time
+    """
+    for entry in reversed(self.undo):
+      if len(entry) == 2:
+        container, element = entry
+        if isinstance(container, list):
+          i = bisect.bisect_left(container, element)
+          if i < len(container) and container[i] == element:
+            del container[i]
+          else:
+            container.insert(i, element)
+        elif element in container:
+          container.remove(element)
+        else:
+          container.add(element)
+        continue
+      mapping, key, value, contents = entry
+      if value is MISSING:
+        mapping.pop(key, None)
+        continue
+      if contents is not None:
+        if isinstance(value, list):
+          value[:] = contents
+        else:
+          value.clear()
+          value.update(contents)
+      mapping[key] = value
+
+  ### STRATA METHODS ###
+  def __enable_strata(self):
+    """
+    Settles, and computes the strata order the first time it is needed
+    """
+    self.settle()
+    if not self.reverse_edges:
+      self.__build_reverse_edges()
+    if self.ranks is None:
+      self.__rebuild_strata()
+      self.last_reranked, self.reranked = self.reranked, set()
+
+  def __rebuild_strata(self):
+    """
+    Topologically sorts the condensation (Kahn's algorithm) and labels the strata in that order
+    O(|V|+|E|) time
+    """
+    successors, in_degree = {}, dict((scc, 0) for scc in self.components)
+    for scc in self.components:
+      successors[scc] = self.__stratum_successors(scc)
+      for e_scc in successors[scc]:
+        in_degree[e_scc] += 1
+    order = [scc for scc in self.components if in_degree[scc] == 0]
+    for scc in order:
+      for e_scc in successors[scc]:
+        in_degree[e_scc] -= 1
+        if in_degree[e_scc] == 0:
+          order.append(e_scc)
+    if self.undo is not None:
+      self.__save_attributes('ranks', 'rank_labels', 'stratum_at')
+    self.ranks, self.rank_labels, self.stratum_at = {}, [], {}
+    for i, scc in enumerate(order):
+      label = (i + 1) * STRATUM_GAP
+      self.ranks[scc] = label
+      self.rank_labels.append(label)
+      self.stratum_at[label] = scc
+    if self.undo is not None:
+      self.__save_attributes('unordered')
+    self.unordered = set()
+    self.reranked = set(order)
+
+  def __maintain_strata(self, check_edges=True):
+    """
+    Applies the change events made since the last call to the strata order: new
+    components are appended, split fragments are ordered in the place of their
+    source, and merged components take the place of their last source. Then the
+    inserted edges are checked against the order and any violation is repaired
+    by reordering only the affected region (Pearce-Kelly).
+    @param check_edges: False while inserted edges may still merge components
+    """
+    if self.ranks is None:
+      return
+    if self.undo is not None:
+      self.__save_attributes('unordered')
+    changes, self.ordered_changes = self.changes[self.ordered_changes:], len(self.changes)
+    for event in changes:
+      if isinstance(event, events.NodesAdded):
+        for scc in set(event.nodes.itervalues()):
+          if scc not in self.ranks:
+            self.__insert_stratum(scc, (self.rank_labels[-1] if len(self.rank_labels) > 0 else 0) + STRATUM_GAP)
+      elif isinstance(event, events.NodesRemoved):
+        for scc in set(event.nodes.itervalues()):
+          if scc in self.ranks and scc not in self.components:
+            self.__remove_stratum(scc)
+      elif isinstance(event, events.Merged):
+        # Predecessors of any source come before the last source, so only the
+        # edges leaving the merged component can be out of order
+        label = max(self.ranks[scc] for scc in event.sources)
+        for scc in event.sources:
+          self.__remove_stratum(scc)
+        self.__insert_stratum(event.target, label)
+        for node in self.components[event.target]:
+          for e_node in self.inter_edges.get(node, ()):
+            self.unordered.add((node, e_node))
+      elif isinstance(event, events.Split):
+        self.__split_stratum(event.source, event.fragments)
+      elif isinstance(event, events.Recomputed):
+        self.__rebuild_strata()
+
+    if not check_edges or len(self.pending_edges) > 0 or len(self.pending_sccs) > 0:
+      return
+    for s_node, e_node in self.unordered:
+      if s_node not in self.edges or e_node not in self.edges[s_node]:
+        continue
+      s_scc, e_scc = self.inverse_components[s_node], self.inverse_components[e_node]
+      if s_scc != e_scc and self.ranks[s_scc] > self.ranks[e_scc]:
+        self.__reorder_strata(s_scc, e_scc)
+    self.unordered = set()
+
+  def __split_stratum(self, source, fragments):
+    """
+    Replaces a split component's stratum by its fragments, topologically sorted
+    among themselves, between the neighboring strata
+    @param source: the split component, which kept some of its nodes
+    @param fragments: a dictionary mapping each new component to its nodes
+    """
+    parts = [source] + fragments.keys()
+    successors, in_degree = {}, dict((scc, 0) for scc in parts)
+    for scc in parts:
+      successors[scc] = set(e_scc for e_scc in self.__stratum_successors(scc) if e_scc in in_degree)
+      for e_scc in successors[scc]:
+        in_degree[e_scc] += 1
+    order = [scc for scc in parts if in_degree[scc] == 0]
+    for scc in order:
+      for e_scc in successors[scc]:
+        in_degree[e_scc] -= 1
+        if in_degree[e_scc] == 0:
+          order.append(e_scc)
+
+    # Find room for the fragments between the neighbors of the source's label
+    while True:
+      i = bisect.bisect_left(self.rank_labels, self.ranks[source])
+      lower = self.rank_labels[i-1] if i > 0 else 0
+      upper = self.rank_labels[i+1] if i + 1 < len(self.rank_labels) else \
+        self.rank_labels[i] + STRATUM_GAP * len(order)
+      if upper - lower > len(order):
+        break
+      self.__relabel_strata(max(STRATUM_GAP, 2 * len(order)))
+    self.__remove_stratum(source)
+    for j, scc in enumerate(order):
+      self.__insert_stratum(scc, lower + (upper - lower) * (j + 1) // (len(order) + 1))
+
+  def __reorder_strata(self, s_scc, e_scc):
+    """
+    Pearce-Kelly repair of an inter-SCC edge s_scc -> e_scc that goes against the
+    order: the strata reachable from e_scc that come before s_scc, and the strata
+    reaching s_scc that come after e_scc, swap places, keeping their own order.
+    Both searches stay between the two labels, since other inserted edges may
+    still be out of order. Time proportional to the edges of the affected strata
+    """
+    upper, lower = self.ranks[s_scc], self.ranks[e_scc]
+    inside = lambda label: lower < label < upper
+    forward = self.__strata_region(e_scc, self.__stratum_successors, inside)
+    backward = self.__strata_region(s_scc, self.__stratum_predecessors, inside)
+    region = sorted(backward, key=self.ranks.get) + sorted(forward, key=self.ranks.get)
+    labels = sorted(self.ranks[scc] for scc in region)
+    if self.undo is not None:
+      self.__save_keys(self.ranks, region)
+      self.__save_keys(self.stratum_at, labels)
+    for scc, label in zip(region, labels):
+      self.ranks[scc] = label
+      self.stratum_at[label] = scc
+    self.reranked.update(region)
+
+  def __strata_region(self, start, neighbors, inside):
+    """
+    @return the strata reachable from start through neighbors whose label is inside the bounds
+    """
+    region, stack = set([start]), [start]
+    while len(stack) > 0:
+      scc = stack.pop()
+      for n_scc in neighbors(scc):
+        if n_scc not in region and inside(self.ranks[n_scc]):
+          region.add(n_scc)
+          stack.append(n_scc)
+    return region
+
+  def __build_reverse_edges(self):
+    """
+    Builds rev_edges from the forward edges, and maintains it from then on. O(|E|) time
+    """
+    if self.undo is not None:
+      self.__save_attributes('rev_edges', 'reverse_edges')
+    rev_edges = {}
+    for s_node, e_nodes in self.edges.iteritems():
+      for e_node in e_nodes:
+        if e_node not in rev_edges:
+          rev_edges[e_node] = set()
+        rev_edges[e_node].add(s_node)
+    self.rev_edges, self.reverse_edges = rev_edges, True
+
+  def __stratum_successors(self, scc):
+    return set(self.inverse_components[e_node] for node in self.components[scc] \
+      for e_node in self.inter_edges.get(node, ()))
+
+  def __stratum_predecessors(self, scc):
+    return set(self.inverse_components[s_node] for node in self.components[scc] \
+      for s_node in self.rev_edges.get(node, ()) if self.inverse_components[s_node] != scc)
+
+  def __insert_stratum(self, scc, label):
+    if self.undo is not None:
+      self.__save(self.ranks, scc)
+      self.__save(self.stratum_at, label)
+      self.undo.append((self.rank_labels, label))
+    bisect.insort(self.rank_labels, label)
+    self.ranks[scc] = label
+    self.stratum_at[label] = scc
+    self.reranked.add(scc)
+
+  def __remove_stratum(self, scc):
+    if self.undo is not None:
+      self.__save(self.ranks, scc)
+      self.__save(self.stratum_at, self.ranks[scc])
+      self.undo.append((self.rank_labels, self.ranks[scc]))
+    label = self.ranks.pop(scc)
+    del self.stratum_at[label]
+    del self.rank_labels[bisect.bisect_left(self.rank_labels, label)]
+
+  def __relabel_strata(self, gap):
+    """
+    Spreads the order labels out evenly, keeping the order. O(number of components) time
+    @param gap: the new spacing of the labels
+    """
+    if self.undo is not None:
+      self.__save_attributes('rank_labels', 'stratum_at')
+      self.__save_keys(self.ranks, self.ranks)
+    self.rank_labels = [(i + 1) * gap for i in xrange(len(self.rank_labels))]
+    stratum_at = {}
+    for label, old_label in zip(self.rank_labels, sorted(self.stratum_at)):
+      stratum_at[label] = scc = self.stratum_at[old_label]
+      self.ranks[scc] = label
+    self.stratum_at = stratum_at
+
+  def __reset_changes(self):
+    """
+    Replaces the change events of the current batch with a Recomputed event,
+    after a full compute or a restore
+    """
+    self.removed_nodes, self.ordered_changes = {}, 0
+    if self.__changes_wanted():
+      self.changes = [events.Recomputed(dict((scc, frozenset(nodes)) for scc, nodes in self.components.items()))]
+
+  def __changes_wanted(self):
+    """
+    @return True if change events must be built, for subscribers or the strata
+    """
+    return len(self.subscribers) > 0 or self.ranks is not None
+
+  def __publish_labels(self):
+    """
+    Hands the nodes relabeled by the current batch to the label listeners, and
+    its change events to the subscribers. Held back until a transaction commits.
+    """
+    if self.undo is not None:
+      return
+    if self.ranks is not None:
+      self.last_reranked, self.reranked = self.reranked, set()
+    if len(self.changes) > 0:
+      changes, self.changes, self.ordered_changes = self.changes, [], 0
+      for callback in self.subscribers:
+        callback(changes)
+    if len(self.relabeled) == 0:
+      return
+    relabeled, self.relabeled = self.relabeled, set()
+    for listener in self.label_listeners:
+      listener(self.inverse_components, relabeled)
+
 #######################
 ### TESTING METHODS ###
 #######################
@@ -525,9 +1610,15 @@ def print_graph(G):
   print "H: %s\n" % G.dynamic_set
 
 def benchmark(edge_set_list):
+  """
+  Times the bulk insertion of each edge set; see benchmark.py for the full suite
+  @param edge_set_list: a list of sets of edges
+  @return the elapsed time in seconds
+  """
   with Timer() as t:
     G1 = Graph()
     for edge_set in edge_set_list:
-      for edge in edge_set:
-        G1.add_edge(edge)
+      G1.optimized_add_edges(edge_set)
   fsecs = float(t.secs)
+  print "Optimized insertion completed in %s s" % fsecs
+  return fsecs
@@ -0,0 +1,236 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### VERSION FOREST FILES, for saving and reopening a rz_graph.DynamicGraph ###
+# A forest file holds the state of a versioned graph instead of its history, so
+# opening it takes time proportional to the size of the graph, not to the number
+# of insertions and deletions that built it. Forest nodes get dense ids: the
+# nodes of the graph (the leaves) first, then the SCC nodes ordered by height, so
+# that every node comes before its parent. The file is the HEADER followed by
+#   parent:  uint32 per forest node, the id of its parent (its own id for a root)
+#   version: uint32 per forest node, the version it first appeared in
+#   roots:   uint32 per root of the forest that is a component
+#   offsets: uint32 per dynamic edge set H_0..H_{t+1}, plus one: the edges of H_i
+#            are the edges offsets[i] to offsets[i+1] - 1
+#   edges:   (source id, target id) uint32 pair per edge, grouped by H_i
+#   values:  the pickled list of the values of the leaves, by id
+import array
+import cPickle as pickle
+import mmap
+import struct
+import sys
+
+import rz_graph
+
+MAGIC = 'RZFRST01'
+HEADER = struct.Struct('<8sQQQQQ')  # magic, leaves, forest nodes, t, edges, roots
+ID = struct.Struct('<I')
+
+def write_forest(path, graph):
+  """
+  O(|V| + |E|) time, plus sorting the SCC nodes by height
+  @param path: the forest file to create
+  @param graph: a rz_graph.DynamicGraph
+  @return the list of leaves, indexed by their id in the file
+  """
+  leaves = list(graph.nodes)
+  heights = _heights(graph)
+  forest = leaves + sorted((node for node in graph.parent if node not in graph.nodes), key=heights.get)
+  ids = dict((node, i) for i, node in enumerate(forest))
+
+  parent = array.array('I', (ids[graph.parent[node]] for node in forest))
+  version = array.array('I', (graph.version[node] for node in forest))
+  roots = array.array('I', (ids[root] for root in graph.roots))
+  offsets, edges = array.array('I', [0]), array.array('I')
+  for i in xrange(graph.t + 2):
+    for edge in graph.dynamic_set.get(i, ()):
+      s_node, e_node = edge.nodes
+      edges.append(ids[s_node])
+      edges.append(ids[e_node])
+    offsets.append(len(edges) // 2)
+
+  with open(path, 'wb') as forest_file:
+    forest_file.write(HEADER.pack(MAGIC, len(leaves), len(forest), graph.t, len(edges) // 2, len(roots)))
+    for data in (parent, version, roots, offsets, edges):
+      if sys.byteorder == 'big':
+        data.byteswap()
+      data.tofile(forest_file)
+    pickle.dump([node.value for node in leaves], forest_file, 2)
+  return leaves
+
+def _heights(graph):
+  """
+  @return a dictionary mapping every forest node to its height in its component
+          tree (0 for the leaves)
+  """
+  heights = dict((node, 0) for node in graph.nodes)
+  for node in graph.parent:
+    stack = [node]
+    while len(stack) > 0:
+      top = stack[-1]
+      if top in heights:
+        stack.pop()
+        continue
+      children = [child for child in top.get_children() if child is not top]
+      pending = [child for child in children if child not in heights]
+      if len(pending) > 0:
+        stack.extend(pending)
+      else:
+        heights[top] = 1 + max(heights[child] for child in children)
+        stack.pop()
+  return heights
+
+def read_forest(path):
+  """
+  Rebuilds a versioned graph. O(|V| + |E|) time, however long its history
+  @param path: a forest file
+  @return (graph, leaves): the rz_graph.DynamicGraph, and the list of its nodes
+          indexed by their id in the file
+  """
+  view = ForestView(path)
+  try:
+    parent, version, roots, offsets, edges = [view.array(name) for name in ('parent', 'version', 'roots', 'offsets', 'edges')]
+    values = view.values()
+  finally:
+    view.close()
+
+  n, num_leaves = len(parent), len(values)
+  forest = [rz_graph.Node(value) for value in values]
+  children = [[] for i in xrange(n)]
+  for i in xrange(n):
+    if parent[i] != i:
+      children[parent[i]].append(i)
+  for i in xrange(num_leaves, n):
+    # Children come before their parents, so they already exist
+    node = rz_graph.Node([forest[child].value for child in children[i]])
+    node.add_children(set(forest[child] for child in children[i]))
+    forest.append(node)
+
+  # Parents come after their children, so a reverse pass finds every root
+  root_of = array.array('I', [0]) * n
+  for i in xrange(n - 1, -1, -1):
+    root_of[i] = i if parent[i] == i else root_of[parent[i]]
+
+  graph = rz_graph.DynamicGraph()
+  graph.t = len(offsets) - 3
+  graph.nodes = set(forest[:num_leaves])
+  graph.parent = dict((forest[i], forest[parent[i]]) for i in xrange(n))
+  graph.version = dict((forest[i], version[i]) for i in xrange(n))
+  graph.roots = dict((forest[root], set()) for root in roots)
+  for i in xrange(num_leaves):
+    leaves = graph.roots.get(forest[root_of[i]])
+    if leaves is not None:
+      leaves.add(forest[i])
+  graph.dynamic_set = {}
+  for i in xrange(len(offsets) - 1):
+    index = rz_graph.EdgeIndex()
+    for j in xrange(offsets[i], offsets[i + 1]):
+      s_id, e_id = edges[2 * j], edges[2 * j + 1]
+      index.add(rz_graph.Edge(forest[s_id], forest[e_id]), (forest[root_of[s_id]], forest[root_of[e_id]]))
+    index.fresh = set()
+    graph.dynamic_set[i] = index
+  return graph, forest[:num_leaves]
+
+class ForestView:
+  """
+  A read-only, memory-mapped forest file that answers version queries directly
+  from the file, without building the graph. Nodes are given by their id.
+  """
+  def __init__(self, path):
+    self.path = path
+    self.file = open(path, 'rb')
+    self.memory = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, self.num_leaves, self.num_nodes, self.t, self.num_edges, num_roots = HEADER.unpack_from(self.memory, 0)
+    if magic != MAGIC:
+      self.close()
+      raise IOError('Not a forest file: %s' % path)
+    self.sections = {}          # Maps array name to (offset, length, typecode)
+    offset = HEADER.size
+    for name, length, typecode in (('parent', self.num_nodes, 'I'), ('version', self.num_nodes, 'I'),
+        ('roots', num_roots, 'I'), ('offsets', self.t + 3, 'I'), ('edges', 2 * self.num_edges, 'I')):
+      self.sections[name] = (offset, length, typecode)
+      offset += length * array.array(typecode).itemsize
+    self.values_offset = offset
+    if len(self.memory) < offset:
+      self.close()
+      raise IOError('Truncated forest file: %s' % path)
+    self.parent_offset = self.sections['parent'][0]
+    self.version_offset = self.sections['version'][0]
+    self.ids = None             # Maps leaf value to id, loaded on first use
+
+  def query(self, u, v, i):
+    """
+    O(h) time, where h is the height of the trees of u and v, as DynamicGraph.query
+    @param u, v: two leaf ids
+    @param i: the version of the graph to query
+    @return True if u, v are in the same SCC in version i of the graph
+    """
+    lca = self.__lca(u, v)
+    return lca is not None and self.__read(self.version_offset, lca) <= i
+
+  def version_of(self, node):
+    """
+    @param node: a forest node id
+    @return the version the node first appeared in
+    """
+    return self.__read(self.version_offset, node)
+
+  def node_id(self, value):
+    """
+    Unpickles the leaf values on first use. O(1) time afterwards
+    @param value: the value of a node of the graph
+    @return its leaf id, or None if it is not in the file
+    """
+    if self.ids is None:
+      self.ids = dict((leaf, i) for i, leaf in enumerate(self.values()))
+    return self.ids.get(value)
+
+  def values(self):
+    """
+    @return the list of the values of the leaves, by id
+    """
+    return pickle.loads(self.memory[self.values_offset:])
+
+  def array(self, name):
+    """
+    Copies a whole section out of the file
+    @param name: 'parent', 'version', 'roots', 'offsets' or 'edges'
+    @return an array.array
+    """
+    offset, length, typecode = self.sections[name]
+    data = array.array(typecode)
+    data.fromstring(self.memory[offset:offset + length * data.itemsize])
+    if sys.byteorder == 'big':
+      data.byteswap()
+    return data
+
+  def close(self):
+    self.memory.close()
+    self.file.close()
+
+  #######################
+  ### PRIVATE METHODS ###
+  #######################
+
+  def __read(self, offset, node):
+    if not 0 <= node < self.num_nodes:
+      raise ValueError('No such node id: %s' % node)
+    return ID.unpack_from(self.memory, offset + ID.size * node)[0]
+
+  def __lca(self, u, v):
+    """
+    @return the id of the lowest common ancestor of u and v, or None
+    """
+    traversed = set([u])
+    parent = self.__read(self.parent_offset, u)
+    while parent != u:
+      u = parent
+      traversed.add(u)
+      parent = self.__read(self.parent_offset, u)
+    if v in traversed:
+      return v
+    parent = self.__read(self.parent_offset, v)
+    while parent != v:
+      v = parent
+      if v in traversed:
+        return v
+      parent = self.__read(self.parent_offset, v)
+    return None
@@ -0,0 +1,165 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### SYNTHETIC GRAPHS AND WORKLOADS, for benchmarking the graph implementations ###
+# Graphs are lists of (u, v) integer pairs over the nodes 0..n-1, without self loops
+# or duplicates. Every generator is deterministic for a given seed.
+import random
+
+def random_graph(n, m, seed=0):
+  """
+  Uniformly random directed graph with n nodes and (at most) m edges
+  """
+  rand = random.Random(seed)
+  edges = set()
+  for i in xrange(20 * m):
+    if len(edges) >= m:
+      break
+    u, v = rand.randrange(n), rand.randrange(n)
+    if u != v:
+      edges.add((u, v))
+  return _shuffled(edges, rand)
+
+def power_law_graph(n, m, seed=0, exponent=2.1):
+  """
+  Directed graph whose endpoints are drawn from a Zipf-like distribution, giving
+  a few hub nodes with very high degree
+  @param exponent: the exponent of the degree distribution (larger is less skewed)
+  """
+  rand = random.Random(seed)
+  weights = [(i + 1) ** (-1.0 / (exponent - 1)) for i in xrange(n)]
+  cumulative, total = [], 0.0
+  for weight in weights:
+    total += weight
+    cumulative.append(total)
+  labels = range(n)
+  rand.shuffle(labels)
+
+  def draw():
+    x = rand.random() * total
+    lo, hi = 0, n - 1
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if cumulative[mid] < x:
+        lo = mid + 1
+      else:
+        hi = mid
+    return labels[lo]
+
+  edges = set()
+  for i in xrange(20 * m):
+    if len(edges) >= m:
+      break
+    u, v = draw(), draw()
+    if u != v:
+      edges.add((u, v))
+  return _shuffled(edges, rand)
+
+def long_chain(n, seed=0):
+  """
+  A single path through all n nodes (deep traversals, no non-trivial SCCs)
+  """
+  rand = random.Random(seed)
+  order = range(n)
+  rand.shuffle(order)
+  return _shuffled([(order[i], order[i+1]) for i in xrange(n - 1)], rand)
+
+def small_cycles(n, cycle_size=4, cross_edges=None, seed=0):
+  """
+  Many disjoint cycles of cycle_size nodes, joined by forward-only edges so that
+  every cycle stays its own SCC
+  @param cross_edges: number of edges between cycles (defaults to n / cycle_size)
+  """
+  rand = random.Random(seed)
+  order = range(n)
+  rand.shuffle(order)
+  edges = set()
+  cycles = [order[i:i+cycle_size] for i in xrange(0, n, cycle_size)]
+  for cycle in cycles:
+    if len(cycle) > 1:
+      for i in xrange(len(cycle)):
+        edges.add((cycle[i], cycle[(i + 1) % len(cycle)]))
+  if cross_edges is None:
+    cross_edges = len(cycles)
+  for i in xrange(cross_edges):
+    a, b = sorted(rand.sample(xrange(len(cycles)), 2))
+    edges.add((rand.choice(cycles[a]), rand.choice(cycles[b])))
+  return _shuffled(edges, rand)
+
+def giant_scc(n, m, seed=0):
+  """
+  One cycle through all n nodes plus random chords: a single SCC with (at most) m edges
+  """
+  rand = random.Random(seed)
+  order = range(n)
+  rand.shuffle(order)
+  edges = set((order[i], order[(i + 1) % n]) for i in xrange(n))
+  for i in xrange(20 * m):
+    if len(edges) >= m:
+      break
+    u, v = rand.randrange(n), rand.randrange(n)
+    if u != v:
+      edges.add((u, v))
+  return _shuffled(edges, rand)
+
+GENERATORS = {
+  'random': lambda n, seed: random_graph(n, 4 * n, seed),
+  'power_law': lambda n, seed: power_law_graph(n, 4 * n, seed),
+  'long_chain': lambda n, seed: long_chain(n, seed),
+  'small_cycles': lambda n, seed: small_cycles(n, seed=seed),
+  'giant_scc': lambda n, seed: giant_scc(n, 2 * n, seed),
+}
+
+### WORKLOADS ###
+# A workload is a list of ('add' or 'remove', list of edges) batches. Edges are
+# only added while absent and only removed while present.
+
+def bulk_load(edges, batch_size=None, seed=0):
+  """
+  All edges in a single insertion batch
+  """
+  return [('add', list(edges))]
+
+def streaming_insert(edges, batch_size=64, seed=0):
+  """
+  All edges, inserted batch_size at a time
+  """
+  return [('add', edges[i:i+batch_size]) for i in xrange(0, len(edges), batch_size)]
+
+def churn(edges, batch_size=64, seed=0):
+  """
+  Loads half the edges, then alternates inserting a batch of the remaining edges
+  with deleting a random batch of the present ones
+  """
+  rand = random.Random(seed)
+  half = len(edges) // 2
+  present, pending = list(edges[:half]), list(edges[half:])
+  batches = [('add', list(present))]
+  while len(pending) > 0:
+    batch, pending = pending[:batch_size], pending[batch_size:]
+    batches.append(('add', batch))
+    present.extend(batch)
+    rand.shuffle(present)
+    batch, present = present[:batch_size], present[batch_size:]
+    batches.append(('remove', batch))
+  return batches
+
+def delete_heavy(edges, batch_size=64, seed=0):
+  """
+  Loads every edge, then deletes them all batch_size at a time in random order
+  """
+  rand = random.Random(seed)
+  order = list(edges)
+  rand.shuffle(order)
+  return [('add', list(edges))] + \
+    [('remove', order[i:i+batch_size]) for i in xrange(0, len(order), batch_size)]
+
+WORKLOADS = {
+  'bulk_load': bulk_load,
+  'streaming_insert': streaming_insert,
+  'churn': churn,
+  'delete_heavy': delete_heavy,
+}
+
+def _shuffled(edges, rand):
+  edges = sorted(edges)
+  rand.shuffle(edges)
+  return edges
@@ -0,0 +1,156 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### INSTRUMENTATION, per-operation counters and phase timings for SCC maintenance ###
+# A graph with instrumentation set to None (the default) only pays one attribute
+# check per operation; counters are derived from structures the maintenance code
+# builds anyway, so nothing is counted per node or per edge.
+import functools
+import time
+
+class Histogram:
+  """
+  Cumulative histogram with power-of-two buckets; bucket b counts values v
+  with 2^(b-1) <= v < 2^b (bucket 0 counts values below 1)
+  """
+  def __init__(self):
+    self.buckets = {}
+    self.count = 0
+    self.total = 0
+    self.max = 0
+
+  def add(self, value):
+    """
+    O(1) time
+    @param value: a non-negative number
+    """
+    bucket = int(value).bit_length() if value >= 1 else 0
+    self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+    self.count += 1
+    self.total += value
+    self.max = max(self.max, value)
+
+  def percentile(self, p):
+    """
+    @param p: the percentile, between 0 and 100
+    @return an upper bound on the p-th percentile (the top of its bucket)
+    """
+    seen, target = 0, self.count * p / 100.0
+    for bucket in sorted(self.buckets):
+      seen += self.buckets[bucket]
+      if seen >= target:
+        return min(self.max, 2 ** bucket)
+    return self.max
+
+  def to_dict(self):
+    return {
+      'count': self.count, 'total': self.total, 'max': self.max,
+      'p50': self.percentile(50), 'p99': self.percentile(99),
+      'buckets': dict((str(2 ** bucket), n) for bucket, n in self.buckets.items()),
+    }
+
+class Operation:
+  """
+  The counters and phase timings of one public operation (e.g. one call to
+  optimized_add_edges). Handed to the instrumentation hooks when it ends.
+  """
+  def __init__(self, name):
+    self.name = name
+    self.path = None          # The maintenance path taken, e.g. 'maintenance' or 'full'
+    self.counters = {}        # Maps counter name to count
+    self.timings = {}         # Maps phase name to seconds
+    self.start = time.time()
+    self.seconds = 0.0
+
+  def count(self, name, n=1):
+    self.counters[name] = self.counters.get(name, 0) + n
+
+  def phase(self, name, start):
+    """
+    Adds the time elapsed since start to a phase
+    @param name: the phase name, e.g. 'traversal'
+    @param start: the time.time() when the phase started
+    """
+    self.timings[name] = self.timings.get(name, 0.0) + time.time() - start
+
+class Instrumentation:
+  """
+  Collects operations from one or more graphs into cumulative counters and
+  histograms, and passes each finished operation to the registered hooks.
+  """
+  def __init__(self, hooks=()):
+    """
+    @param hooks: callables taking a finished Operation
+    """
+    self.hooks = list(hooks)
+    self.counters = {}        # Maps 'op.counter' (and 'op.path.<path>') to cumulative count
+    self.histograms = {}      # Maps 'op.counter' or 'op.phase_us' to a Histogram
+
+  def add_hook(self, hook):
+    """
+    @param hook: a callable taking a finished Operation
+    """
+    self.hooks.append(hook)
+
+  def begin(self, name):
+    return Operation(name)
+
+  def end(self, operation):
+    """
+    Accumulates a finished operation and hands it to the hooks
+    @param operation: an Operation
+    """
+    operation.seconds = time.time() - operation.start
+    name = operation.name
+    self.__count(name + '.calls', 1)
+    if operation.path is not None:
+      self.__count('%s.path.%s' % (name, operation.path), 1)
+    self.__histogram(name + '.latency_us', operation.seconds * 1e6)
+    for counter, n in operation.counters.items():
+      self.__count('%s.%s' % (name, counter), n)
+      self.__histogram('%s.%s' % (name, counter), n)
+    for phase, seconds in operation.timings.items():
+      self.__histogram('%s.%s_us' % (name, phase), seconds * 1e6)
+    for hook in self.hooks:
+      hook(operation)
+
+  def report(self):
+    """
+    @return a JSON-serializable summary of every counter and histogram
+    """
+    return {
+      'counters': dict(self.counters),
+      'histograms': dict((name, histogram.to_dict()) for name, histogram in self.histograms.items()),
+    }
+
+  def reset(self):
+    self.counters, self.histograms = {}, {}
+
+  def __count(self, name, n):
+    self.counters[name] = self.counters.get(name, 0) + n
+
+  def __histogram(self, name, value):
+    if name not in self.histograms:
+      self.histograms[name] = Histogram()
+    self.histograms[name].add(value)
+
+def instrumented(name):
+  """
+  Decorator for the public operations of an instrumentable graph: the graph
+  must have an instrumentation attribute (None when disabled) and an operation
+  attribute holding the Operation in progress. Nested operations are counted
+  as part of the outermost one.
+  @param name: the operation name used in counters and histograms
+  """
+  def decorate(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+      instrumentation = self.instrumentation
+      if instrumentation is None or self.operation is not None:
+        return method(self, *args, **kwargs)
+      self.operation = instrumentation.begin(name)
+      try:
+        return method(self, *args, **kwargs)
+      finally:
+        operation, self.operation = self.operation, None
+        instrumentation.end(operation)
+    return wrapper
+  return decorate
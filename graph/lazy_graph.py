@@ -0,0 +1,259 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### LAZY COMPONENTS, for graphs queried only around a few seed nodes ###
+# A LazyGraph keeps the edges of a graph like fd_graph.Graph, but no component
+# labels until they are asked for. A query on a node that is not labeled yet runs
+# a Tarjan pass over the nodes reachable from it and labels all of them: that set
+# is a region, and it holds the whole component of each of its nodes. The pass
+# stops at nodes labeled by earlier regions, since the component of a labeled node
+# cannot reach back into unlabeled nodes, so a query costs only the part of its
+# neighborhood that is not labeled yet.
+#
+# The labeled nodes are closed under forward edges. An update only changes the
+# components of a region if it inserts or deletes an edge out of one of its nodes;
+# that region is dropped, along with the regions whose pass stopped at it (their
+# components may now run through it), and the next query labels them again. Edges
+# whose source is not labeled never drop anything.
+import fd_graph
+
+class LazyGraph:
+  """
+  Class to represent a DIRECTED graph whose components are computed on demand,
+  one region at a time, and memoized until an update touches the region
+  """
+  def __init__(self, edges=set()):
+    """
+    @param edges: optional input set or list of edges to be inserted
+    """
+    self.edges = {}               # Maps node to set of forward neighbors
+    self.rev_edges = {}           # Maps node to set of backwards neighbors
+    self.degrees = {}             # Node registry: maps every node to its (in degree, out degree)
+    self.explicit_nodes = set()   # Nodes added by add_node, which stay without edges
+    self.components = {}          # Maps component number to its set of nodes, for the labeled nodes
+    self.inverse_components = {}  # Maps each labeled node to its component number
+    self.scc_num = 0              # Next available component number
+
+    self.region_of = {}           # Maps each labeled node to its region
+    self.regions = {}             # Maps region number to the set of nodes it labeled
+    self.downstream = {}          # Maps region to the earlier regions its pass stopped at
+    self.upstream = {}            # Maps region to the later regions whose pass stopped at it
+    self.region_num = 0           # Next available region number
+
+    self.nodes_visited = 0        # Nodes labeled by all the passes so far
+    self.regions_dropped = 0      # Regions dropped by updates so far
+
+    self.optimized_add_edges(edges)
+
+  def add_edge(self, edge):
+    """
+    O(1) time, plus dropping the region of the source if it is labeled
+    """
+    s_node, e_node = edge.nodes
+    if s_node in self.edges and e_node in self.edges[s_node]:
+      return
+    self.__drop_region(s_node)
+    if s_node not in self.edges:
+      self.edges[s_node] = set()
+    self.edges[s_node].add(e_node)
+    if e_node not in self.rev_edges:
+      self.rev_edges[e_node] = set()
+    self.rev_edges[e_node].add(s_node)
+    in_degree, out_degree = self.degrees.get(s_node, (0, 0))
+    self.degrees[s_node] = (in_degree, out_degree + 1)
+    in_degree, out_degree = self.degrees.get(e_node, (0, 0))
+    self.degrees[e_node] = (in_degree + 1, out_degree)
+
+  def optimized_add_edges(self, edge_set):
+    """
+    Bulk edge insertion: O(1) time per edge, no component is computed
+    @param edge_set: a set of edges to be added to the graph
+    """
+    for edge in edge_set:
+      self.add_edge(edge)
+
+  def remove_edge(self, edge):
+    """
+    O(1) time, plus dropping the region of the source if it is labeled
+    """
+    s_node, e_node = edge.nodes
+    if s_node not in self.edges or e_node not in self.edges[s_node]:
+      return
+    self.__drop_region(s_node)
+    self.edges[s_node].remove(e_node)
+    if len(self.edges[s_node]) == 0:
+      del self.edges[s_node]
+    self.rev_edges[e_node].remove(s_node)
+    if len(self.rev_edges[e_node]) == 0:
+      del self.rev_edges[e_node]
+    in_degree, out_degree = self.degrees[s_node]
+    self.degrees[s_node] = (in_degree, out_degree - 1)
+    in_degree, out_degree = self.degrees[e_node]
+    self.degrees[e_node] = (in_degree - 1, out_degree)
+    # A node left without edges leaves the graph, unless it was added by add_node
+    for node in edge.nodes:
+      if node in self.degrees and self.degrees[node] == (0, 0) and node not in self.explicit_nodes:
+        self.__drop_region(node)
+        del self.degrees[node]
+
+  def optimized_remove_edges(self, edge_set):
+    """
+    Bulk edge removal: O(1) time per edge, no component is computed
+    @param edge_set: a set of edges to be removed
+    """
+    for edge in edge_set:
+      self.remove_edge(edge)
+
+  def get_nodes(self):
+    """
+    O(|V|) time to retrieve all nodes in the graph
+    """
+    return set(self.degrees)
+
+  def degree(self, node):
+    """
+    O(1) time
+    @param node: a Node object
+    @return the (in degree, out degree) pair of the node, or None if it is not in the graph
+    """
+    return self.degrees.get(node)
+
+  def add_node(self, node):
+    """
+    Adds a node, which stays in the graph even without edges until remove_node
+    is called. O(1) time
+    @param node: a Node object
+    """
+    self.explicit_nodes.add(node)
+    if node not in self.degrees:
+      self.degrees[node] = (0, 0)
+
+  def remove_node(self, node):
+    """
+    Removes a node and its edges. O(degree) time, plus the regions dropped
+    @param node: a Node object
+    """
+    if node not in self.degrees:
+      return
+    self.explicit_nodes.discard(node)
+    edge_set = set(fd_graph.Edge(node, e_node) for e_node in self.edges.get(node, ()))
+    edge_set.update(fd_graph.Edge(s_node, node) for s_node in self.rev_edges.get(node, ()) if s_node is not node)
+    self.optimized_remove_edges(edge_set)
+    if node in self.degrees:
+      self.__drop_region(node)
+      del self.degrees[node]
+
+  def component_of(self, node):
+    """
+    O(1) time if the node is labeled, else the time of a pass over the unlabeled
+    nodes reachable from it
+    @param node: a Node object
+    @return the component number of the node, or None if it is not in the graph.
+            Numbers hold until the node's region is dropped
+    """
+    if node not in self.degrees:
+      return None
+    if node not in self.inverse_components:
+      self.__label_region(node)
+    return self.inverse_components[node]
+
+  def same_component(self, u, v):
+    """
+    See component_of
+    @param u, v: two Node objects
+    @return True if u, v are in the same SCC
+    """
+    scc = self.component_of(u)
+    return scc is not None and scc == self.component_of(v)
+
+  def component(self, node):
+    """
+    See component_of
+    @param node: a Node object
+    @return the set of nodes in the component of the node (not to be modified), or
+            None if it is not in the graph
+    """
+    scc = self.component_of(node)
+    return self.components[scc] if scc is not None else None
+
+  def invalidate(self):
+    """
+    Drops every region, e.g. to free the memory of the labels
+    """
+    self.components, self.inverse_components = {}, {}
+    self.region_of, self.regions = {}, {}
+    self.downstream, self.upstream = {}, {}
+
+  #######################
+  ### PRIVATE METHODS ###
+  #######################
+
+  def __label_region(self, root):
+    """
+    Tarjan's algorithm from one node, iterative, over the nodes that are not
+    labeled yet. O(nodes visited + their edges) time
+    """
+    region = self.region_num
+    self.region_num += 1
+    nodes, downstream = set(), set()
+    indices, lowlinks = { root: 0 }, { root: 0 }
+    stack, on_stack = [root], set([root])
+    work = [(root, iter(self.edges.get(root, ())))]
+    while len(work) > 0:
+      node, e_nodes = work[-1]
+      for e_node in e_nodes:
+        if e_node in indices:
+          if e_node in on_stack:
+            lowlinks[node] = min(lowlinks[node], indices[e_node])
+        elif e_node in self.inverse_components:
+          # Labeled by an earlier region, whose components cannot reach this node
+          downstream.add(self.region_of[e_node])
+        else:
+          indices[e_node] = lowlinks[e_node] = len(indices)
+          stack.append(e_node)
+          on_stack.add(e_node)
+          work.append((e_node, iter(self.edges.get(e_node, ()))))
+          break
+      else:
+        work.pop()
+        if len(work) > 0:
+          parent = work[-1][0]
+          lowlinks[parent] = min(lowlinks[parent], lowlinks[node])
+        if lowlinks[node] == indices[node]:
+          component = set()
+          while True:
+            member = stack.pop()
+            on_stack.remove(member)
+            component.add(member)
+            self.inverse_components[member] = self.scc_num
+            self.region_of[member] = region
+            if member is node:
+              break
+          self.components[self.scc_num] = component
+          self.scc_num += 1
+          nodes.update(component)
+    self.regions[region] = nodes
+    self.downstream[region] = downstream
+    for other in downstream:
+      self.upstream.setdefault(other, set()).add(region)
+    self.nodes_visited += len(nodes)
+
+  def __drop_region(self, node):
+    """
+    Drops the region of a labeled node and, transitively, the regions whose pass
+    stopped at a dropped region. O(nodes dropped) time
+    """
+    if node not in self.region_of:
+      return
+    pending = [self.region_of[node]]
+    while len(pending) > 0:
+      region = pending.pop()
+      nodes = self.regions.pop(region, None)
+      if nodes is None:
+        continue
+      for member in nodes:
+        self.components.pop(self.inverse_components.pop(member), None)
+        del self.region_of[member]
+      for other in self.downstream.pop(region):
+        if other in self.upstream:
+          self.upstream[other].discard(region)
+      pending.extend(self.upstream.pop(region, ()))
+      self.regions_dropped += 1
@@ -0,0 +1,289 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### MULTI-VERSION COMPONENT LABELS, for readers running concurrently with a writer ###
+import collections
+import weakref
+
+PAGE_SIZE = 256               # Labels per page, and components per page of successor sets
+NO_SUCCESSORS = frozenset()
+
+class Epoch:
+  """
+  An immutable version of the node -> component labels, published after a batch.
+
+  A reader pins an epoch simply by holding a reference to it, and leaves by
+  dropping that reference; an epoch (and every page only it refers to) is
+  reclaimed as soon as its last reader leaves.
+  """
+  def __init__(self, number, slots, pages, size, successors=None):
+    """
+    @param number: the epoch number; increases by one per published batch
+    @param slots: the store's node -> slot mapping, shared by all epochs; the slot of
+                  a removed node is only reused once no live epoch still labels it
+    @param pages: a list of label pages; never modified once the epoch is published
+    @param size: the number of slots that existed when the epoch was published
+    @param successors: [optional] the condensation, as a dictionary mapping page number
+                       to a page mapping component to its frozenset of successor
+                       components; never modified once the epoch is published
+    """
+    self.number = number
+    self.slots = slots
+    self.pages = pages
+    self.size = size
+    self.successors = successors
+
+  def component_of(self, node):
+    """
+    O(1) time
+    @param node: a Node object
+    @return the component number of the node in this epoch, or None if it was
+            not in the graph
+    """
+    slot = self.slots.get(node)
+    if slot is None or slot >= self.size:
+      return None
+    return self.pages[slot // PAGE_SIZE][slot % PAGE_SIZE]
+
+  def same_component(self, u, v):
+    """
+    @param u, v: two Node objects
+    @return True if u, v were in the same SCC in this epoch
+    """
+    scc = self.component_of(u)
+    return scc is not None and scc == self.component_of(v)
+
+  def successors_of(self, scc):
+    """
+    O(1) time
+    @param scc: a component number of this epoch
+    @return the frozenset of components that the component has inter-SCC edges to
+    """
+    page = self.successors.get(scc // PAGE_SIZE)
+    return page.get(scc, NO_SUCCESSORS) if page is not None else NO_SUCCESSORS
+
+  def reachable(self, u, v):
+    """
+    Searches the condensation of this epoch from the component of u. Only for
+    epochs of a store that keeps the condensation.
+    O(components reachable from u + their successor sets) time
+    @param u, v: two Node objects
+    @return True if there was a path from u to v in this epoch
+    """
+    source, target = self.component_of(u), self.component_of(v)
+    if source is None or target is None:
+      return False
+    stack, seen = [source], set([source])
+    while len(stack) > 0:
+      scc = stack.pop()
+      if scc == target:
+        return True
+      for e_scc in self.successors_of(scc):
+        if e_scc not in seen:
+          seen.add(e_scc)
+          stack.append(e_scc)
+    return False
+
+class LabelStore:
+  """
+  Multi-version store of a graph's component labels. The writer publishes a new
+  epoch after every batch by copying only the label pages the batch touched;
+  readers pin the current epoch in O(1) time and never block, even while the
+  writer is in the middle of a batch.
+
+  The slot of a removed node is recycled once every live epoch is at least as
+  recent as the removal, so that each of them reads None at the slot until it is
+  reused; the store then grows with the nodes in the graph, not with node churn.
+
+  The store can also publish the condensation of the graph with every epoch, for
+  reachability queries. The writer keeps the number of inter-SCC edges between
+  each pair of components; a publish moves the edges incident to the changed
+  nodes, and the edges recorded with record_edges, from their old components to
+  their new ones, and copies only the successor pages of the components whose
+  successors changed.
+
+  Only one thread may publish; any number of threads may read.
+  """
+  def __init__(self, graph=None, condensation=False):
+    """
+    @param graph: [optional] a fd_graph.Graph to publish the labels of; the store
+                  is registered as one of the graph's label listeners
+    @param condensation: True to also publish the condensation of the graph, which
+                         is then required; the writer must call record_edges before
+                         every batch, and publish_edges after it
+    """
+    if condensation and graph is None:
+      raise ValueError('A condensation needs the graph')
+    self.slots = {}           # Maps node to its slot
+    self.size = 0             # Number of slots handed out so far
+    self.free = []            # Recycled slots, reused before new ones
+    self.removed = {}         # Maps each removed node that still has a slot to the epoch that removed it
+    self.freeing = collections.deque()  # (epoch, node) removals, oldest first
+    self.graph = graph if condensation else None  # The graph whose condensation is published
+    self.counts = {}          # Maps component to {successor component: number of inter-SCC edges}
+    self.added_edges = []     # (s_node, e_node) pairs inserted since the last publish
+    self.removed_edges = []   # (s_node, e_node) pairs deleted since the last publish
+    self.current = Epoch(0, self.slots, [], 0, {} if condensation else None)
+    self.retired = weakref.WeakValueDictionary()  # Maps number to superseded epochs that are still pinned
+    if graph is not None:
+      self.publish(graph.inverse_components, graph.inverse_components.keys())
+      graph.add_label_listener(self.publish)
+
+  def pin(self):
+    """
+    O(1) time; never blocks
+    @return the latest published Epoch
+    """
+    return self.current
+
+  def publish(self, labels, changed):
+    """
+    Publishes a new epoch, copying only the pages of the changed nodes.
+    O(|changed| + |V|/PAGE_SIZE) time
+    @param labels: the writer's mapping of node to component number
+    @param changed: the nodes whose label changed or that were removed
+    """
+    previous = self.current
+    number = previous.number + 1
+    successors = self.__update_condensation(previous, labels, changed) if self.graph is not None else None
+    pages = list(previous.pages)
+    copied = set()
+    for node in changed:
+      slot = self.slots.get(node)
+      label = labels.get(node)
+      if slot is None:
+        if label is None:
+          continue
+        slot = self.__allocate(node)
+      elif label is None:
+        self.removed[node] = number
+        self.freeing.append((number, node))
+      else:
+        self.removed.pop(node, None)
+      page, offset = slot // PAGE_SIZE, slot % PAGE_SIZE
+      if page == len(pages):
+        pages.append([None] * PAGE_SIZE)
+        copied.add(page)
+      elif page not in copied:
+        pages[page] = list(pages[page])
+        copied.add(page)
+      pages[page][offset] = label
+
+    self.retired[previous.number] = previous
+    self.current = Epoch(number, self.slots, pages, self.size, successors)
+    self.__recycle()
+
+  def record_edges(self, added=(), removed=()):
+    """
+    Records the edges a batch is about to insert or delete, for the condensation
+    @param added: (s_node, e_node) pairs that are not in the graph yet
+    @param removed: (s_node, e_node) pairs that are in the graph
+    """
+    self.added_edges.extend(added)
+    self.removed_edges.extend(removed)
+
+  def discard_edges(self):
+    """
+    Forgets the recorded edges, e.g. after a batch that was rolled back
+    """
+    self.added_edges, self.removed_edges = [], []
+
+  def publish_edges(self, labels):
+    """
+    Publishes the recorded edges if the batch relabeled no node, and so was not
+    published by the graph
+    @param labels: the writer's mapping of node to component number
+    """
+    if len(self.added_edges) > 0 or len(self.removed_edges) > 0:
+      self.publish(labels, ())
+
+  def live_epochs(self):
+    """
+    @return the numbers of the current epoch and of older epochs still pinned by readers
+    """
+    return sorted(self.retired.keys()) + [self.current.number]
+
+  #######################
+  ### PRIVATE METHODS ###
+  #######################
+
+  def __update_condensation(self, previous, labels, changed):
+    """
+    Moves the changed edges from their components in the previous epoch to their
+    current ones: the recorded edges, and the edges of the changed nodes.
+    O(recorded edges + edges of the changed nodes + successors of the components
+    whose successors changed) time, or O(|E|) to find the incoming edges of the
+    changed nodes if the graph does not maintain rev_edges
+    @return the successor pages of the new epoch
+    """
+    graph = self.graph
+    added, removed = set(self.added_edges), set(self.removed_edges)
+    self.added_edges, self.removed_edges = [], []
+    edges = added | removed
+    changed = set(changed)
+    for node in changed:
+      edges.update((node, e_node) for e_node in graph.edges.get(node, ()))
+      if graph.reverse_edges:
+        edges.update((s_node, node) for s_node in graph.rev_edges.get(node, ()))
+    if not graph.reverse_edges and len(changed) > 0:
+      edges.update((s_node, e_node) for s_node, e_nodes in graph.edges.iteritems() \
+        for e_node in e_nodes if e_node in changed)
+    touched = set()
+    for s_node, e_node in edges:
+      if (s_node, e_node) not in added:
+        self.__count(previous.component_of(s_node), previous.component_of(e_node), -1, touched)
+      if (s_node, e_node) not in removed:
+        self.__count(labels.get(s_node), labels.get(e_node), 1, touched)
+
+    successors, copied = dict(previous.successors), set()
+    for scc in touched:
+      page = scc // PAGE_SIZE
+      if page not in copied:
+        successors[page] = dict(successors.get(page, ()))
+        copied.add(page)
+      if scc in self.counts:
+        successors[page][scc] = frozenset(self.counts[scc])
+      else:
+        successors[page].pop(scc, None)
+    for page in copied:
+      if len(successors[page]) == 0:
+        del successors[page]
+    return successors
+
+  def __count(self, s_scc, e_scc, delta, touched):
+    """
+    Adds delta to the number of inter-SCC edges from s_scc to e_scc, if the edge
+    joins two components
+    """
+    if s_scc is None or e_scc is None or s_scc == e_scc:
+      return
+    counts = self.counts.setdefault(s_scc, {})
+    count = counts.get(e_scc, 0) + delta
+    if count > 0:
+      counts[e_scc] = count
+    else:
+      del counts[e_scc]
+      if len(counts) == 0:
+        del self.counts[s_scc]
+    touched.add(s_scc)
+
+  def __allocate(self, node):
+    if len(self.free) > 0:
+      slot = self.free.pop()
+    else:
+      slot, self.size = self.size, self.size + 1
+    self.slots[node] = slot
+    return slot
+
+  def __recycle(self):
+    """
+    Frees the slots of the nodes removed no later than the oldest live epoch.
+    O(pinned epochs + slots freed) time
+    """
+    if len(self.freeing) == 0:
+      return
+    oldest = min(self.retired.keys() + [self.current.number])
+    while len(self.freeing) > 0 and self.freeing[0][0] <= oldest:
+      number, node = self.freeing.popleft()
+      # Skip removals superseded by a later removal, or undone by a new label
+      if self.removed.get(node) == number:
+        del self.removed[node]
+        self.free.append(self.slots.pop(node))
@@ -0,0 +1,286 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### GRAPH REGISTRY, for hosting many graphs in one process under a memory budget ###
+# The registry owns one fd_graph.Graph per key (e.g. per tenant) and keeps an
+# estimate of the memory each resident graph takes. When the resident graphs go
+# over the budget, the least recently used ones are written to compressed
+# snapshots in a spill directory and dropped; the next access loads them back.
+#
+# A reloaded graph holds new Node objects with the same values (which must be
+# picklable), and a Node kept from before the spill is not a node of the reloaded
+# graph. The registry keeps an index from value to Node for each resident graph,
+# rebuilt on load, so callers get their nodes with node(key, value) in every use()
+# block instead of keeping Node objects across blocks. Graphs in use, in a
+# transaction, with listeners, subscribers or scheduled expiries are never spilled.
+import collections
+import contextlib
+import cPickle as pickle
+import os
+import threading
+import zlib
+
+import fd_graph
+from wal import CHECKPOINT_HEADER, crc32
+
+NODE_BYTES = 600              # Rough resident size of a node, over all the graph's mappings
+EDGE_BYTES = 500              # Rough resident size of an edge, in both directions and its partition
+
+def footprint(graph):
+  """
+  Estimates the memory held by a graph. O(1) time
+  @param graph: a fd_graph.Graph
+  @return the estimated number of bytes
+  """
+  return NODE_BYTES * len(graph.degrees) + EDGE_BYTES * graph.num_edges
+
+class GraphRegistry:
+  """
+  Graphs by key, with the resident ones kept under a memory budget by spilling
+  the least recently used ones to disk.
+  Use a graph inside `with registry.use(key) as graph:`, getting its nodes with
+  registry.node(key, value); the registry measures it again when the block ends,
+  and spills other graphs if needed.
+  """
+  def __init__(self, directory, budget, measure=footprint, **graph_options):
+    """
+    @param directory: the directory holding the snapshots of the spilled graphs
+    @param budget: the memory budget of the resident graphs, in bytes
+    @param measure: the function estimating the bytes held by a graph
+    @param graph_options: keyword arguments of fd_graph.Graph, for new graphs
+    """
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    self.directory = directory
+    self.budget = budget
+    self.measure = measure
+    self.graph_options = graph_options
+    self.lock = threading.RLock()
+    self.resident = collections.OrderedDict()   # Maps key to its graph, least recently used first
+    self.footprints = {}      # Maps the key of a resident graph to its estimated bytes
+    self.indexes = {}         # Maps the key of a resident graph to its value to Node index
+    self.resident_bytes = 0
+    self.spilled = {}         # Maps the key of a spilled graph to its snapshot path
+    self.in_use = {}          # Maps key to the number of use() blocks holding it
+    self.spills = 0           # Number of graphs written to disk so far
+    self.loads = 0            # Number of graphs read back so far
+
+  def __contains__(self, key):
+    return key in self.resident or key in self.spilled
+
+  def __len__(self):
+    return len(self.resident) + len(self.spilled)
+
+  def keys(self):
+    return self.resident.keys() + self.spilled.keys()
+
+  @contextlib.contextmanager
+  def use(self, key, create=True):
+    """
+    Holds a graph in memory for the duration of a with block, loading it if it
+    was spilled. Other graphs may be spilled when the block ends.
+    @param key: the key of the graph
+    @param create: whether to create an empty graph if there is none for the key
+    """
+    with self.lock:
+      graph = self.__acquire(key, create)
+      self.in_use[key] = self.in_use.get(key, 0) + 1
+    try:
+      yield graph
+    finally:
+      with self.lock:
+        self.in_use[key] -= 1
+        if self.in_use[key] == 0:
+          del self.in_use[key]
+        if key in self.resident:
+          self.__remeasure(key)
+        self.__enforce_budget()
+
+  def node(self, key, value):
+    """
+    The Node of a value in a graph held by a use() block, created if the graph
+    does not have one yet; pass it to the graph to add it. Nodes of a graph must
+    be made here for the index to know them. O(1) time
+    @param key: the key of the graph
+    @param value: the value of the node
+    @return the Node object
+    """
+    with self.lock:
+      if key not in self.in_use:
+        raise ValueError('Graph %r is not in use' % (key,))
+      index = self.indexes[key]
+      node = index.get(value)
+      if node is None:
+        node = index[value] = fd_graph.Node(value)
+      return node
+
+  def add(self, key, graph):
+    """
+    Hands an existing graph to the registry, replacing any graph under the key.
+    Its nodes are indexed by value, which must be unique. O(|V|) time
+    @param key: the key of the graph
+    @param graph: a fd_graph.Graph
+    """
+    with self.lock:
+      self.drop(key)
+      self.__admit(key, graph, graph.get_nodes())
+      self.__enforce_budget()
+
+  def drop(self, key):
+    """
+    Forgets a graph and deletes its snapshot
+    @param key: the key of the graph
+    @return the graph if it was resident, or None
+    """
+    with self.lock:
+      if key in self.in_use:
+        raise ValueError('Graph %r is in use' % (key,))
+      path = self.spilled.pop(key, None)
+      if path is not None:
+        os.remove(path)
+      graph = self.resident.pop(key, None)
+      if graph is not None:
+        self.resident_bytes -= self.footprints.pop(key)
+        del self.indexes[key]
+      return graph
+
+  def spill(self, key):
+    """
+    Writes a resident graph to disk and drops it from memory.
+    O(|V|+|E|) time
+    @param key: the key of the graph
+    @return True if the graph was spilled, False if it cannot be right now
+    """
+    with self.lock:
+      graph = self.resident.get(key)
+      if graph is None or not self.__spillable(key, graph):
+        return False
+      path = self.__path(key)
+      _write_snapshot(path, graph)
+      del self.resident[key]
+      self.resident_bytes -= self.footprints.pop(key)
+      del self.indexes[key]
+      self.spilled[key] = path
+      self.spills += 1
+      return True
+
+  def close(self):
+    """
+    Deletes the snapshots of the spilled graphs; the resident graphs are kept
+    """
+    with self.lock:
+      for path in self.spilled.itervalues():
+        os.remove(path)
+      self.spilled = {}
+
+  #######################
+  ### PRIVATE METHODS ###
+  #######################
+
+  def __acquire(self, key, create):
+    """
+    @return the graph of the key, made the most recently used
+    """
+    if key in self.resident:
+      graph = self.resident.pop(key)
+      self.resident[key] = graph
+    elif key in self.spilled:
+      path = self.spilled.pop(key)
+      graph, nodes = _read_snapshot(path)
+      os.remove(path)
+      self.loads += 1
+      self.__admit(key, graph, nodes)
+    elif create:
+      graph = fd_graph.Graph(**self.graph_options)
+      self.__admit(key, graph, ())
+    else:
+      raise KeyError(key)
+    return graph
+
+  def __admit(self, key, graph, nodes):
+    self.resident[key] = graph
+    self.indexes[key] = dict((node.value, node) for node in nodes)
+    self.footprints[key] = self.measure(graph)
+    self.resident_bytes += self.footprints[key]
+
+  def __remeasure(self, key):
+    size = self.measure(self.resident[key])
+    self.resident_bytes += size - self.footprints[key]
+    self.footprints[key] = size
+
+  def __enforce_budget(self):
+    """
+    Spills the least recently used graphs that can be spilled until the resident
+    graphs fit in the budget (or nothing else can be spilled)
+    """
+    if self.resident_bytes <= self.budget:
+      return
+    for key in self.resident.keys():
+      if self.resident_bytes <= self.budget:
+        return
+      self.spill(key)
+
+  def __spillable(self, key, graph):
+    return key not in self.in_use and graph.undo is None \
+      and len(graph.label_listeners) == 0 and len(graph.subscribers) == 0 \
+      and (graph.expiry is None or len(graph.expiry) == 0)
+
+  def __path(self, key):
+    """
+    Snapshot files are named after a checksum of the key, with a counter
+    to tell apart keys whose checksums collide
+    """
+    name = '%08x' % crc32(pickle.dumps(key, 2))
+    taken = set(self.spilled.itervalues())
+    path, i = os.path.join(self.directory, name + '.graph'), 0
+    while path in taken or os.path.exists(path):
+      i += 1
+      path = os.path.join(self.directory, '%s-%d.graph' % (name, i))
+    return path
+
+def _write_snapshot(path, graph):
+  """
+  Writes a graph, its components and its options to a compressed snapshot,
+  settling it first if it is in DEFERRED mode
+  """
+  graph.settle()
+  nodes = list(graph.get_nodes())
+  ids = dict((node, i) for i, node in enumerate(nodes))
+  edges = []
+  for s_node, e_nodes in graph.edges.iteritems():
+    s_id = ids[s_node]
+    for e_node in e_nodes:
+      edges.append(s_id)
+      edges.append(ids[e_node])
+  state = {
+    'mode': graph.mode,
+    'full_recompute_ratio': graph.full_recompute_ratio,
+    'reverse_edges': graph.reverse_edges,
+    'compressed_inter_edges': graph.compressed_inter_edges,
+    'scc_num': graph.scc_num,
+    'values': [node.value for node in nodes],
+    'edges': edges,
+    'labels': [graph.inverse_components[node] for node in nodes],
+  }
+  payload = zlib.compress(pickle.dumps(state, 2), 1)
+  with open(path + '.tmp', 'wb') as snapshot:
+    snapshot.write(CHECKPOINT_HEADER.pack(len(payload), crc32(payload)))
+    snapshot.write(payload)
+  os.rename(path + '.tmp', path)
+
+def _read_snapshot(path):
+  """
+  @return the graph of a snapshot, with its components restored, and its nodes
+  """
+  with open(path, 'rb') as snapshot:
+    length, checksum = CHECKPOINT_HEADER.unpack(snapshot.read(CHECKPOINT_HEADER.size))
+    payload = snapshot.read(length)
+  if len(payload) < length or crc32(payload) != checksum:
+    raise IOError('Corrupt snapshot: %s' % path)
+  state = pickle.loads(zlib.decompress(payload))
+  graph = fd_graph.Graph(mode=state['mode'], full_recompute_ratio=state['full_recompute_ratio'], \
+    reverse_edges=state['reverse_edges'], compressed_inter_edges=state['compressed_inter_edges'])
+  nodes = [fd_graph.Node(value) for value in state['values']]
+  edges = state['edges']
+  for i in xrange(0, len(edges), 2):
+    graph.add_edge(fd_graph.Edge(nodes[edges[i]], nodes[edges[i+1]]))
+  graph.restore_scc(dict(zip(nodes, state['labels'])), state['scc_num'])
+  return graph, nodes
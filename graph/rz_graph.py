@@ -1,5 +1,10 @@
 # See https://wiki.python.org/moin/TimeComplexity for running times
 ### GRAPH VERSIONING GRAPH, for maintaining versions of graphs across changes ###
+import time
+
+import events
+from instrument import instrumented
+from timer import Timer
 
 class Node:
   """
@@ -73,6 +78,145 @@ class Edge:
   def __str__(self):
     return '[%s %s]' % (str(self.nodes[0]), str(self.nodes[1]))
 
+class EdgeIndex:
+  """
+  A dynamic edge set H_i, with its edges bucketed by the pair of component roots
+  they connect. After a merge only the buckets of the merged roots are looked at
+  again, and edges between different components move a bucket at a time.
+  """
+  def __init__(self):
+    self.buckets = {}         # Maps (s_root, e_root) to the set of edges between the two components
+    self.incident = {}        # Maps root to the keys of its buckets
+    self.fresh = set()        # Keys that were added or re-bucketed since the last split_internal
+    self.size = 0
+
+  def __len__(self):
+    return self.size
+
+  def __iter__(self):
+    for bucket in self.buckets.itervalues():
+      for edge in bucket:
+        yield edge
+
+  def __repr__(self):
+    return repr(set(self))
+
+  def add(self, edge, key):
+    """
+    O(1) time
+    @param edge: an Edge
+    @param key: the (root of its start node, root of its end node) pair
+    """
+    if key not in self.buckets:
+      self.__put(key, set())
+    bucket = self.buckets[key]
+    if edge not in bucket:
+      bucket.add(edge)
+      self.size += 1
+    self.fresh.add(key)
+
+  def rekey(self, roots, find):
+    """
+    Re-buckets the edges of roots that were merged into new components.
+    O(number of their buckets) time, plus the unions of buckets that now share a key
+    @param roots: the former roots
+    @param find: the function mapping a node to its current root
+    """
+    keys = set()
+    for root in roots:
+      keys.update(self.incident.get(root, ()))
+    for key in keys:
+      self.__put((find(key[0]), find(key[1])), self.__take(key))
+
+  def rebuild(self, find, removed=()):
+    """
+    Re-buckets every edge, after the forest was rebuilt. O(|H_i|) time
+    @param find: the function mapping a node to its current root
+    @param removed: [optional] edges to leave out
+    """
+    edges = [edge for edge in self if edge not in removed]
+    self.buckets, self.incident, self.fresh, self.size = {}, {}, set(), 0
+    for edge in edges:
+      s_node, e_node = edge.nodes
+      self.add(edge, (find(s_node), find(e_node)))
+
+  def reachable(self, sources):
+    """
+    O(number of buckets reached) time
+    @param sources: the roots to start from
+    @return the keys of the buckets reachable from the sources, following their edges forward
+    """
+    keys, seen, stack = [], set(sources), list(sources)
+    while len(stack) > 0:
+      root = stack.pop()
+      for key in self.incident.get(root, ()):
+        if key[0] is root:
+          keys.append(key)
+          if key[1] not in seen:
+            seen.add(key[1])
+            stack.append(key[1])
+    return keys
+
+  def split_internal(self):
+    """
+    Takes out the buckets whose edges start and end in the same component; those
+    can only be among the fresh keys. O(number of fresh keys) time
+    @return an EdgeIndex of the taken buckets
+    """
+    internal = EdgeIndex()
+    for key in self.fresh:
+      if key[0] == key[1] and key in self.buckets:
+        internal.__put(key, self.__take(key), False)
+    self.fresh = set()
+    return internal
+
+  def merge(self, other):
+    """
+    Moves every bucket of another index into this one.
+    O(number of buckets of the other index), so merge the smaller index into the larger
+    """
+    for key, bucket in other.buckets.iteritems():
+      self.__put(key, bucket, False)
+    other.buckets, other.incident, other.fresh, other.size = {}, {}, set(), 0
+
+  #######################
+  ### PRIVATE METHODS ###
+  #######################
+
+  def __take(self, key):
+    bucket = self.buckets.pop(key)
+    for root in key:
+      keys = self.incident.get(root)
+      if keys is not None:
+        keys.discard(key)
+        if len(keys) == 0:
+          del self.incident[root]
+    self.size -= len(bucket)
+    return bucket
+
+  def __put(self, key, bucket, fresh=True):
+    """
+    Adds a bucket, uniting it with the bucket already under its key
+    (the smaller set is added to the larger one)
+    """
+    if fresh:
+      self.fresh.add(key)
+    existing = self.buckets.get(key)
+    if existing is None:
+      self.buckets[key] = bucket
+      self.size += len(bucket)
+      for root in key:
+        if root not in self.incident:
+          self.incident[root] = set()
+        self.incident[root].add(key)
+      return
+    self.size -= len(existing)
+    if len(existing) < len(bucket):
+      existing, bucket = bucket, existing
+      self.buckets[key] = existing
+    existing.update(bucket)
+    self.size += len(existing)
+
 class Graph:
   """
   Class to represent a DIRECTED graph using linear space
@@ -163,7 +307,7 @@ class Graph:
         if e_node not in indices:
           self.__traverse(e_node, lowlinks, indices, index, components, visited)
           lowlinks[node] = min(lowlinks[node], lowlinks[e_node])
-        else:
+        elif e_node in visited:
           lowlinks[node] = min(lowlinks[node], indices[e_node])
 
     lowlink = lowlinks[node]
@@ -195,11 +339,15 @@ class DynamicGraph():
     Note: all nodes will be a key in self.parent and self.version
     """
     self.t = 0              # t represents the version of the graph that is most recently represented
-    self.dynamic_set = { 0: set(), 1: set() }   # H (dynamic edge set), where the i-th set is H_i
+    self.dynamic_set = { 0: EdgeIndex(), 1: EdgeIndex() }   # H (dynamic edge set), where the i-th set is H_i
     self.parent = {}        # (key, val) -> (node, parent)
     self.version = {}       # The graph version where each node first appeared
     self.nodes = set()      # The nodes in the original graph, NOT SCC nodes
     self.roots = {}         # The root nodes of component trees in the forest
+    self.instrumentation = None   # An instrument.Instrumentation, or None to disable counters
+    self.operation = None         # The instrument.Operation in progress, if instrumented
+    self.subscribers = []         # Called with the list of change events of every batch
+    self.changes = []             # The change events of this batch, if there are subscribers
 
   def __str__(self):
     graph_str = ""
@@ -209,36 +357,95 @@ class DynamicGraph():
         graph_str += "[%s %s]\n" % (str(s_node), str(e_node))
     return graph_str if graph_str != "" else "Empty graph"
 
+  @instrumented('insert')
   def insert(self, edge_set):
     """
     @param edge_set: a set of edges to be inserted
     If there are new nodes, they must be added to every version of the graph.
     """
+    op = self.operation
+    if op is not None:
+      start = time.time()
+      op.count('edges', len(edge_set))
+      op.path = 'insert'
     self.nodes = self.nodes | self.__edge_set_nodes(edge_set)
     self.t += 1
     self.__populate_nodes(edge_set)
-    self.dynamic_set[self.t] = self.dynamic_set[self.t] | edge_set
-    self.__find_scc(self.dynamic_set[self.t])
-    self.dynamic_set[self.t+1] = set()
-    self.__shift(self.dynamic_set[self.t], self.dynamic_set[self.t+1])
+    if op is not None:
+      op.phase('populate', start)
+    self.__insert_version(edge_set)
+    self.__publish_changes()
     # TODO: Pre-process for LCA queries
 
+  @instrumented('insert_many')
+  def insert_many(self, edge_sets):
+    """
+    Inserts a sequence of edge sets, one version each: the versions, forest and
+    queries are the same as after calling insert on each set in turn. New nodes
+    are populated in one pass, and the roots of the forest (with their leaves)
+    are maintained once at the end instead of after every version, so the
+    intermediate components are never expanded. The change events of all the
+    versions are published as one batch.
+    Only that root maintenance is batched: each version still builds its own
+    condensed subgraph and runs __find_scc and __shift over it, so the time is
+    close to that of calling insert in a loop (within 20% when the components
+    are small)
+    @param edge_sets: a sequence of sets of edges, oldest first
+    """
+    op = self.operation
+    edge_sets = list(edge_sets)
+    if op is not None:
+      start = time.time()
+      op.count('edges', sum(len(edge_set) for edge_set in edge_sets))
+      op.count('versions', len(edge_sets))
+      op.path = 'insert_many'
+    first = self.t + 1
+    for version, edge_set in enumerate(edge_sets, first):
+      self.nodes.update(self.__edge_set_nodes(edge_set))
+      self.t = version
+      self.__populate_nodes(edge_set)
+    if op is not None:
+      op.phase('populate', start)
+    touched = set()           # Nodes that became roots in one of the versions
+    merged = set()            # Nodes that stopped being roots
+    for version, edge_set in enumerate(edge_sets, first):
+      self.t = version
+      merged.update(self.__insert_version(edge_set, touched))
+    self.__settle_roots(touched, merged)
+    self.__publish_changes()
+
+  @instrumented('delete')
   def delete(self, edge_set):
     """
     @param edge_set: a set of edges to be deleted
     """
+    if self.operation is not None:
+      self.operation.count('edges', len(edge_set))
+      self.operation.count('versions', self.t)
+      self.operation.path = 'replay'
     #self.parent = dict((node, node) for node in self.parent)  # Set all parent nodes to themselves
     self.parent = dict((node, node) for node in self.nodes)
+    self.roots = {}
 
-    # Recompute the strong components using our dynamic edge partitions
+    # Recompute the strong components using our dynamic edge partitions; the
+    # forest was reset, so each H_i is re-bucketed before it is used
     for i in xrange(1, self.t+1):
-      self.dynamic_set[i] = self.dynamic_set[i] - edge_set
-      self.__find_scc(self.dynamic_set[i])
-      self.__shift(self.dynamic_set[i], self.dynamic_set[i+1])
-
-    self.dynamic_set[self.t+1] = self.dynamic_set[self.t+1] - edge_set
+      self.dynamic_set[i].rebuild(self.__find, edge_set)
+      merged = self.__find_scc(self.dynamic_set[i])
+      self.__shift(i, merged)
+
+    self.dynamic_set[self.t+1].rebuild(self.__find, edge_set)
+    # Nodes whose edges all stayed inter-component are not in any traversed H_i,
+    # but are still components of their own
+    for key in self.dynamic_set[self.t+1].buckets:
+      for root in key:
+        if root not in self.roots:
+          self.roots[root] = set([root])
     self.version = dict((node, version) for node, version in self.version.items() \
       if node in self.parent.keys())
+    if len(self.subscribers) > 0:
+      self.changes = [events.Recomputed(dict((root, frozenset(leaves)) for root, leaves in self.roots.items()))]
+    self.__publish_changes()
     # TODO: Pre-process for LCA queries
 
   def compute_scc(self):
@@ -266,6 +473,20 @@ class DynamicGraph():
     @return a set of all the nodes in the actual graph
     """
     return self.nodes
+
+  def subscribe(self, callback):
+    """
+    Registers a callable that is given the list of change events (see events.py)
+    of every batch; components are identified by their root node in the forest
+    @param callback: a callable taking a list of events
+    """
+    self.subscribers.append(callback)
+
+  def unsubscribe(self, callback):
+    """
+    @param callback: a callable previously passed to subscribe
+    """
+    self.subscribers.remove(callback)
   
   def __get_forest_nodes(self):
     """
@@ -284,32 +505,70 @@ class DynamicGraph():
       u = self.parent[u]
       traversed.add(u)
 
+    if v in traversed:
+      return v
     while self.parent[v] != v:
       v = self.parent[v]
       if v in traversed:
         return v
     return None if v not in traversed else v
 
-  def __find_scc(self, dynamic_edge_set):
+  def __insert_version(self, edge_set, touched=None):
+    """
+    Adds the edges of the current version t to H_t, merges the components they
+    close, and shifts the edges that are still inter-component to H_{t+1}
+    @param edge_set: the inserted edges; their nodes are already populated
+    @param touched: [optional] see __find_scc
+    @return the roots that were merged into new SCC nodes
+    """
+    index = self.dynamic_set.get(self.t)
+    if index is None:
+      index = self.dynamic_set[self.t] = EdgeIndex()
+    sources = set()
+    for edge in edge_set:
+      s_node, e_node = edge.nodes
+      s_root = self.__find(s_node)
+      index.add(edge, (s_root, self.__find(e_node)))
+      sources.add(s_root)
+    # Every new component closes a cycle through an inserted edge
+    merged = self.__find_scc(index, touched, sources)
+    self.dynamic_set[self.t+1] = EdgeIndex()
+    self.__shift(self.t, merged)
+    return merged
+
+  def __find_scc(self, dynamic_edge_set, touched=None, sources=None):
     """
     1. Create a temporary dynamic edge set using the component nodes instead
-        of the actual nodes
+        of the actual nodes: one edge per bucket of the index
     2. Construct a subgraph using these new edges and find their SCCs
     3. Add pointers from the component nodes to their new SCC node(s)
     4. Pre-process the new graph for fast LCA queries
-    @param dynamic_edge_set: a dynamic edge set of the current time step
-    """
+    @param dynamic_edge_set: the EdgeIndex of the current time step, keyed by current roots
+    @param touched: [optional] a set to add the new roots to, instead of maintaining
+                    self.roots; see __settle_roots
+    @param sources: [optional] the roots to traverse from; by default all the buckets
+                    are traversed
+    @return the roots that were merged into new SCC nodes
+    """
+    op = self.operation
+    if op is not None:
+      start = time.time()
+    keys = dynamic_edge_set.buckets if sources is None else dynamic_edge_set.reachable(sources)
+    if op is not None:
+      op.count('edges_traversed', len(keys))
+
     # Create a temporary dynamic edge set
-    temp_dynamic_edge_set = set()
-    for edge in dynamic_edge_set:
-      s_node, e_node = edge.nodes
-      temp_edge = Edge(self.__find(s_node), self.__find(e_node))
-      temp_dynamic_edge_set.add(temp_edge)
+    temp_dynamic_edge_set = set(Edge(s_root, e_root) for s_root, e_root in keys)
 
     # Construct a subgraph out of the edges in the dynamic edge set and find SCCs
     # These newly constructed SCC nodes will always be root nodes (new/bigger SCCs)
     subgraph = self.__construct_subgraph(temp_dynamic_edge_set)
     components = subgraph.compute_scc()
+    if op is not None:
+      op.phase('traversal', start)
+      op.count('nodes_visited', sum(len(component_nodes) for component_nodes in components.itervalues()))
+      start = time.time()
+    merged = []
     for scc in components:
       component_nodes = components[scc]
       component_values = [node.value for node in component_nodes]
@@ -322,9 +581,24 @@ class DynamicGraph():
         for node in component_nodes:
           # union step here?
           self.parent[node] = scc_node
+        merged.extend(component_nodes)
+        if len(self.subscribers) > 0:
+          self.changes.append(events.Merged(scc_node, set(component_nodes)))
+        if op is not None:
+          op.count('components_merged', len(component_nodes))
+          op.count('components_created')
       else:
         scc_node = next(iter(component_nodes))
-      self.__maintain_roots(scc_node, scc_node.get_leaves())
+        if scc_node in self.roots or (touched is not None and scc_node in touched):
+          # Still the same component
+          continue
+      if touched is not None:
+        touched.add(scc_node)
+      else:
+        self.__maintain_roots(scc_node, scc_node.get_leaves())
+    if op is not None:
+      op.phase('forest', start)
+    return merged
 
   def __maintain_roots(self, root, children_set):
     """
@@ -336,6 +610,33 @@ class DynamicGraph():
       self.roots.pop(node, None)
     self.roots[root] = children_set
 
+  def __settle_roots(self, touched, merged):
+    """
+    Maintains the roots once after several versions were inserted. The leaves of
+    a new root are collected by descending only through the nodes created in
+    those versions; the roots it absorbed already know their leaves.
+    O(leaves of the new roots + nodes created) time
+    @param touched: the nodes that became roots in one of the versions
+    @param merged: the nodes that stopped being roots in one of the versions
+    """
+    roots = {}
+    for root in touched:
+      if self.parent[root] != root:
+        continue
+      leaves, stack = set(), [root]
+      while len(stack) > 0:
+        node = stack.pop()
+        if node in self.roots:
+          leaves.update(self.roots[node])
+        elif len(node.child_nodes) == 1:
+          leaves.add(node)
+        else:
+          stack.extend(child for child in node.child_nodes if child is not node)
+      roots[root] = leaves
+    for node in merged:
+      self.roots.pop(node, None)
+    self.roots.update(roots)
+
   def __construct_subgraph(self, edge_set):
     """
     Builds a graph out of the set of edges and returns it
@@ -344,35 +645,62 @@ class DynamicGraph():
     """
     return Graph(edge_set)
 
-  def __shift(self, dynamic_edge_set_1, dynamic_edge_set_2):
-    """
-    Essentially, we want to move the edges in the first edge set into the second
-    if the edge's nodes are not part of the same SCC (an inter-component edge)
-    @param dynamic_edge_set_1: the dynamic edge set for the current time step
-    @param dynamic_edge_set_2: the dynamic edge set for the next time step
-    """
-    edges_to_remove = set()
-    for edge_1 in dynamic_edge_set_1:
-      s_node, e_node = edge_1.nodes
-      if self.__find(s_node) != self.__find(e_node):
-        edges_to_remove.add(edge_1)
-        dynamic_edge_set_2.add(edge_1)
-    for edge in edges_to_remove:
-      dynamic_edge_set_1.remove(edge)
+  def __shift(self, i, merged):
+    """
+    Essentially, we want to move the edges in H_i into H_{i+1} if the edge's
+    nodes are not part of the same SCC (an inter-component edge). Only the
+    buckets of the merged roots are re-bucketed; the buckets that became
+    intra-component stay in H_i, and all others move as a whole, by merging
+    the smaller of the two indexes into the larger.
+    O(buckets of the merged roots + new buckets) time when H_{i+1} is empty
+    @param i: the current time step
+    @param merged: the roots merged into new SCC nodes at this time step
+    """
+    op = self.operation
+    if op is not None:
+      start = time.time()
+    index, following = self.dynamic_set[i], self.dynamic_set[i+1]
+    index.rekey(merged, self.__find)
+    internal = index.split_internal()
+    shifted = len(index)
+    if len(following.buckets) >= len(index.buckets):
+      following.merge(index)
+    else:
+      index.merge(following)
+      self.dynamic_set[i+1] = index
+    self.dynamic_set[i] = internal
+    if op is not None:
+      op.phase('shift', start)
+      op.count('edges_shifted', shifted)
 
   def __populate_nodes(self, edge_set):
     """
     Used for keeping track of nodes that were not previously in the graph
     @param edge_set: the set of edges to look at for nodes to add to dictionaries
     """
+    added = []
     for edge in edge_set:
       s_node, e_node = edge.nodes
       if s_node not in self.parent:
         self.parent[s_node] = s_node
         self.version[s_node] = self.t
+        added.append(s_node)
       if e_node not in self.parent:
         self.parent[e_node] = e_node
         self.version[e_node] = self.t
+        added.append(e_node)
+    if len(self.subscribers) > 0 and len(added) > 0:
+      self.changes.append(events.NodesAdded(dict((node, node) for node in added)))
+
+  def __publish_changes(self):
+    """
+    Hands the change events of the current batch to the subscribers
+    """
+    if len(self.changes) == 0:
+      return
+    changes, self.changes = self.changes, []
+    for callback in self.subscribers:
+      callback(changes)
 
   def __find(self, node):
     """
@@ -390,22 +718,6 @@ class DynamicGraph():
       nodes.add(edge.nodes[1])
     return nodes
 
-import time
-class Timer(object):
-  def __init__(self, verbose=False):
-    self.verbose = verbose
-
-  def __enter__(self):
-    self.start = time.time()
-    return self
-
-  def __exit__(self, *args):
-    self.end = time.time()
-    self.secs = self.end - self.start
-    self.msecs = self.secs * 1000  # millisecs
-    if self.verbose:
-      print 'elapsed time: %f ms' % self.msecs
-
 def print_graph(G):
   print str(G)
   print "Parents: %s\n" % G.parent
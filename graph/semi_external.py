@@ -0,0 +1,294 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### SEMI-EXTERNAL SCC, for graphs whose edges do not fit in memory but whose nodes do ###
+# The edges live in a binary edge file, read through mmap in sequential passes;
+# only a few arrays of one entry per node are kept in memory. An edge file is the
+# HEADER followed by a little-endian (source id, target id) uint32 pair per edge,
+# where node ids are dense in [0, number of nodes).
+#
+# The components are found by rounds of forward-backward coloring:
+#   1. Trim: nodes without incoming or outgoing edges among the unfinished nodes
+#      are components of their own. Degrees are counted in one pass and then
+#      decremented in place as nodes are trimmed, so a pass peels every path
+#      that runs along the file order, not just one layer
+#   2. Color: every unfinished node takes the largest id that reaches it, by
+#      propagating ids forward along the edges until nothing changes. A node
+#      whose color is its own id is the root of its color
+#   3. Backward: the nodes of a color that reach its root (along edges inside
+#      the color) are the root's component; they are labeled and finished
+# Every round finishes at least the component of the largest unfinished id.
+# Colors and marks are also updated in place, and passes alternate between
+# scanning the file forward and backward, so a path listed in either order is
+# crossed in one pass; in the worst case (a path listed in random order) a
+# phase still takes one pass per hop, i.e. O(diameter) passes.
+import array
+import mmap
+import struct
+import sys
+
+MAGIC = 'SCCEDG01'
+HEADER = struct.Struct('<8sQQ')   # magic, number of nodes, number of edges
+PAIR = struct.Struct('<II')
+CHUNK = 1 << 16                   # Edges read per slice of the file
+
+def write_edge_file(path, num_nodes, pairs):
+  """
+  O(|E|) time, O(CHUNK) memory
+  @param path: the edge file to create
+  @param num_nodes: the number of nodes; every id must be below it
+  @param pairs: an iterable of (source id, target id) pairs
+  @return the number of edges written
+  """
+  count = 0
+  with open(path, 'wb') as edge_file:
+    edge_file.write(HEADER.pack(MAGIC, num_nodes, 0))
+    buffer = array.array('I')
+    for s_id, e_id in pairs:
+      buffer.append(s_id)
+      buffer.append(e_id)
+      if len(buffer) >= 2 * CHUNK:
+        count += _flush(edge_file, buffer)
+    count += _flush(edge_file, buffer)
+    edge_file.seek(0)
+    edge_file.write(HEADER.pack(MAGIC, num_nodes, count))
+  return count
+
+def write_graph(path, graph):
+  """
+  Writes the edges of an in-memory graph to an edge file, e.g. to check the
+  semi-external computation against compute_scc
+  @param path: the edge file to create
+  @param graph: a fd_graph.Graph
+  @return the list of nodes, indexed by their id in the file
+  """
+  nodes = list(graph.get_nodes())
+  ids = dict((node, i) for i, node in enumerate(nodes))
+  write_edge_file(path, len(nodes), \
+    ((ids[s_node], ids[e_node]) for s_node, e_nodes in graph.edges.iteritems() for e_node in e_nodes))
+  return nodes
+
+def _flush(edge_file, buffer):
+  if sys.byteorder == 'big':
+    buffer.byteswap()
+  buffer.tofile(edge_file)
+  count = len(buffer) // 2
+  del buffer[:]
+  return count
+
+class EdgeFile:
+  """
+  A read-only, memory-mapped edge file
+  """
+  def __init__(self, path):
+    self.path = path
+    self.file = open(path, 'rb')
+    self.memory = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, self.num_nodes, self.num_edges = HEADER.unpack_from(self.memory, 0)
+    if magic != MAGIC or len(self.memory) < HEADER.size + PAIR.size * self.num_edges:
+      self.close()
+      raise IOError('Not an edge file: %s' % path)
+
+  def __len__(self):
+    return self.num_edges
+
+  def chunks(self, reverse=False):
+    """
+    One sequential pass over the edges
+    @param reverse: whether to hand out the chunks from the end of the file; the
+                    edges inside each chunk stay in file order
+    @return a generator of arrays holding CHUNK edges or fewer, as flat
+            (source id, target id) pairs
+    """
+    firsts = xrange(0, self.num_edges, CHUNK)
+    for first in (reversed(firsts) if reverse else firsts):
+      last = min(self.num_edges, first + CHUNK)
+      chunk = array.array('I')
+      chunk.fromstring(self.memory[HEADER.size + PAIR.size * first:HEADER.size + PAIR.size * last])
+      if sys.byteorder == 'big':
+        chunk.byteswap()
+      yield chunk
+
+  def close(self):
+    self.memory.close()
+    self.file.close()
+
+class SemiExternalSCC:
+  """
+  Computes the strong components of an edge file with O(|V|) memory, in
+  O(|E|) time per pass over the edges. Each phase of a round takes O(diameter)
+  passes, where the diameter is that of the unfinished nodes; paths listed in
+  file order (or its reverse) are crossed in a single pass.
+  """
+  def __init__(self, edge_file, trim_passes=None):
+    """
+    @param edge_file: an EdgeFile
+    @param trim_passes: [optional] the maximum number of trimming passes per round;
+                        by default trimming goes on as long as it finishes nodes
+    """
+    self.edge_file = edge_file
+    self.trim_passes = trim_passes
+    n = edge_file.num_nodes
+    self.labels = array.array('l', [-1]) * n    # Maps node id to its component, -1 until it is finished
+    self.num_components = 0
+    self.passes = 0                             # Passes over the edge file so far
+    self.unfinished = n
+
+  def compute(self):
+    """
+    @return the labels array: the component of node id i is labels[i], and the
+            components are numbered densely from 0 to num_components - 1
+    """
+    n = self.edge_file.num_nodes
+    colors = array.array('l', [0]) * n
+    while self.unfinished > 0:
+      self.__trim()
+      if self.unfinished == 0:
+        break
+      for node in xrange(n):
+        colors[node] = node
+      self.__color(colors)
+      self.__backward(colors)
+    return self.labels
+
+  def inverse_components(self, nodes):
+    """
+    @param nodes: the list of nodes, indexed by their id in the edge file
+    @return (inverse_components, scc_num), as taken by fd_graph.Graph.restore_scc
+    """
+    return dict((node, self.labels[i]) for i, node in enumerate(nodes)), self.num_components
+
+  def components(self, nodes):
+    """
+    @param nodes: the list of nodes, indexed by their id in the edge file
+    @return a dictionary mapping each component number to its set of nodes
+    """
+    components = {}
+    for i, node in enumerate(nodes):
+      scc = self.labels[i]
+      if scc not in components:
+        components[scc] = set()
+      components[scc].add(node)
+    return components
+
+  #######################
+  ### PRIVATE METHODS ###
+  #######################
+
+  def __finish(self, node):
+    self.labels[node] = self.num_components
+    self.num_components += 1
+    self.unfinished -= 1
+
+  def __trim(self):
+    """
+    Finishes the unfinished nodes that have no incoming or no outgoing edge from
+    or to another unfinished node, repeatedly. A node trimmed while scanning edge
+    number t (counting edges over all the passes of the round) is taken out of
+    the degrees of its neighbors by the next visit of each of its edges: the
+    edges t+1 to t+|E|, in this pass or the next one.
+    """
+    n, labels, num_edges = self.edge_file.num_nodes, self.labels, self.edge_file.num_edges
+    in_degree, out_degree = array.array('l', [0]) * n, array.array('l', [0]) * n
+    self.passes += 1
+    for chunk in self.edge_file.chunks():
+      for j in xrange(0, len(chunk), 2):
+        s_id, e_id = chunk[j], chunk[j + 1]
+        if s_id != e_id and labels[s_id] < 0 and labels[e_id] < 0:
+          out_degree[s_id] += 1
+          in_degree[e_id] += 1
+    trimmed_at = array.array('l', [-1]) * n     # Maps node id to the edge number it was trimmed at
+    last = -1
+    for node in xrange(n):
+      if labels[node] < 0 and (in_degree[node] == 0 or out_degree[node] == 0):
+        self.__finish(node)
+        trimmed_at[node] = last = 0
+
+    clock, passes = 0, 1
+    while last >= 0 and last + num_edges > clock and self.unfinished > 0 and \
+        (self.trim_passes is None or passes < self.trim_passes):
+      passes += 1
+      self.passes += 1
+      for chunk in self.edge_file.chunks():
+        for j in xrange(0, len(chunk), 2):
+          clock += 1
+          s_id, e_id = chunk[j], chunk[j + 1]
+          if s_id == e_id:
+            continue
+          s_time, e_time = trimmed_at[s_id], trimmed_at[e_id]
+          if labels[e_id] < 0 and s_time >= 0 and s_time < clock <= s_time + num_edges:
+            in_degree[e_id] -= 1
+            if in_degree[e_id] == 0:
+              self.__finish(e_id)
+              trimmed_at[e_id] = last = clock
+          elif labels[s_id] < 0 and e_time >= 0 and e_time < clock <= e_time + num_edges:
+            out_degree[s_id] -= 1
+            if out_degree[s_id] == 0:
+              self.__finish(s_id)
+              trimmed_at[s_id] = last = clock
+
+  def __color(self, colors):
+    """
+    Propagates the largest id forward until no color changes. Colors are
+    updated in place, so a pass often carries a color along many edges
+    """
+    labels, changed, reverse = self.labels, True, False
+    while changed:
+      changed = False
+      self.passes += 1
+      for chunk in self.edge_file.chunks(reverse):
+        for j in (xrange(len(chunk) - 2, -1, -2) if reverse else xrange(0, len(chunk), 2)):
+          s_id, e_id = chunk[j], chunk[j + 1]
+          if colors[s_id] > colors[e_id] and labels[s_id] < 0 and labels[e_id] < 0:
+            colors[e_id] = colors[s_id]
+            changed = True
+      reverse = not reverse
+
+  def __backward(self, colors):
+    """
+    Marks the nodes that reach the root of their color, and finishes each
+    color's marked nodes as one component
+    """
+    n, labels = self.edge_file.num_nodes, self.labels
+    marked = bytearray(n)
+    for node in xrange(n):
+      if labels[node] < 0 and colors[node] == node:
+        marked[node] = 1
+    changed, reverse = True, False
+    while changed:
+      changed = False
+      self.passes += 1
+      for chunk in self.edge_file.chunks(reverse):
+        for j in (xrange(len(chunk) - 2, -1, -2) if reverse else xrange(0, len(chunk), 2)):
+          s_id, e_id = chunk[j], chunk[j + 1]
+          if marked[e_id] and not marked[s_id] and colors[s_id] == colors[e_id] and labels[s_id] < 0:
+            marked[s_id] = 1
+            changed = True
+      reverse = not reverse
+    roots = {}                # Maps color to its component number
+    for node in xrange(n):
+      if marked[node] and labels[node] < 0:
+        color = colors[node]
+        if color not in roots:
+          roots[color] = self.num_components
+          self.num_components += 1
+        labels[node] = roots[color]
+        self.unfinished -= 1
+
+def semi_external_scc(path, nodes=None, graph=None, trim_passes=None):
+  """
+  Computes the components of an edge file, and optionally hands them to a graph
+  so that incremental maintenance continues from them. The graph must hold the
+  same edges (see write_graph); restoring still takes O(|V|+|E|) time.
+  @param path: the edge file
+  @param nodes: [optional] the list of nodes, indexed by id; required with graph
+  @param graph: [optional] a fd_graph.Graph to restore the components into
+  @return the SemiExternalSCC, holding the dense labels array
+  """
+  edge_file = EdgeFile(path)
+  try:
+    scc = SemiExternalSCC(edge_file, trim_passes)
+    scc.compute()
+  finally:
+    edge_file.close()
+  if graph is not None:
+    graph.restore_scc(*scc.inverse_components(nodes))
+  return scc
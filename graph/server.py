@@ -0,0 +1,262 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### QUERY/UPDATE SERVER, owning one fully dynamic graph ###
+import json
+import Queue
+import SocketServer
+import threading
+import time
+
+import fd_graph
+import mvcc
+
+class Snapshot:
+  """
+  An immutable view of the components and the condensation of the graph after
+  some batch. Nodes are keyed by their values, so a snapshot can be read without
+  touching the graph.
+  """
+  def __init__(self, epoch, nodes, version):
+    """
+    O(1) time: the labels and the condensation are an epoch of the writer's
+    mvcc.LabelStore, which only copies the pages a batch touched
+    @param epoch: the mvcc.Epoch published by the batch
+    @param nodes: the writer's mapping of value to Node, which only grows
+    @param version: the number of batches applied to the graph so far
+    """
+    self.epoch = epoch
+    self.nodes = nodes
+    self.version = version
+
+  def component_of(self, u):
+    """
+    @param u: a node value
+    @return the component number of u, or None if u is not in the graph
+    """
+    node = self.nodes.get(u)
+    return self.epoch.component_of(node) if node is not None else None
+
+  def same_component(self, u, v):
+    """
+    @param u, v: two node values
+    @return True if u, v are in the same SCC
+    """
+    scc = self.component_of(u)
+    return scc is not None and scc == self.component_of(v)
+
+  def reachable(self, u, v):
+    """
+    Searches the condensation from u's component; see mvcc.Epoch.reachable
+    @param u, v: two node values
+    @return True if there is a path from u to v
+    """
+    if u not in self.nodes or v not in self.nodes:
+      return False
+    return self.epoch.reachable(self.nodes[u], self.nodes[v])
+
+class UpdateCoalescer(threading.Thread):
+  """
+  The only thread that mutates the graph. Update requests that arrive within
+  window seconds of each other are applied as a single optimized_add_edges or
+  optimized_remove_edges batch (consecutive requests of the same kind are merged,
+  so insertions and deletions still apply in arrival order). A DEFERRED graph is
+  settled after every batch, and a new snapshot is published, in time
+  proportional to the nodes the batch relabeled and their edges.
+  """
+  def __init__(self, graph, window=0.002):
+    """
+    @param graph: the fd_graph.Graph to maintain
+    @param window: seconds to wait for more updates after the first one arrives
+    """
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.graph = graph
+    self.window = window
+    self.requests = Queue.Queue()
+    self.nodes = dict((node.value, node) for node in graph.get_nodes())  # Maps value to Node
+    self.version = 0
+    self.store = mvcc.LabelStore(graph, condensation=True)
+    self.snapshot = Snapshot(self.store.pin(), self.nodes, self.version)
+
+  def submit(self, op, pairs):
+    """
+    Queues an update and blocks until it has been applied
+    @param op: 'insert' or 'delete'
+    @param pairs: a list of (u, v) node value pairs
+    @return the snapshot version that first reflects the update
+    """
+    return self.__wait({ 'op': op, 'pairs': pairs, 'done': threading.Event() })['version']
+
+  def stop(self):
+    self.requests.put(None)
+
+  def run(self):
+    while True:
+      request = self.requests.get()
+      if request is None:
+        return
+      pending = [request]
+      deadline = time.time() + self.window
+      while True:
+        try:
+          request = self.requests.get(timeout=max(0, deadline - time.time()))
+        except Queue.Empty:
+          break
+        if request is None:
+          self.__apply(pending)
+          return
+        pending.append(request)
+      self.__apply(pending)
+
+  def __apply(self, pending):
+    """
+    Applies the pending requests in arrival order, merging runs of the same op
+    @param pending: a list of queued update requests
+    """
+    start = 0
+    while start < len(pending):
+      end = start
+      while end < len(pending) and pending[end]['op'] == pending[start]['op']:
+        end += 1
+      run = pending[start:end]
+      try:
+        self.__apply_batch(run[0]['op'], [pair for request in run for pair in request['pairs']])
+        self.version += 1
+        self.snapshot = Snapshot(self.store.pin(), self.nodes, self.version)
+        for request in run:
+          request['version'] = self.version
+      except Exception as error:
+        for request in run:
+          request['error'] = error
+      for request in run:
+        request['done'].set()
+      start = end
+
+  def __wait(self, request):
+    """
+    Queues a request and blocks until this thread has handled it
+    @return the request, with its results
+    """
+    self.requests.put(request)
+    request['done'].wait()
+    if 'error' in request:
+      raise request['error']
+    return request
+
+  def __apply_batch(self, op, pairs):
+    """
+    @param op: 'insert' or 'delete'
+    @param pairs: (u, v) node value pairs; duplicates and no-ops are dropped
+    """
+    edges, seen = set(), set()
+    for u, v in pairs:
+      if (u, v) in seen:
+        continue
+      seen.add((u, v))
+      if op == 'insert':
+        present = u in self.nodes and v in self.nodes and self.nodes[v] in self.graph.edges.get(self.nodes[u], ())
+        if not present:
+          edges.add(fd_graph.Edge(self.__node(u), self.__node(v)))
+      elif u in self.nodes and v in self.nodes and self.nodes[v] in self.graph.edges.get(self.nodes[u], ()):
+        edges.add(fd_graph.Edge(self.nodes[u], self.nodes[v]))
+    if len(edges) == 0:
+      return
+    # A failed batch is rolled back, so the recorded edges are dropped with it
+    try:
+      with self.graph.transaction():
+        if op == 'insert':
+          self.store.record_edges(added=[edge.nodes for edge in edges])
+          self.graph.optimized_add_edges(edges)
+        else:
+          self.store.record_edges(removed=[edge.nodes for edge in edges])
+          self.graph.optimized_remove_edges(edges)
+        self.graph.settle()
+    except Exception:
+      self.store.discard_edges()
+      raise
+    self.store.publish_edges(self.graph.inverse_components)
+
+  def __node(self, value):
+    if value not in self.nodes:
+      self.nodes[value] = fd_graph.Node(value)
+    return self.nodes[value]
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+  """
+  Newline-delimited JSON: each request is {"op": ..., "args": [...]} and each
+  response is {"result": ...} or {"error": "..."}.
+  """
+  def handle(self):
+    for line in iter(self.rfile.readline, ''):
+      try:
+        request = json.loads(line)
+        response = { 'result': self.server.dispatch(request['op'], request.get('args', [])) }
+      except Exception as error:
+        response = { 'error': '%s: %s' % (type(error).__name__, error) }
+      self.wfile.write(json.dumps(response) + '\n')
+      self.wfile.flush()
+
+class ThreadedTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+class ThreadedUnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+  daemon_threads = True
+
+class GraphServer:
+  """
+  Serves insert, delete, same_component, component_of and reachable calls for
+  one graph over a Unix socket or TCP. Reads are answered from the latest
+  published snapshot and never wait for the writer.
+  """
+  def __init__(self, address, graph=None, window=0.002):
+    """
+    @param address: a Unix socket path, or a (host, port) tuple for TCP
+    @param graph: [optional] the fd_graph.Graph to serve
+    @param window: update coalescing window in seconds
+    """
+    self.coalescer = UpdateCoalescer(graph if graph is not None else fd_graph.Graph(), window)
+    if isinstance(address, tuple):
+      self.server = ThreadedTCPServer(address, RequestHandler)
+    else:
+      self.server = ThreadedUnixServer(address, RequestHandler)
+    self.server.dispatch = self.dispatch
+    self.address = self.server.server_address
+
+  def dispatch(self, op, args):
+    """
+    @param op: the name of the call
+    @param args: the positional arguments of the call
+    @return the JSON-serializable result of the call
+    """
+    if op == 'insert' or op == 'delete':
+      edges, = args
+      return self.coalescer.submit(op, [(u, v) for u, v in edges])
+    snapshot = self.coalescer.snapshot
+    if op == 'same_component':
+      return snapshot.same_component(*args)
+    if op == 'component_of':
+      return snapshot.component_of(*args)
+    if op == 'reachable':
+      return snapshot.reachable(*args)
+    if op == 'version':
+      return snapshot.version
+    raise ValueError('Unknown op: %s' % op)
+
+  def serve_forever(self):
+    self.coalescer.start()
+    self.server.serve_forever()
+
+  def start(self):
+    """
+    Serves from background threads
+    @return the serving thread
+    """
+    thread = threading.Thread(target=self.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+  def shutdown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    self.coalescer.stop()
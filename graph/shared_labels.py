@@ -0,0 +1,193 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### SHARED-MEMORY COMPONENT LABELS, for read-only query worker processes ###
+import errno
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+MAGIC = 'SCCLBL01'
+HEADER = struct.Struct('<8sQQQ')  # magic, sequence number, capacity, size
+SEQ_OFFSET, CAPACITY_OFFSET, SIZE_OFFSET = 8, 16, 24
+LABEL = struct.Struct('<q')       # A component number, or -1 if the node is not in the graph
+U64 = struct.Struct('<Q')
+NO_COMPONENT = -1
+
+def segment_path(name):
+  """
+  @param name: the name of a shared label segment
+  @return the path of the file backing the segment (in /dev/shm where available)
+  """
+  directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+  return os.path.join(directory, name)
+
+class SharedLabelWriter:
+  """
+  Publishes a graph's node -> component mapping into a shared-memory array of
+  64-bit integers, indexed by node id. The writer process keeps running the
+  incremental maintenance; each batch is published under a seqlock (the sequence
+  number is odd while a batch is being written), so readers in other processes
+  always see the labels of a whole batch.
+  """
+  def __init__(self, name, node_id, graph=None, capacity=1024, replace=False):
+    """
+    @param name: the name of the segment, shared with the readers
+    @param node_id: a function mapping a Node to its integer id (e.g. one returning
+                    node.value); readers look nodes up by the same ids, so they
+                    must be able to compute them without the writer
+    @param graph: [optional] a fd_graph.Graph to publish; the writer is registered
+                  as one of the graph's label listeners
+    @param capacity: the initial number of slots; the segment grows as needed
+    @param replace: whether to replace an existing segment of the same name, e.g.
+                    one left by a writer that died. The old file is unlinked, never
+                    truncated: readers that still have it mapped keep reading its
+                    last labels until they open the new segment
+    """
+    self.path = segment_path(name)
+    self.node_id = node_id
+    self.size = 0             # One past the largest id written so far
+    if replace and os.path.exists(self.path):
+      os.unlink(self.path)
+    try:
+      fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0644)
+    except OSError as error:
+      if error.errno == errno.EEXIST:
+        raise IOError('Shared label segment already exists: %s' % self.path)
+      raise
+    self.file = os.fdopen(fd, 'w+b')
+    self.capacity = 0
+    self.memory = None
+    self.__grow(max(1, capacity))
+    HEADER.pack_into(self.memory, 0, MAGIC, 0, self.capacity, 0)
+    if graph is not None:
+      self.publish(graph.inverse_components, graph.inverse_components.keys())
+      graph.add_label_listener(self.publish)
+
+  def publish(self, labels, changed):
+    """
+    Writes the labels of the changed nodes inside one seqlock write section
+    @param labels: the writer's mapping of node to component number
+    @param changed: the nodes whose label changed or that were removed
+    """
+    updates = []
+    for node in changed:
+      node_id = self.node_id(node)
+      updates.append((node_id, labels.get(node, NO_COMPONENT)))
+      self.size = max(self.size, node_id + 1)
+    if self.size > self.capacity:
+      self.__grow(max(self.size, 2 * self.capacity))
+
+    seq, = U64.unpack_from(self.memory, SEQ_OFFSET)
+    U64.pack_into(self.memory, SEQ_OFFSET, seq + 1)
+    for node_id, scc in updates:
+      LABEL.pack_into(self.memory, HEADER.size + LABEL.size * node_id, scc)
+    U64.pack_into(self.memory, SIZE_OFFSET, self.size)
+    U64.pack_into(self.memory, SEQ_OFFSET, seq + 2)
+
+  def close(self, unlink=True):
+    """
+    @param unlink: whether to remove the segment; readers that still have it
+                   mapped keep working
+    """
+    self.memory.close()
+    self.file.close()
+    if unlink:
+      os.unlink(self.path)
+
+  def __grow(self, capacity):
+    """
+    Resizes the segment; new slots hold NO_COMPONENT
+    @param capacity: the new number of slots
+    """
+    old_capacity = self.capacity
+    self.file.truncate(HEADER.size + LABEL.size * capacity)
+    memory = mmap.mmap(self.file.fileno(), HEADER.size + LABEL.size * capacity)
+    filler = LABEL.pack(NO_COMPONENT)
+    memory[HEADER.size + LABEL.size * old_capacity:] = filler * (capacity - old_capacity)
+    if self.memory is not None:
+      self.memory.close()
+    self.memory, self.capacity = memory, capacity
+    U64.pack_into(self.memory, CAPACITY_OFFSET, capacity)
+
+class SharedLabelReader:
+  """
+  Read-only, zero-copy view of a SharedLabelWriter's segment, for query worker
+  processes. Reads never lock: they retry if the writer published a batch
+  while they were reading, for at most timeout seconds per read.
+  """
+  def __init__(self, name, timeout=1.0):
+    """
+    @param name: the name the writer was created with
+    @param timeout: seconds a read retries before giving up on a writer that
+                    stays in the middle of a batch (e.g. because it died there)
+    """
+    self.path = segment_path(name)
+    self.timeout = timeout
+    self.file = open(self.path, 'rb')
+    self.memory = None
+    self.capacity = 0
+    self.__map()
+
+  def component_of(self, node_id):
+    """
+    O(1) time
+    @param node_id: a node id, as computed by the writer's node_id function
+    @return the component number of the node, or None if it is not in the graph
+    """
+    return self.component_of_many([node_id])[0]
+
+  def same_component(self, u, v):
+    """
+    @param u, v: two node ids
+    @return True if u, v are in the same SCC
+    """
+    u_scc, v_scc = self.component_of_many([u, v])
+    return u_scc is not None and u_scc == v_scc
+
+  def component_of_many(self, node_ids):
+    """
+    Looks up every id against the labels of the same batch.
+    O(len(node_ids)) time
+    @param node_ids: an iterable of node ids
+    @return a list of component numbers (None for nodes not in the graph)
+    @raise IOError if the writer did not finish a batch within the timeout
+    """
+    node_ids = list(node_ids)
+    deadline = time.time() + self.timeout
+    while True:
+      if time.time() > deadline:
+        raise IOError('Shared label writer stalled in the middle of a batch: %s' % self.path)
+      seq, = U64.unpack_from(self.memory, SEQ_OFFSET)
+      if seq % 2 == 1:
+        time.sleep(0)
+        continue
+      capacity, size = struct.unpack_from('<QQ', self.memory, CAPACITY_OFFSET)
+      if capacity > self.capacity:
+        self.__map()
+        continue
+      result = []
+      for node_id in node_ids:
+        scc = NO_COMPONENT
+        if 0 <= node_id < size:
+          scc, = LABEL.unpack_from(self.memory, HEADER.size + LABEL.size * node_id)
+        result.append(scc if scc != NO_COMPONENT else None)
+      if U64.unpack_from(self.memory, SEQ_OFFSET)[0] == seq:
+        return result
+
+  def close(self):
+    self.memory.close()
+    self.file.close()
+
+  def __map(self):
+    """
+    (Re)maps the whole segment, e.g. after the writer grew it
+    """
+    length = os.fstat(self.file.fileno()).st_size
+    memory = mmap.mmap(self.file.fileno(), length, access=mmap.ACCESS_READ)
+    magic, seq, capacity, size = HEADER.unpack_from(memory, 0)
+    if magic != MAGIC:
+      raise IOError('Not a shared label segment: %s' % self.path)
+    if self.memory is not None:
+      self.memory.close()
+    self.memory, self.capacity = memory, min(capacity, (length - HEADER.size) // LABEL.size)
@@ -0,0 +1,146 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### COMPONENT STATISTICS, maintained incrementally from the change events of a graph ###
+# Sizes are kept per component and indexed by size: the distinct sizes are kept
+# sorted, and there are at most O(sqrt(|V|)) of them since the sizes add up to |V|.
+import bisect
+
+import events
+
+class ComponentStats:
+  """
+  Live count, size histogram and largest components of a graph, updated from its
+  change events (see events.py) in time proportional to the change instead of
+  iterating over the components on every read
+  """
+  def __init__(self, graph):
+    """
+    Subscribes to the graph's change events. In DEFERRED mode, the statistics
+    follow the components as of the last settle.
+    @param graph: a fd_graph.Graph
+    """
+    self.graph = graph
+    self.sizes = {}           # Maps component to its number of nodes
+    self.by_size = {}         # Maps size to the set of components of that size
+    self.distinct = []        # The sizes in by_size, sorted
+    self.buckets = {}         # Maps b to the number of components with 2^(b-1) < size <= 2^b
+    self.nodes = 0            # Number of nodes in all components
+    self.__rebuild(graph.components)
+    graph.subscribe(self.update)
+
+  def count(self):
+    """
+    O(1) time
+    @return the number of components
+    """
+    return len(self.sizes)
+
+  def size_of(self, scc):
+    """
+    O(1) time
+    @param scc: a component number
+    @return the number of nodes in the component, or 0 if it does not exist
+    """
+    return self.sizes.get(scc, 0)
+
+  def largest(self, k=1):
+    """
+    O(k) time, plus one step per distinct size visited
+    @param k: the number of components
+    @return a list of (size, component) pairs, largest first
+    """
+    result = []
+    for i in xrange(len(self.distinct) - 1, -1, -1):
+      size = self.distinct[i]
+      for scc in self.by_size[size]:
+        if len(result) == k:
+          return result
+        result.append((size, scc))
+    return result
+
+  def histogram(self):
+    """
+    O(log |V|) time
+    @return a dictionary mapping the upper bound 2^b of each bucket to its number of components
+    """
+    return dict((2 ** bucket, n) for bucket, n in self.buckets.items())
+
+  def to_dict(self, k=10):
+    """
+    @return a JSON-serializable summary, e.g. for a dashboard
+    """
+    return {
+      'components': self.count(), 'nodes': self.nodes,
+      'nontrivial': self.count() - len(self.by_size.get(1, ())),
+      'histogram': dict((str(bound), n) for bound, n in self.histogram().items()),
+      'largest': [size for size, scc in self.largest(k)],
+    }
+
+  def update(self, changes):
+    """
+    Applies the change events of a batch
+    @param changes: a list of events
+    """
+    for event in changes:
+      if isinstance(event, events.NodesAdded):
+        for node, scc in event.nodes.iteritems():
+          self.__resize(scc, self.sizes.get(scc, 0) + 1)
+      elif isinstance(event, events.NodesRemoved):
+        for node, scc in event.nodes.iteritems():
+          self.__resize(scc, self.sizes[scc] - 1)
+      elif isinstance(event, events.Merged):
+        size = 0
+        for scc in event.sources:
+          size += self.sizes[scc]
+          self.__resize(scc, 0)
+        self.__resize(event.target, size)
+      elif isinstance(event, events.Split):
+        for scc, nodes in event.fragments.iteritems():
+          self.__resize(event.source, self.sizes[event.source] - len(nodes))
+          self.__resize(scc, len(nodes))
+      elif isinstance(event, events.Recomputed):
+        self.__rebuild(event.components)
+
+  def close(self):
+    self.graph.unsubscribe(self.update)
+
+  #######################
+  ### PRIVATE METHODS ###
+  #######################
+
+  def __rebuild(self, components):
+    """
+    O(number of components) time
+    @param components: a dictionary mapping component to its nodes
+    """
+    self.sizes, self.by_size, self.distinct, self.buckets, self.nodes = {}, {}, [], {}, 0
+    for scc, nodes in components.iteritems():
+      self.__resize(scc, len(nodes))
+
+  def __resize(self, scc, size):
+    """
+    Moves a component to a new size; size 0 removes it.
+    O(log n) time, plus O(number of distinct sizes) when a size appears or disappears
+    @param scc: a component
+    @param size: its new number of nodes
+    """
+    old = self.sizes.pop(scc, 0)
+    if old > 0:
+      self.by_size[old].remove(scc)
+      if len(self.by_size[old]) == 0:
+        del self.by_size[old]
+        del self.distinct[bisect.bisect_left(self.distinct, old)]
+      self.__bucket(old, -1)
+    if size > 0:
+      self.sizes[scc] = size
+      if size not in self.by_size:
+        self.by_size[size] = set()
+        bisect.insort(self.distinct, size)
+      self.by_size[size].add(scc)
+      self.__bucket(size, 1)
+    self.nodes += size - old
+
+  def __bucket(self, size, n):
+    bucket = (size - 1).bit_length()
+    self.buckets[bucket] = self.buckets.get(bucket, 0) + n
+    if self.buckets[bucket] == 0:
+      del self.buckets[bucket]
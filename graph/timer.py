@@ -0,0 +1,31 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### TIMER, shared by the benchmark helpers ###
+import time
+
+class Timer(object):
+  """
+  Context manager measuring the wall-clock time of its block
+  """
+  def __init__(self, verbose=False):
+    self.verbose = verbose
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, *args):
+    self.end = time.time()
+    self.secs = self.end - self.start
+    self.msecs = self.secs * 1000  # millisecs
+    if self.verbose:
+      print 'elapsed time: %f ms' % self.msecs
+
+def percentile(samples, p):
+  """
+  @param samples: a sorted list of numbers
+  @param p: the percentile, between 0 and 100
+  @return the p-th percentile of the samples (0.0 if there are none)
+  """
+  if len(samples) == 0:
+    return 0.0
+  return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
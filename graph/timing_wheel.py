@@ -0,0 +1,169 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### HIERARCHICAL TIMING WHEEL, for expiring items without scanning them ###
+# Time is counted in ticks of a fixed resolution. Level L has SLOTS slots, each
+# covering SLOTS^L ticks: an item due in fewer than SLOTS^(L+1) ticks waits in
+# level L, and is moved down a level (cascaded) when the wheel reaches the block
+# of ticks its deadline falls in, until it expires from level 0. Items due beyond
+# the top level wait in an overflow set that is rescheduled when the top level
+# wraps around.
+import math
+
+BITS = 6
+SLOTS = 1 << BITS
+
+class TimingWheel:
+  """
+  Maps items to deadlines, and hands back the items whose deadline has passed.
+  Scheduling and cancelling take O(1) time; advancing takes O(expired) time,
+  plus O(SLOTS) per level for every wheel turn it steps through, and is fast
+  forwarded over levels with nothing scheduled.
+  Supports item in wheel, wheel[item] = deadline, wheel.get and wheel.pop.
+  """
+  def __init__(self, resolution=1.0, now=0, levels=4):
+    """
+    @param resolution: the length of a tick, in the units of the deadlines
+    @param now: the current time
+    @param levels: the number of levels; deadlines up to resolution * SLOTS^levels
+                   ahead are scheduled in the wheel, later ones in the overflow
+    """
+    self.resolution = resolution
+    self.tick = int(math.floor(now / float(resolution)))
+    self.now = now
+    self.wheels = [[set() for i in xrange(SLOTS)] for level in xrange(levels)]
+    self.counts = [0] * levels    # Number of items in each level
+    self.overflow = set()         # Items due beyond the top level
+    self.due = set()              # Items scheduled at or before the current tick
+    self.deadlines = {}           # Maps item to its deadline
+    self.where = {}               # Maps item to (level, set it waits in); level -1 for due and overflow
+
+  def __len__(self):
+    return len(self.deadlines)
+
+  def __contains__(self, item):
+    return item in self.deadlines
+
+  def __setitem__(self, item, deadline):
+    """
+    Schedules an item, replacing its previous deadline. O(1) time
+    @param item: a hashable item
+    @param deadline: when it expires, in the units of now
+    """
+    self.pop(item)
+    self.deadlines[item] = deadline
+    self.__place(item)
+
+  def get(self, item, default=None):
+    """
+    @return the deadline of the item, or default if it is not scheduled
+    """
+    return self.deadlines.get(item, default)
+
+  def pop(self, item, default=None):
+    """
+    Cancels an item. O(1) time
+    @return its deadline, or default if it was not scheduled
+    """
+    if item not in self.deadlines:
+      return default
+    self.__unplace(item)
+    return self.deadlines.pop(item)
+
+  def advance(self, now):
+    """
+    Moves the wheel forward to now; the wheel never moves back
+    @param now: the current time
+    @return the set of items whose deadline is at or before now, which are unscheduled
+    """
+    target = int(math.floor(now / float(self.resolution)))
+    self.now = max(self.now, now)
+    expired = self.due
+    self.due = set()
+    for item in expired:
+      del self.deadlines[item]
+      del self.where[item]
+    while self.tick < target:
+      # Fast forward to the next tick at which the lowest occupied level has
+      # something to do; an empty wheel jumps straight to the target
+      step = None
+      for level, count in enumerate(self.counts):
+        if count > 0:
+          step = SLOTS ** level
+          break
+      if step is None and len(self.overflow) == 0:
+        self.tick = target
+        break
+      if step is None:
+        step = SLOTS ** len(self.counts)
+      self.tick = min(target, (self.tick // step + 1) * step)
+      self.__turn(expired)
+    return expired
+
+  #######################
+  ### PRIVATE METHODS ###
+  #######################
+
+  def __to_tick(self, time):
+    """
+    Rounds a deadline up, so that items never expire before their deadline
+    """
+    return int(math.ceil(time / float(self.resolution)))
+
+  def __turn(self, expired):
+    """
+    Cascades the slots whose block starts at the current tick, top level first,
+    then expires the items in the current level 0 slot
+    @param expired: the set to add the expired items to
+    """
+    levels = len(self.counts)
+    if self.tick % (SLOTS ** levels) == 0 and len(self.overflow) > 0:
+      overflow, self.overflow = self.overflow, set()
+      for item in overflow:
+        self.__place(item)
+    for level in xrange(levels - 1, 0, -1):
+      if self.tick % (SLOTS ** level) != 0:
+        continue
+      slot = self.wheels[level][(self.tick >> (BITS * level)) & (SLOTS - 1)]
+      if len(slot) == 0:
+        continue
+      self.counts[level] -= len(slot)
+      items = list(slot)
+      slot.clear()
+      for item in items:
+        self.__place(item)
+    slot = self.wheels[0][self.tick & (SLOTS - 1)]
+    if len(slot) > 0:
+      self.counts[0] -= len(slot)
+      for item in slot:
+        del self.deadlines[item]
+        del self.where[item]
+      expired.update(slot)
+      slot.clear()
+    for item in self.due:
+      del self.deadlines[item]
+      del self.where[item]
+    expired.update(self.due)
+    self.due = set()
+
+  def __place(self, item):
+    """
+    Puts a scheduled item in the set for its deadline, relative to the current tick
+    """
+    deadline = self.__to_tick(self.deadlines[item])
+    delta = deadline - self.tick
+    target, where = self.overflow, -1
+    if delta <= 0:
+      target = self.due
+    else:
+      for level in xrange(len(self.counts)):
+        if delta < SLOTS ** (level + 1):
+          target, where = self.wheels[level][(deadline >> (BITS * level)) & (SLOTS - 1)], level
+          self.counts[level] += 1
+          break
+    target.add(item)
+    self.where[item] = (where, target)
+
+  def __unplace(self, item):
+    level, target = self.where.pop(item)
+    target.remove(item)
+    if level >= 0:
+      self.counts[level] -= 1
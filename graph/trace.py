@@ -0,0 +1,180 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### TRACES, compact binary recordings of the updates and queries applied to a graph ###
+# A trace is the MAGIC header followed by records, each made of varints:
+#   kind byte, microseconds since the previous record, then
+#   ADD/REMOVE:      number of edges, then a (source id, target id) pair per edge
+#   COMPONENT_OF:    a node id
+#   SAME_COMPONENT:  two node ids
+#   ADD_NODE/REMOVE_NODE: a node id (a removal also removes the node's edges)
+# Node ids are handed out densely by the recorder, in the order nodes are first seen.
+import time
+
+MAGIC = 'SCCTRC01'
+
+ADD = ord('A')
+REMOVE = ord('R')
+COMPONENT_OF = ord('Q')
+SAME_COMPONENT = ord('S')
+ADD_NODE = ord('N')
+REMOVE_NODE = ord('D')
+
+KIND_NAMES = { ADD: 'add', REMOVE: 'remove', COMPONENT_OF: 'component_of', SAME_COMPONENT: 'same_component',
+  ADD_NODE: 'add_node', REMOVE_NODE: 'remove_node' }
+
+def write_varint(out, n):
+  """
+  Appends a non-negative integer as a LEB128 varint
+  @param out: a bytearray
+  @param n: the integer
+  """
+  while n >= 0x80:
+    out.append((n & 0x7f) | 0x80)
+    n >>= 7
+  out.append(n)
+
+def read_varint(data, offset):
+  """
+  @param data: a bytearray
+  @param offset: where the varint starts
+  @return the integer and the offset after it
+  """
+  n, shift = 0, 0
+  while True:
+    byte = data[offset]
+    offset += 1
+    n |= (byte & 0x7f) << shift
+    if byte < 0x80:
+      return n, offset
+    shift += 7
+
+class TraceRecorder:
+  """
+  Appends every batch and query made on a graph to a trace file. Attach it to
+  a fd_graph.Graph by setting graph.recorder.
+  """
+  def __init__(self, path, buffer_size=1 << 16):
+    """
+    @param path: the trace file to create
+    @param buffer_size: bytes buffered before they are written out
+    """
+    self.file = open(path, 'wb')
+    self.file.write(MAGIC)
+    self.buffer = bytearray()
+    self.buffer_size = buffer_size
+    self.ids = {}             # Maps Node to its id in the trace
+    self.last = time.time()
+
+  def node_id(self, node):
+    if node not in self.ids:
+      self.ids[node] = len(self.ids)
+    return self.ids[node]
+
+  def record_batch(self, kind, edge_set):
+    """
+    O(|edge_set|) time
+    @param kind: ADD or REMOVE
+    @param edge_set: the edges of the batch
+    """
+    self.__header(kind)
+    write_varint(self.buffer, len(edge_set))
+    for edge in edge_set:
+      s_node, e_node = edge.nodes
+      write_varint(self.buffer, self.node_id(s_node))
+      write_varint(self.buffer, self.node_id(e_node))
+    self.__maybe_flush()
+
+  def record_query(self, kind, nodes):
+    """
+    @param kind: COMPONENT_OF or SAME_COMPONENT
+    @param nodes: the queried nodes
+    """
+    self.__header(kind)
+    for node in nodes:
+      write_varint(self.buffer, self.node_id(node))
+    self.__maybe_flush()
+
+  def record_node(self, kind, node):
+    """
+    @param kind: ADD_NODE or REMOVE_NODE
+    @param node: the added or removed node
+    """
+    self.__header(kind)
+    write_varint(self.buffer, self.node_id(node))
+    self.__maybe_flush()
+
+  def flush(self):
+    self.file.write(self.buffer)
+    self.file.flush()
+    del self.buffer[:]
+
+  def close(self):
+    self.flush()
+    self.file.close()
+
+  def __header(self, kind):
+    now = time.time()
+    self.buffer.append(kind)
+    write_varint(self.buffer, max(0, int((now - self.last) * 1e6)))
+    self.last = now
+
+  def __maybe_flush(self):
+    if len(self.buffer) >= self.buffer_size:
+      self.flush()
+
+class RecordBuffer:
+  """
+  Stands in for a TraceRecorder during a transaction: holds the batches and
+  queries until the transaction commits, and drops them if it rolls back
+  """
+  def __init__(self):
+    self.records = []         # (method name, kind, arguments) tuples
+
+  def record_batch(self, kind, edge_set):
+    self.records.append(('record_batch', kind, list(edge_set)))
+
+  def record_query(self, kind, nodes):
+    self.records.append(('record_query', kind, tuple(nodes)))
+
+  def record_node(self, kind, node):
+    self.records.append(('record_node', kind, node))
+
+  def replay(self, recorder):
+    """
+    @param recorder: the TraceRecorder to write the held records to
+    """
+    for method, kind, args in self.records:
+      getattr(recorder, method)(kind, args)
+    self.records = []
+
+def read_trace(path):
+  """
+  Iterates over the records of a trace
+  @param path: a trace file
+  @return a generator of (kind, seconds since the first record, node ids) tuples;
+          for ADD/REMOVE the ids are a flat tuple of (source, target) pairs
+  """
+  with open(path, 'rb') as trace:
+    data = bytearray(trace.read())
+  if str(data[:len(MAGIC)]) != MAGIC:
+    raise IOError('Not a trace file: %s' % path)
+
+  offset, clock, first = len(MAGIC), 0, True
+  while offset < len(data):
+    kind = data[offset]
+    delta, offset = read_varint(data, offset + 1)
+    clock = 0 if first else clock + delta
+    first = False
+    if kind == ADD or kind == REMOVE:
+      count, offset = read_varint(data, offset)
+      count *= 2
+    elif kind == COMPONENT_OF or kind == ADD_NODE or kind == REMOVE_NODE:
+      count = 1
+    elif kind == SAME_COMPONENT:
+      count = 2
+    else:
+      raise IOError('Unknown record kind %d at offset %d' % (kind, offset - 1))
+    ids = []
+    for i in xrange(count):
+      node_id, offset = read_varint(data, offset)
+      ids.append(node_id)
+    yield kind, clock / 1e6, tuple(ids)
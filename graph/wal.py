@@ -0,0 +1,408 @@
+# See https://wiki.python.org/moin/TimeComplexity for running times
+### WRITE-AHEAD LOG AND CHECKPOINTS, for crash-safe incremental SCC maintenance ###
+import cPickle as pickle
+import os
+import struct
+import threading
+import time
+import zlib
+
+import fd_graph
+
+# fsync policies
+FSYNC_ALWAYS = 'always'       # Every commit is on disk when it returns
+FSYNC_INTERVAL = 'interval'   # Commits reach the OS; fsync at most once per interval
+FSYNC_NEVER = 'never'         # Commits reach the OS; the OS decides when to write back
+
+# Record types
+RECORD_NODE = 'N'             # Node definition: node id + pickled node value
+RECORD_ADD = 'A'              # An optimized_add_edges batch: pairs of node ids
+RECORD_REMOVE = 'R'           # An optimized_remove_edges batch: pairs of node ids
+RECORD_ABORT = 'X'            # A batch that failed to apply and was rolled back: its LSN
+
+RECORD_HEADER = struct.Struct('<IIQ')       # payload length, payload crc32, lsn
+CHECKPOINT_HEADER = struct.Struct('<II')    # payload length, payload crc32
+
+LOG_FILE = 'wal.log'
+CHECKPOINT_FILE = 'checkpoint'
+
+def crc32(data):
+  return zlib.crc32(data) & 0xffffffff
+
+def fsync_directory(directory):
+  """
+  Makes a rename or file creation inside the directory durable
+  @param directory: path of the directory
+  """
+  fd = os.open(directory, os.O_RDONLY)
+  try:
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+
+class WriteAheadLog:
+  """
+  Append-only log of records, each identified by a log sequence number (LSN).
+
+  Appends are buffered in memory; commit() makes every record up to an LSN
+  durable. Concurrent committers are grouped: one thread (the leader) writes
+  and syncs everything buffered so far, and every other committer whose record
+  was part of that write returns without issuing its own fsync.
+  """
+  def __init__(self, path, fsync=FSYNC_ALWAYS, group_delay=0.0, group_size=64,
+               fsync_interval=1.0, start_lsn=0):
+    """
+    @param path: the log file; created if missing, torn tail records are truncated
+    @param fsync: one of FSYNC_ALWAYS, FSYNC_INTERVAL or FSYNC_NEVER
+    @param group_delay: seconds a commit leader waits for more records to join its group
+    @param group_size: number of buffered records that ends the group delay early
+    @param fsync_interval: seconds between fsyncs under FSYNC_INTERVAL
+    @param start_lsn: LSNs handed out will be greater than this (e.g. a checkpoint's LSN)
+    """
+    self.path = path
+    self.fsync = fsync
+    self.group_delay, self.group_size = group_delay, group_size
+    self.fsync_interval = fsync_interval
+    self.lock = threading.Lock()
+    self.flushed = threading.Condition(self.lock)
+    self.buffer = []              # Encoded records that have not been written yet
+    self.flushing = False         # Whether a group leader is currently writing
+    self.last_fsync = time.time()
+
+    last_lsn, valid_end = self.__scan()
+    self.next_lsn = max(start_lsn, last_lsn) + 1
+    self.durable_lsn = self.next_lsn - 1
+    self.file = open(path, 'ab')
+    if self.file.tell() > valid_end:
+      # Drop a record torn by a crash in the middle of a write
+      self.file.truncate(valid_end)
+      self.file.seek(valid_end)
+
+  def append(self, records):
+    """
+    Buffers records so they are written contiguously and in order
+    @param records: a list of (record type, body) tuples
+    @return the LSN of the last record
+    """
+    with self.lock:
+      for kind, body in records:
+        payload = kind + body
+        self.buffer.append(RECORD_HEADER.pack(len(payload), crc32(payload), self.next_lsn) + payload)
+        self.next_lsn += 1
+      if len(self.buffer) >= self.group_size:
+        self.flushed.notify_all()
+      return self.next_lsn - 1
+
+  def commit(self, lsn):
+    """
+    Blocks until every record up to lsn is written (and synced, per the fsync policy)
+    @param lsn: a LSN returned by append()
+    """
+    with self.lock:
+      while self.durable_lsn < lsn:
+        if self.flushing:
+          self.flushed.wait()
+          continue
+
+        # Become the group leader; wait a little for other committers to join
+        self.flushing = True
+        try:
+          if self.group_delay > 0 and len(self.buffer) < self.group_size:
+            self.flushed.wait(self.group_delay)
+          records, self.buffer = self.buffer, []
+          group_lsn = self.next_lsn - 1
+          self.lock.release()
+          try:
+            self.__write(records)
+          finally:
+            self.lock.acquire()
+          self.durable_lsn = group_lsn
+        finally:
+          self.flushing = False
+          self.flushed.notify_all()
+
+  def sync(self):
+    """
+    Writes and fsyncs everything appended so far, regardless of the fsync policy
+    """
+    self.commit(self.next_lsn - 1)
+    with self.lock:
+      os.fsync(self.file.fileno())
+      self.last_fsync = time.time()
+
+  def records(self):
+    """
+    Iterates over the records currently on disk, stopping at a torn tail
+    @return a generator of (lsn, record type, body) tuples
+    """
+    with open(self.path, 'rb') as log:
+      while True:
+        header = log.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+          return
+        length, checksum, lsn = RECORD_HEADER.unpack(header)
+        payload = log.read(length)
+        if len(payload) < length or crc32(payload) != checksum:
+          return
+        yield lsn, payload[0], payload[1:]
+
+  def truncate(self):
+    """
+    Drops every record in the log; the caller must have checkpointed them first.
+    LSNs keep increasing across truncations.
+    """
+    with self.lock:
+      self.file.close()
+      self.file = open(self.path, 'wb')
+      os.fsync(self.file.fileno())
+
+  def close(self):
+    self.sync()
+    self.file.close()
+
+  def __write(self, records):
+    """
+    Writes a group of encoded records and syncs them according to the fsync policy
+    @param records: a list of encoded records
+    """
+    self.file.write(''.join(records))
+    self.file.flush()
+    now = time.time()
+    if self.fsync == FSYNC_ALWAYS or \
+        (self.fsync == FSYNC_INTERVAL and now - self.last_fsync >= self.fsync_interval):
+      os.fsync(self.file.fileno())
+      self.last_fsync = now
+
+  def __scan(self):
+    """
+    @return the last LSN in the log, and the offset where the valid records end
+    """
+    if not os.path.exists(self.path):
+      return 0, 0
+    last_lsn, valid_end = 0, 0
+    for lsn, kind, body in self.records():
+      last_lsn = lsn
+      valid_end += RECORD_HEADER.size + 1 + len(body)
+    return last_lsn, valid_end
+
+class DurableGraph:
+  """
+  A fd_graph.Graph whose bulk insertions and deletions are logged before they are
+  applied, with periodic checkpoints so that recovery only replays the log tail.
+
+  Nodes are identified in the log and in checkpoints by integer ids, and their
+  values are pickled, so node values must be picklable. After recovery the graph
+  holds new Node objects; self.nodes maps each id to its Node.
+
+  A batch is applied in a transaction after it is logged. If applying it raises,
+  the graph is rolled back and an abort record tells recovery to skip the batch.
+  """
+  def __init__(self, directory, checkpoint_interval=1000, **log_options):
+    """
+    Opens (or creates) a durable graph, recovering any state found in directory
+    @param directory: directory holding the checkpoint and the log
+    @param checkpoint_interval: number of batches between automatic checkpoints,
+                                or None to only checkpoint when asked to
+    @param log_options: fsync policy and group commit options for WriteAheadLog
+    """
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    self.directory = directory
+    self.checkpoint_interval = checkpoint_interval
+    self.lock = threading.Lock()  # Serializes logging and applying batches
+    self.graph = fd_graph.Graph()
+    self.nodes = {}               # Maps node id to Node
+    self.node_ids = {}            # Maps Node to node id
+    self.next_node_id = 0
+    self.batches = 0              # Batches since the last checkpoint
+
+    checkpoint_lsn = self.__load_checkpoint()
+    self.wal = WriteAheadLog(os.path.join(directory, LOG_FILE), start_lsn=checkpoint_lsn, **log_options)
+    # Abort records follow their batch, so they are collected in a first pass
+    aborted = set(struct.unpack('<Q', body)[0] for lsn, kind, body in self.wal.records() if kind == RECORD_ABORT)
+    for lsn, kind, body in self.wal.records():
+      if lsn > checkpoint_lsn and lsn not in aborted:
+        self.__replay(kind, body)
+
+  def optimized_add_edges(self, edge_set):
+    """
+    Logs then applies a bulk insertion; durable (per the fsync policy) on return
+    @param edge_set: a set of edges to be added to the graph
+    """
+    with self.lock:
+      lsn = self.__log_batch(RECORD_ADD, edge_set)
+      self.__apply(lsn, self.graph.optimized_add_edges, edge_set)
+    self.__commit(lsn)
+
+  def optimized_remove_edges(self, edge_set):
+    """
+    Logs then applies a bulk removal; durable (per the fsync policy) on return
+    @param edge_set: a set of edges to be removed
+    """
+    with self.lock:
+      lsn = self.__log_batch(RECORD_REMOVE, edge_set)
+      self.__apply(lsn, self.graph.optimized_remove_edges, edge_set)
+    self.__commit(lsn)
+
+  def checkpoint(self):
+    """
+    Snapshots the graph and its components, then truncates the log.
+    O(|V|+|E|) time
+    """
+    with self.lock:
+      lsn = self.wal.next_lsn - 1
+      self.wal.commit(lsn)
+      self.__write_checkpoint(lsn)
+      self.wal.truncate()
+      self.batches = 0
+
+  def close(self):
+    self.wal.close()
+
+  #######################
+  ### PRIVATE METHODS ###
+  #######################
+  def __commit(self, lsn):
+    """
+    Waits for the batch to be durable and checkpoints if it is time to
+    @param lsn: the LSN of the batch record
+    """
+    self.wal.commit(lsn)
+    self.batches += 1
+    if self.checkpoint_interval is not None and self.batches >= self.checkpoint_interval:
+      self.checkpoint()
+
+  def __apply(self, lsn, method, edge_set):
+    """
+    Applies a logged batch in a transaction; if it raises, the graph is rolled back
+    and the batch is aborted in the log before the exception is re-raised
+    @param lsn: the LSN of the batch record
+    @param method: the bulk method of the graph applying the batch
+    @param edge_set: the edges of the batch
+    """
+    try:
+      with self.graph.transaction():
+        method(edge_set)
+    except:
+      self.wal.commit(self.wal.append([(RECORD_ABORT, struct.pack('<Q', lsn))]))
+      raise
+
+  def __node_id(self, node, records):
+    """
+    @param node: a Node object
+    @param records: pending log records; a definition is added for unseen nodes
+    @return the id of the node
+    """
+    if node not in self.node_ids:
+      node_id = self.next_node_id
+      self.next_node_id += 1
+      self.node_ids[node], self.nodes[node_id] = node_id, node
+      records.append((RECORD_NODE, struct.pack('<Q', node_id) + pickle.dumps(node.value, 2)))
+    return self.node_ids[node]
+
+  def __log_batch(self, kind, edge_set):
+    """
+    Appends a batch (and any new node definitions) to the log
+    @param kind: RECORD_ADD or RECORD_REMOVE
+    @param edge_set: the edges of the batch
+    @return the LSN of the batch record
+    """
+    records, ids = [], []
+    for edge in edge_set:
+      s_node, e_node = edge.nodes
+      ids.append(self.__node_id(s_node, records))
+      ids.append(self.__node_id(e_node, records))
+    records.append((kind, struct.pack('<I%dQ' % len(ids), len(ids) // 2, *ids)))
+    return self.wal.append(records)
+
+  def __replay(self, kind, body):
+    """
+    Re-applies a logged record through the incremental paths
+    @param kind: the record type
+    @param body: the record body
+    """
+    if kind == RECORD_NODE:
+      node_id, = struct.unpack_from('<Q', body)
+      node = fd_graph.Node(pickle.loads(body[8:]))
+      self.node_ids[node], self.nodes[node_id] = node_id, node
+      self.next_node_id = max(self.next_node_id, node_id + 1)
+      return
+
+    if kind not in (RECORD_ADD, RECORD_REMOVE):
+      return
+    count, = struct.unpack_from('<I', body)
+    ids = struct.unpack_from('<%dQ' % (2 * count), body, 4)
+    edge_set = set(fd_graph.Edge(self.nodes[ids[i]], self.nodes[ids[i+1]]) for i in xrange(0, len(ids), 2))
+    try:
+      with self.graph.transaction():
+        if kind == RECORD_ADD:
+          self.graph.optimized_add_edges(edge_set)
+        else:
+          self.graph.optimized_remove_edges(edge_set)
+    except Exception:
+      # A batch that failed when it was first applied, and whose abort record
+      # was lost in a crash: it was rolled back then, so it is skipped now
+      pass
+
+  def __write_checkpoint(self, lsn):
+    """
+    Atomically replaces the checkpoint with a snapshot of the current graph.
+    Nodes that are no longer in the graph are forgotten, and get a new id
+    if they come back.
+    @param lsn: the LSN of the last record reflected in the graph
+    """
+    G = self.graph
+    nodes = G.get_nodes()
+    for node in self.node_ids.keys():
+      if node not in nodes:
+        del self.nodes[self.node_ids.pop(node)]
+
+    edges = []
+    for s_node in G.edges:
+      for e_node in G.edges[s_node]:
+        edges.append(self.node_ids[s_node])
+        edges.append(self.node_ids[e_node])
+    state = {
+      'lsn': lsn,
+      'scc_num': G.scc_num,
+      'next_node_id': self.next_node_id,
+      'nodes': [(node_id, node.value) for node_id, node in self.nodes.items()],
+      'edges': edges,
+      'labels': [(self.node_ids[node], scc) for node, scc in G.inverse_components.items()],
+    }
+    payload = pickle.dumps(state, 2)
+
+    path = os.path.join(self.directory, CHECKPOINT_FILE)
+    with open(path + '.tmp', 'wb') as snapshot:
+      snapshot.write(CHECKPOINT_HEADER.pack(len(payload), crc32(payload)))
+      snapshot.write(payload)
+      snapshot.flush()
+      os.fsync(snapshot.fileno())
+    os.rename(path + '.tmp', path)
+    fsync_directory(self.directory)
+
+  def __load_checkpoint(self):
+    """
+    Rebuilds the graph and its components from the checkpoint, if there is one
+    @return the LSN of the checkpoint, or 0 if there is none
+    """
+    path = os.path.join(self.directory, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+      return 0
+    with open(path, 'rb') as snapshot:
+      length, checksum = CHECKPOINT_HEADER.unpack(snapshot.read(CHECKPOINT_HEADER.size))
+      payload = snapshot.read(length)
+    if len(payload) < length or crc32(payload) != checksum:
+      raise IOError('Corrupt checkpoint: %s' % path)
+    state = pickle.loads(payload)
+
+    for node_id, value in state['nodes']:
+      node = fd_graph.Node(value)
+      self.node_ids[node], self.nodes[node_id] = node_id, node
+    self.next_node_id = state['next_node_id']
+    edges = state['edges']
+    for i in xrange(0, len(edges), 2):
+      self.graph.add_edge(fd_graph.Edge(self.nodes[edges[i]], self.nodes[edges[i+1]]))
+    labels = dict((self.nodes[node_id], scc) for node_id, scc in state['labels'])
+    self.graph.restore_scc(labels, state['scc_num'])
+    return state['lsn']
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# Replays a trace recorded from a fd_graph.Graph (see graph/trace.py) against the
+# basic_graph, fd_graph or rz_graph implementation, either at the recorded pace or
+# as fast as possible, and reports the latency of every batch and query. The same
+# trace always drives the same sequence of operations, so a slow window seen in
+# production can be reproduced and compared across implementations and commits.
+import argparse
+import json
+import sys
+import threading
+import time
+import traceback
+
+from benchmark import IMPLEMENTATIONS
+from graph import trace
+from graph.timer import percentile
+
+def replay(impl, path, speed='max'):
+  """
+  @param impl: a key of benchmark.IMPLEMENTATIONS
+  @param path: the trace file
+  @param speed: 'recorded' to wait between records as in the trace, or 'max'
+  @return a result dictionary
+  """
+  adapter = IMPLEMENTATIONS[impl]()
+  operations = []           # (record index, trace time, kind, size, seconds)
+  lag = 0.0                 # How far behind the recorded schedule the replay fell
+  incident = {}             # Maps node id to the (u, v) pairs of its edges in the graph
+  start = time.time()
+  for index, (kind, clock, ids) in enumerate(trace.read_trace(path)):
+    if speed == 'recorded':
+      delay = start + clock - time.time()
+      if delay > 0:
+        time.sleep(delay)
+      else:
+        lag = max(lag, -delay)
+    if kind == trace.ADD or kind == trace.REMOVE:
+      op = 'add' if kind == trace.ADD else 'remove'
+      pairs = zip(ids[0::2], ids[1::2])
+      edge_set = adapter.prepare(op, pairs)
+      began = time.time()
+      adapter.apply(op, edge_set)
+      size = len(edge_set)
+      for pair in pairs:
+        for node_id in pair:
+          if kind == trace.ADD:
+            incident.setdefault(node_id, set()).add(pair)
+          else:
+            incident.get(node_id, set()).discard(pair)
+    elif kind == trace.ADD_NODE:
+      began = time.time()
+      adapter.add_node(ids[0])
+      size = 1
+    elif kind == trace.REMOVE_NODE:
+      pairs = sorted(incident.pop(ids[0], ()))
+      for pair in pairs:
+        for node_id in pair:
+          if node_id != ids[0]:
+            incident[node_id].discard(pair)
+      began = time.time()
+      adapter.remove_node(ids[0], pairs)
+      size = len(pairs)
+    else:
+      nodes = [adapter.node(node_id) for node_id in ids]
+      began = time.time()
+      if kind == trace.COMPONENT_OF:
+        adapter.component_of(*nodes)
+      else:
+        adapter.same_component(*nodes)
+      size = 1
+    operations.append((index, clock, kind, size, time.time() - began))
+
+  result = { 'impl': impl, 'trace': path, 'speed': speed, 'records': len(operations), 'lag_ms': lag * 1000 }
+  for kind, name in trace.KIND_NAMES.items():
+    latencies = sorted(seconds for index, clock, k, size, seconds in operations if k == kind)
+    if len(latencies) == 0:
+      continue
+    result[name] = {
+      'count': len(latencies),
+      'items': sum(size for index, clock, k, size, seconds in operations if k == kind),
+      'seconds': sum(latencies),
+      'p50_ms': percentile(latencies, 50) * 1000,
+      'p99_ms': percentile(latencies, 99) * 1000,
+      'max_ms': latencies[-1] * 1000,
+    }
+  result['batches'] = [
+    { 'record': index, 'time': clock, 'op': trace.KIND_NAMES[kind], 'edges': size, 'ms': seconds * 1000 }
+    for index, clock, kind, size, seconds in operations if kind == trace.ADD or kind == trace.REMOVE
+  ]
+  return result
+
+def main():
+  parser = argparse.ArgumentParser(description='Replay a recorded trace against the graph implementations')
+  parser.add_argument('trace', help='a trace file written by graph.trace.TraceRecorder')
+  parser.add_argument('--impls', default='fd', help='comma-separated subset of %s' % ','.join(sorted(IMPLEMENTATIONS)))
+  parser.add_argument('--speed', choices=['recorded', 'max'], default='max')
+  parser.add_argument('--slowest', type=int, default=10, help='number of slowest batches to print')
+  parser.add_argument('--output', help='write the results, with every batch latency, as JSON to this file')
+  args = parser.parse_args()
+
+  # The traversals are recursive, so replay on a thread with a large stack
+  sys.setrecursionlimit(1 << 20)
+  threading.stack_size(512 * 1024 * 1024)
+  results = []
+  for impl in args.impls.split(','):
+    def work():
+      try:
+        results.append(replay(impl, args.trace, args.speed))
+      except Exception:
+        results.append({ 'impl': impl, 'error': traceback.format_exc().strip().splitlines()[-1] })
+    thread = threading.Thread(target=work)
+    thread.start()
+    thread.join()
+    result = results[-1]
+
+    if 'error' in result:
+      print "%s: ERROR %s" % (impl, result['error'])
+      continue
+    print "%s: %d records, lag %.3f ms" % (impl, result['records'], result['lag_ms'])
+    for name in sorted(trace.KIND_NAMES.values()):
+      if name in result:
+        stats = result[name]
+        print "  %-15s %8d ops  p50 %9.3f ms  p99 %9.3f ms  max %9.3f ms" % \
+          (name, stats['count'], stats['p50_ms'], stats['p99_ms'], stats['max_ms'])
+    for batch in sorted(result['batches'], key=lambda batch: -batch['ms'])[:args.slowest]:
+      print "  slow: record %-8d t=%10.3f s  %-6s %6d edges  %9.3f ms" % \
+        (batch['record'], batch['time'], batch['op'], batch['edges'], batch['ms'])
+
+  if args.output:
+    with open(args.output, 'w') as output:
+      json.dump({ 'results': results }, output, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+  main()
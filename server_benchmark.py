@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# Load generator for graph/server.py: N client threads issue a random mix of
+# updates and queries, then throughput and latency percentiles are printed.
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from graph.client import Client
+from graph.server import GraphServer
+from graph.timer import percentile
+
+READ_OPS = ['same_component', 'component_of', 'reachable']
+
+def run_client(address, args, seed, latencies):
+  """
+  Issues requests until the deadline, recording (op, seconds) latencies
+  """
+  rand = random.Random(seed)
+  client = Client(address)
+  inserted = []
+  deadline = time.time() + args.duration
+  while time.time() < deadline:
+    if rand.random() < args.write_ratio:
+      if len(inserted) > args.batch and rand.random() < args.delete_ratio:
+        rand.shuffle(inserted)
+        op, edges, inserted = 'delete', inserted[:args.batch], inserted[args.batch:]
+      else:
+        op = 'insert'
+        edges = [(rand.randrange(args.nodes), rand.randrange(args.nodes)) for i in xrange(args.batch)]
+        inserted.extend(edges)
+      start = time.time()
+      getattr(client, op)(edges)
+    else:
+      op = rand.choice(READ_OPS)
+      u, v = rand.randrange(args.nodes), rand.randrange(args.nodes)
+      start = time.time()
+      if op == 'component_of':
+        client.component_of(u)
+      else:
+        getattr(client, op)(u, v)
+    latencies.append((op, time.time() - start))
+  client.close()
+
+def main():
+  parser = argparse.ArgumentParser(description='Load generator for the graph server')
+  parser.add_argument('--address', help='host:port or Unix socket of a running server (default: start one)')
+  parser.add_argument('--clients', type=int, default=8)
+  parser.add_argument('--duration', type=float, default=5.0, help='seconds to run')
+  parser.add_argument('--nodes', type=int, default=10000, help='size of the node id space')
+  parser.add_argument('--batch', type=int, default=4, help='edges per update request')
+  parser.add_argument('--write-ratio', type=float, default=0.2)
+  parser.add_argument('--delete-ratio', type=float, default=0.3, help='share of updates that are deletions')
+  parser.add_argument('--window', type=float, default=0.002, help='coalescing window of the local server')
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+
+  server = None
+  if args.address is None:
+    address = os.path.join(tempfile.mkdtemp(), 'graph.sock')
+    server = GraphServer(address, window=args.window)
+    server.start()
+  elif ':' in args.address:
+    host, port = args.address.rsplit(':', 1)
+    address = (host, int(port))
+  else:
+    address = args.address
+
+  latencies, threads = [], []
+  for i in xrange(args.clients):
+    threads.append(threading.Thread(target=run_client, args=(address, args, args.seed + i, latencies)))
+  start = time.time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  elapsed = time.time() - start
+  if server is not None:
+    server.shutdown()
+
+  print "%d requests in %.2f s (%.0f req/s)" % (len(latencies), elapsed, len(latencies) / elapsed)
+  for op in ['insert', 'delete'] + READ_OPS:
+    samples = sorted(secs for name, secs in latencies if name == op)
+    print "%-15s %8d  p50 %8.3f ms  p99 %8.3f ms" % \
+      (op, len(samples), percentile(samples, 50) * 1000, percentile(samples, 99) * 1000)
+  if server is not None:
+    print "Batches applied: %d" % server.coalescer.version
+
+if __name__ == '__main__':
+  main()